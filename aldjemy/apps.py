@@ -1,32 +1,145 @@
-from django.apps import AppConfig
+import contextlib
+import warnings
+from importlib import import_module
+
+from django.apps import AppConfig, apps
 from django.conf import settings
+from django.core.signals import request_finished
 from django.db import router
 from django.db.backends import signals
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, select
 
-from .orm import construct_models
-from .session import get_session
+from .metadata_cache import load_metadata
+from .orm import LazyModels, construct_models
+from .session import (
+    get_routing_session,
+    get_session,
+    stream_partitions,
+    unpin_routing_session,
+)
 
 
 def new_session(sender, connection, **kwargs):
-    """Create a new session for the given connection."""
-    if connection.alias in settings.DATABASES:
-        get_session(alias=connection.alias, recreate=True)
+    """Drop the sessions of a new connection, ``get_session`` creates them.
+
+    Requests that don't use SQLAlchemy don't pay for a session.
+    """
+    vars(connection).pop("sa_session", None)
+    vars(connection).pop("sa_routing_session", None)
+
+
+# Statements of ``BaseSQLAModel.cached``, by model and key
+_statements = {}
 
 
 class BaseSQLAModel:
+    @classmethod
+    def get_session(cls):
+        if getattr(settings, "ALDJEMY_ROUTING_SESSION", False):
+            return get_routing_session()
+        return get_session(getattr(cls, "__alias__", "default"))
+
     @classmethod
     def query(cls, *args, **kwargs):
-        alias = getattr(cls, "__alias__", "default")
         if args or kwargs:
-            return get_session(alias).query(*args, **kwargs)
-        return get_session(alias).query(cls)
+            return cls.get_session().query(*args, **kwargs)
+        return cls.get_session().query(cls)
+
+    @classmethod
+    def cached(cls, key, builder):
+        """Return the statement built by calling ``builder``, once per process.
+
+        Values changing between executions are given with ``bindparam`` and
+        passed as parameters, the compiled statement is then found in the
+        engine's cache without building the statement or its cache key again.
+        """
+        try:
+            return _statements[cls, key]
+        except KeyError:
+            return _statements.setdefault((cls, key), builder())
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        from .querysets import select_from_queryset
+
+        return select_from_queryset(cls, queryset)
+
+    @classmethod
+    def hydrate(cls, rows, using=None):
+        from .hydrate import hydrate
+
+        return hydrate(cls, rows, using=using)
+
+    @classmethod
+    def stream(cls, statement=None, params=None, chunk_size=1000):
+        """Iterate over the results of a statement in bounded memory.
+
+        Without a statement, iterate over all the instances of the model.
+        """
+        entities = statement is None
+        if entities:
+            statement = select(cls)
+        partitions = stream_partitions(cls.get_session(), statement, params, chunk_size)
+        with contextlib.closing(partitions):
+            for partition in partitions:
+                if entities:
+                    yield from (row[0] for row in partition)
+                else:
+                    yield from partition
+
+    @classmethod
+    def fetch_columns(cls, statement, params=None, chunk_size=10000):
+        from .columnar import fetch_columns
+
+        return fetch_columns(cls, statement, params=params, chunk_size=chunk_size)
+
+    @classmethod
+    def bulk_insert(cls, rows, chunk_size=1000, return_pks=False):
+        from .bulk import bulk_insert
+
+        return bulk_insert(cls, rows, chunk_size=chunk_size, return_pks=return_pks)
+
+    @classmethod
+    def upsert(
+        cls,
+        rows,
+        conflict_columns,
+        update_columns=None,
+        chunk_size=1000,
+        return_pks=False,
+    ):
+        from .bulk import upsert
+
+        return upsert(
+            cls,
+            rows,
+            conflict_columns,
+            update_columns=update_columns,
+            chunk_size=chunk_size,
+            return_pks=return_pks,
+        )
+
+    @classmethod
+    def copy_from(cls, rows, columns=None):
+        from .pgcopy import copy_from
+
+        return copy_from(cls, rows, columns=columns)
+
+    @classmethod
+    def copy_to(cls, statement, file, format="text"):
+        from .pgcopy import copy_to
+
+        return copy_to(cls, statement, file, format=format)
 
 
-def _make_sa_model(model):
-    """Create a custom class for the SQLAlchemy model."""
+def _make_sa_model(model, parent=None):
+    """Create a custom class for the SQLAlchemy model.
+
+    ``parent`` is the class of the parent model, for inheritance.
+    """
     mixin = getattr(model, "aldjemy_mixin", None)
-    bases = (mixin, BaseSQLAModel) if mixin else (BaseSQLAModel,)
+    base = parent or BaseSQLAModel
+    bases = (mixin, base) if mixin and not issubclass(base, mixin) else (base,)
 
     # because querying happens on sqlalchemy side, we can use only one
     # type of queries for alias, so we use 'read' type
@@ -35,19 +148,81 @@ def _make_sa_model(model):
         bases,
         {
             "__alias__": router.db_for_read(model),
+            "__model__": model,
             "__module__": model.__module__,
         },
     )
 
 
+class LazySAModel:
+    """Descriptor constructing the SQLAlchemy model on first access."""
+
+    def __init__(self, lazy_models, model):
+        self.lazy_models = lazy_models
+        self.model = model
+
+    def __get__(self, instance, owner):
+        sa_model = self.lazy_models.get(self.model)
+        # Later lookups find the model directly instead of this descriptor
+        self.model.sa = sa_model
+        return sa_model
+
+
+def use_generated(package):
+    """Set ``Model.sa`` to the models of the modules of ``aldjemy_codegen``."""
+    sa_models = import_module(package + ".models").MODELS
+    stale = []
+    for label, sa_model in sa_models.items():
+        try:
+            model = apps.get_model(label)
+        except LookupError:
+            stale.append(label)
+        else:
+            model.sa = sa_model
+            sa_model.__model__ = model
+    stale += [
+        model._meta.label_lower
+        for model in apps.get_models(include_auto_created=True)
+        if not model._meta.proxy and model._meta.label_lower not in sa_models
+    ]
+    if stale:
+        warnings.warn(
+            "The models generated in %s are out of date (%s), "
+            "run the aldjemy_codegen command." % (package, ", ".join(stale)),
+            RuntimeWarning,
+        )
+
+
 class AldjemyConfig(AppConfig):
     name = "aldjemy"
     verbose_name = "Aldjemy"
 
     def ready(self):
+        generated = getattr(settings, "ALDJEMY_USE_GENERATED", None)
+        metadata, plans = MetaData(), None
+        cache_dir = getattr(settings, "ALDJEMY_METADATA_CACHE", None)
+        if cache_dir and not generated:
+            metadata, plans = load_metadata(cache_dir)
+
         # Patch models with SQLAlchemy models
-        models = construct_models(MetaData(), _make_sa_model=_make_sa_model)
-        for model, sa_model in models.items():
-            model.sa = sa_model
+        if generated:
+            use_generated(generated)
+        elif getattr(settings, "ALDJEMY_LAZY", False):
+            lazy_models = LazyModels(
+                metadata, plans=plans, _make_sa_model=_make_sa_model
+            )
+            for model in lazy_models.models:
+                model.sa = LazySAModel(lazy_models, model)
+        else:
+            models = construct_models(
+                metadata, plans=plans, _make_sa_model=_make_sa_model
+            )
+            for model, sa_model in models.items():
+                model.sa = sa_model
 
         signals.connection_created.connect(new_session)
+        request_finished.connect(unpin_routing_session)
+        if getattr(settings, "ALDJEMY_RESULT_CACHE", None):
+            from . import result_cache
+
+            result_cache.install()
@@ -0,0 +1,176 @@
+"""Bulk insert and upsert of rows with the generated tables.
+
+The statements run on the Django connection of the write database through
+``DjangoPool``, so they are part of the current ``atomic()`` block.
+"""
+
+import itertools
+import types
+
+from django.db import models, router
+from sqlalchemy import insert
+
+from .core import get_engine
+
+__all__ = ["bulk_insert", "upsert"]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class _RowConverter:
+    """Turn dicts and model instances into dicts of column values.
+
+    Dicts may be keyed by field name, attname or column name. Fields with a
+    default which are missing from a dict get their default value, and
+    fields with ``auto_now`` or ``auto_now_add`` get the current time, like
+    model instances when they are saved.
+    """
+
+    def __init__(self, model, table):
+        self.fields = [f for f in model._meta.concrete_fields if f.column in table.c]
+        self.columns = {}
+        for f in self.fields:
+            self.columns[f.name] = self.columns[f.attname] = f.column
+            self.columns[f.column] = f.column
+        self.defaults = [
+            f for f in self.fields if f.has_default() and not f.primary_key
+        ]
+        self.auto_now = [
+            f
+            for f in self.fields
+            if getattr(f, "auto_now", False) or getattr(f, "auto_now_add", False)
+        ]
+
+    def column(self, key):
+        return self.columns[key]
+
+    def __call__(self, row):
+        if isinstance(row, models.Model):
+            values = {}
+            for f in self.fields:
+                value = f.pre_save(row, True)
+                if not (value is None and f.primary_key):
+                    values[f.column] = value
+            return values
+        values = {self.columns[key]: value for key, value in row.items()}
+        for f in self.defaults:
+            if f.column not in values:
+                values[f.column] = f.get_default()
+        for f in self.auto_now:
+            # pre_save() sets the value on the instance it is given
+            values[f.column] = f.pre_save(types.SimpleNamespace(), True)
+        return values
+
+
+def _prepare(sa_model, rows, chunk_size):
+    model = sa_model.__model__
+    table = sa_model.__table__
+    converter = _RowConverter(model, table)
+    engine = get_engine(router.db_for_write(model))
+    chunks = _chunks(map(converter, rows), chunk_size)
+    return converter, table, engine, chunks
+
+
+def _execute(connection, statement, chunk, return_pks):
+    pks = []
+    # All the rows of an executemany need the same columns
+    for _, group in itertools.groupby(chunk, key=lambda values: values.keys()):
+        params = list(group)
+        if not return_pks:
+            connection.execute(statement, params)
+        elif connection.dialect.insert_executemany_returning:
+            pk_columns = list(statement.table.primary_key)
+            result = connection.execute(statement.returning(*pk_columns), params)
+            pks.extend(row[0] if len(row) == 1 else tuple(row) for row in result)
+        else:
+            # Without RETURNING, only single row inserts report their keys
+            for values in params:
+                pk = connection.execute(statement, values).inserted_primary_key
+                pks.append(pk[0] if len(pk) == 1 else tuple(pk))
+    return pks
+
+
+def bulk_insert(sa_model, rows, chunk_size=1000, return_pks=False):
+    """Insert rows, which are dicts or model instances, by chunks.
+
+    Return the list of the primary keys of the rows if ``return_pks``,
+    else the number of inserted rows.
+    """
+    _, table, engine, chunks = _prepare(sa_model, rows, chunk_size)
+    pks = []
+    count = 0
+    with engine.begin() as connection:
+        for chunk in chunks:
+            pks.extend(_execute(connection, insert(table), chunk, return_pks))
+            count += len(chunk)
+    return pks if return_pks else count
+
+
+def upsert(
+    sa_model,
+    rows,
+    conflict_columns,
+    update_columns=None,
+    chunk_size=1000,
+    return_pks=False,
+):
+    """Insert rows, updating the existing rows conflicting with them.
+
+    Columns are given as field names or column names. ``update_columns``
+    defaults to every inserted column which is not a conflict column or the
+    primary key, an empty list ignores the conflicting rows.
+    ``conflict_columns`` is ignored on MySQL, which updates the rows
+    conflicting on any unique key.
+
+    Return the list of the primary keys of the inserted and updated rows
+    if ``return_pks``, this needs ``RETURNING`` support (PostgreSQL).
+    Else return the number of rows processed.
+    """
+    converter, table, engine, chunks = _prepare(sa_model, rows, chunk_size)
+    conflict_columns = [converter.column(c) for c in conflict_columns]
+    if update_columns is not None:
+        update_columns = [converter.column(c) for c in update_columns]
+    dialect_name = engine.dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+    else:
+        raise NotImplementedError("Upsert is not supported on %s" % dialect_name)
+    if return_pks and not engine.dialect.insert_executemany_returning:
+        raise NotImplementedError("Returning keys needs RETURNING support")
+
+    pks = []
+    count = 0
+    with engine.begin() as connection:
+        for chunk in chunks:
+            columns = update_columns
+            if columns is None:
+                excluded = set(conflict_columns) | {c.name for c in table.primary_key}
+                columns = [c for c in chunk[0] if c not in excluded]
+            statement = dialect_insert(table)
+            if dialect_name == "mysql":
+                if columns:
+                    values = {c: statement.inserted[c] for c in columns}
+                else:
+                    # Updating a column to itself ignores the conflicting row
+                    values = {c.name: c for c in table.primary_key}
+                statement = statement.on_duplicate_key_update(values)
+            elif columns:
+                statement = statement.on_conflict_do_update(
+                    index_elements=conflict_columns,
+                    set_={c: statement.excluded[c] for c in columns},
+                )
+            else:
+                statement = statement.on_conflict_do_nothing(
+                    index_elements=conflict_columns
+                )
+            pks.extend(_execute(connection, statement, chunk, return_pks))
+            count += len(chunk)
+    return pks if return_pks else count
@@ -0,0 +1,697 @@
+"""Write the generated tables and mappings as Python modules.
+
+``generate_modules`` renders the ``Table`` objects of ``generate_tables`` and
+the mappings of ``construct_models`` as the source of a package with a
+``tables`` and a ``models`` module. With the ``ALDJEMY_USE_GENERATED``
+setting naming that package, ``AldjemyConfig.ready()`` imports it instead of
+introspecting the Django models. The modules are written by the
+``aldjemy_codegen`` management command.
+"""
+
+import importlib
+import inspect
+import keyword
+import re
+from decimal import Decimal
+
+import sqlalchemy
+from django.apps import apps
+from django.conf import settings
+from django.db import router
+from sqlalchemy import CheckConstraint, MetaData, UniqueConstraint, types
+from sqlalchemy.sql import elements, functions, operators
+from sqlalchemy.sql.base import ColumnCollection
+
+from .apps import BaseSQLAModel
+from .orm import _get_parent, get_loading, get_model_plan
+from .table import generate_tables
+
+__all__ = ["generate_modules"]
+
+HEADER = '"""Generated by ``manage.py aldjemy_codegen``, do not edit."""\n'
+
+LINE_LENGTH = 88
+
+DIALECTS = ["postgresql", "mysql", "sqlite", "oracle", "mssql"]
+
+COMPARISONS = {
+    operators.eq: "==",
+    operators.ne: "!=",
+    operators.lt: "<",
+    operators.le: "<=",
+    operators.gt: ">",
+    operators.ge: ">=",
+}
+METHODS = {
+    operators.in_op: "in_",
+    operators.not_in_op: "not_in",
+    operators.is_: "is_",
+    operators.is_not: "isnot",
+}
+
+
+def _is_attribute(name):
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+
+def _identifier(name, prefix=""):
+    name = prefix + re.sub(r"\W", "_", name)
+    if not _is_attribute(name):
+        name = "_" + name
+    return name
+
+
+def _unique(name, taken):
+    candidate, number = name, 1
+    while candidate in taken:
+        number += 1
+        candidate = "%s_%d" % (name, number)
+    taken.add(candidate)
+    return candidate
+
+
+def _is_default(value, parameter):
+    default = parameter.default
+    if default is parameter.empty:
+        return False
+    if value is default:
+        return True
+    primitives = (bool, int, float, str)
+    return (
+        type(value) is type(default)
+        and isinstance(value, primitives)
+        and (value == default)
+    )
+
+
+def _resolves(obj):
+    """Return whether an object can be imported by its qualified name."""
+    found = importlib.import_module(obj.__module__)
+    for name in obj.__qualname__.split("."):
+        found = getattr(found, name, None)
+    return found is obj
+
+
+def _sort_key(item):
+    return type(item).__name__, item.name or "", str(item)
+
+
+def _string(value):
+    """Return the literal of a string, with double quotes like black."""
+    literal = repr(value)
+    if literal.startswith("'") and '"' not in value:
+        literal = '"%s"' % literal[1:-1]
+    return literal
+
+
+def _depths(text, depth=0):
+    """Return the bracket depth before each character of a line, and after it.
+
+    The characters of string literals have a depth of None, their brackets
+    and commas are not those of the code.
+    """
+    depths = []
+    quote = None
+    escaped = False
+    for char in text:
+        if quote:
+            depths.append(None)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+            continue
+        depths.append(depth)
+        if char in "\"'":
+            depths[-1] = None
+            quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+    return depths, depth
+
+
+def _split(text, depths, separators):
+    """Split a line before the separators outside of its brackets."""
+    positions = [
+        i for i in range(len(text)) if depths[i] == 0 and text.startswith(separators, i)
+    ]
+    bounds = [0, *positions, len(text)]
+    return [text[a:b].strip() for a, b in zip(bounds, bounds[1:])]
+
+
+def _wrap(text, indent, inside):
+    """Return the lines of a line longer than ``LINE_LENGTH``, like black does.
+
+    A line in brackets is split at its commas, with a trailing comma, or at
+    its comparisons. Otherwise the content of its last brackets goes on its
+    own lines, and is split in turn. The content of a literal is split at
+    its commas even if it fits.
+    """
+    space = " " * indent
+    if indent + len(text) <= LINE_LENGTH:
+        return [space + text]
+    depths, _ = _depths(text)
+    trailing = "," if text.endswith(",") and depths[-1] == 0 else ""
+    if inside:
+        content = text[: len(text) - len(trailing)]
+        items = [item.lstrip(", ") for item in _split(content, depths, ",")]
+        if len(items) > 1:
+            return [line for item in items for line in _wrap(item + ",", indent, True)]
+        parts = _split(text, depths, (" == ", " != ", " < ", " > ", " <= ", " >= "))
+        if len(parts) > 1:
+            return [line for part in parts for line in _wrap(part, indent, True)]
+
+    close = len(text) - len(trailing) - 1
+    if close < 0 or text[close] not in ")]}":
+        return [space + text]
+    openings = [i for i in range(close) if depths[i] == 0 and text[i] in "([{"]
+    if not openings or not text[openings[-1] + 1 : close].strip():
+        return [space + text]
+    start = openings[-1]
+    body = text[start + 1 : close]
+    head, tail = text[: start + 1], text[close:]
+    literal = start == 0 or not (text[start - 1].isalnum() or text[start - 1] in "_)]")
+    body_depths, _ = _depths(body)
+    if literal and 0 in [d for d, c in zip(body_depths, body) if c == ","]:
+        lines = [
+            line
+            for item in _split(body, body_depths, ",")
+            for line in _wrap(item.lstrip(", ") + ",", indent + 4, True)
+        ]
+    else:
+        lines = _wrap(body, indent + 4, True)
+    return [space + head, *lines, space + tail]
+
+
+class _Module:
+    """The source of a generated module, with the imports it needs."""
+
+    def __init__(self, table_names=None):
+        self.imports = set()
+        self.from_imports = {}
+        self.table_names = table_names or {}
+        self.lines = []
+
+    def add_import(self, module, name=None):
+        if name is None:
+            self.imports.add(module)
+        else:
+            self.from_imports.setdefault(module, set()).add(name)
+        return name or module
+
+    def name(self, obj):
+        """Return the expression of a class, importing its module."""
+        module, name = obj.__module__, obj.__qualname__
+        if getattr(types, name, None) is obj:
+            return "%s.%s" % (self.add_import("sqlalchemy", "types"), name)
+        for dialect in DIALECTS:
+            if module.startswith("sqlalchemy.dialects.%s." % dialect):
+                dialect_module = importlib.import_module(
+                    "sqlalchemy.dialects." + dialect
+                )
+                if getattr(dialect_module, name, None) is obj:
+                    self.add_import("sqlalchemy.dialects", dialect)
+                    return "%s.%s" % (dialect, name)
+        return "%s.%s" % (self.add_import(module), name)
+
+    def value(self, value):
+        """Render a value of a type, constraint or mapping argument."""
+        if isinstance(value, types.TypeEngine):
+            return self.type(value)
+        if isinstance(value, type):
+            return self.name(value)
+        if isinstance(value, Decimal):
+            return "%s.Decimal(%s)" % (self.add_import("decimal"), _string(str(value)))
+        if isinstance(value, list):
+            return "[%s]" % ", ".join(self.value(item) for item in value)
+        if isinstance(value, tuple):
+            items = [self.value(item) for item in value]
+            return "(%s)" % (items[0] + "," if len(items) == 1 else ", ".join(items))
+        if isinstance(value, dict):
+            items = sorted(value.items())
+            return "{%s}" % ", ".join(
+                "%s: %s" % (self.value(k), self.value(v)) for k, v in items
+            )
+        if isinstance(value, str):
+            return _string(value)
+        if value is None or isinstance(value, (bool, int, float, bytes)):
+            return repr(value)
+        raise NotImplementedError("Unsupported value %r" % (value,))
+
+    def type(self, typ):
+        """Render a column type like its ``repr``, with importable names."""
+        cls = type(typ)
+        parameters = list(inspect.signature(cls.__init__).parameters.values())[1:]
+        args = []
+        for parameter in parameters:
+            if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+                continue
+            if parameter.name.startswith("_") or not hasattr(typ, parameter.name):
+                continue
+            value = getattr(typ, parameter.name)
+            if not _is_default(value, parameter):
+                args.append("%s=%s" % (parameter.name, self.value(value)))
+        return "%s(%s)" % (self.name(cls), ", ".join(args))
+
+    def column(self, column):
+        table = self.table_names[column.table]
+        key = column.key
+        if _is_attribute(key) and not hasattr(ColumnCollection, key):
+            return "%s.c.%s" % (table, key)
+        return "%s.c[%s]" % (table, _string(key))
+
+    def expression(self, clause):
+        """Render a SQL expression of the columns of the known tables.
+
+        Only the expressions of the conditions of ``table._condition`` and of
+        server defaults are supported, like the statements they come from.
+        """
+        if isinstance(clause, sqlalchemy.Column):
+            return self.column(clause)
+        if isinstance(clause, elements.Grouping):
+            return self.expression(clause.element)
+        if isinstance(clause, elements.BindParameter):
+            return self.value(clause.value)
+        if isinstance(clause, elements.Null):
+            return "None"
+        if isinstance(clause, (elements.True_, elements.False_)):
+            name = "true" if isinstance(clause, elements.True_) else "false"
+            return "%s()" % self.add_import("sqlalchemy", name)
+        if isinstance(clause, elements.BinaryExpression):
+            left = self.expression(clause.left)
+            right = self.expression(clause.right)
+            if clause.operator in COMPARISONS:
+                return "%s %s %s" % (left, COMPARISONS[clause.operator], right)
+            if clause.operator in METHODS:
+                return "%s.%s(%s)" % (left, METHODS[clause.operator], right)
+        if isinstance(clause, elements.BooleanClauseList):
+            name = {operators.and_: "and_", operators.or_: "or_"}[clause.operator]
+            return "%s(%s)" % (
+                self.add_import("sqlalchemy", name),
+                ", ".join(self.expression(c) for c in clause.clauses),
+            )
+        if isinstance(clause, elements.UnaryExpression):
+            if clause.operator is operators.inv:
+                return "%s(%s)" % (
+                    self.add_import("sqlalchemy", "not_"),
+                    self.expression(clause.element),
+                )
+            if clause.modifier in (operators.desc_op, operators.asc_op):
+                name = "desc" if clause.modifier is operators.desc_op else "asc"
+                return "%s.%s()" % (self.expression(clause.element), name)
+        if isinstance(clause, functions.FunctionElement) and not clause.clauses:
+            return "%s.%s()" % (self.add_import("sqlalchemy", "func"), clause.name)
+        raise NotImplementedError("Unsupported expression %r" % (clause,))
+
+    def server_default(self, default):
+        arg = default.arg
+        if isinstance(arg, str):
+            return _string(arg)
+        if isinstance(arg, elements.BindParameter):
+            literal = self.add_import("sqlalchemy", "literal")
+            return "%s(%s)" % (literal, self.value(arg.value))
+        return self.expression(arg)
+
+    def call(self, function, args, split=False):
+        """Render a call, with an argument per line if ``split`` is true.
+
+        Other calls are on one line, ``source()`` wraps them if needed.
+        """
+        if not split:
+            return "%s(%s)" % (function, ", ".join(args))
+        lines = ["%s(" % function]
+        lines.extend("    %s," % arg.replace("\n", "\n    ") for arg in args)
+        lines.append(")")
+        return "\n".join(lines)
+
+    def kwargs(self, **kwargs):
+        return ["%s=%s" % (name, value) for name, value in kwargs.items()]
+
+    def source(self):
+        imports = sorted("import %s" % module for module in self.imports)
+        relative = []
+        for module, names in sorted(self.from_imports.items()):
+            line = "from %s import %s" % (module, ", ".join(sorted(names)))
+            if len(line) > 88:
+                line = "from %s import (\n%s)" % (
+                    module,
+                    "".join("    %s,\n" % name for name in sorted(names)),
+                )
+            (relative if module.startswith(".") else imports).append(line)
+        if relative:
+            relative.insert(0, "")
+        lines = []
+        depth = 0
+        for line in "\n".join(self.lines).split("\n"):
+            text = line.lstrip(" ")
+            lines += _wrap(text, len(line) - len(text), depth > 0)
+            depth = _depths(text, depth)[1]
+        lines = [HEADER, *imports, *relative, "", *lines]
+        return "\n".join(lines).rstrip() + "\n"
+
+
+def _render_column(module, column):
+    args = [_string(column.name), module.type(column.type)]
+    for fk in sorted(column.foreign_keys, key=lambda fk: fk._get_colspec()):
+        fk_args = [_string(fk._get_colspec())]
+        for name in ["name", "onupdate", "ondelete", "deferrable", "initially"]:
+            value = getattr(fk, name)
+            if value is not None:
+                fk_args.append("%s=%s" % (name, module.value(value)))
+        if fk.info:
+            fk_args.append("info=%s" % module.value(dict(fk.info)))
+        name = module.add_import("sqlalchemy", "ForeignKey")
+        args.append(module.call(name, fk_args))
+    if column.primary_key:
+        args.append("primary_key=True")
+    if column.nullable == column.primary_key:
+        args.append("nullable=%r" % column.nullable)
+    if column.unique:
+        args.append("unique=True")
+    if column.index:
+        args.append("index=True")
+    if column.server_default is not None:
+        args.append("server_default=%s" % module.server_default(column.server_default))
+    return module.call(module.add_import("sqlalchemy", "Column"), args)
+
+
+def _render_table(module, table):
+    """Render the ``Table`` of a table, and its check constraints and indexes."""
+    name = module.table_names[table]
+    args = [_string(table.name), "metadata"]
+    args += [_render_column(module, column) for column in table.c]
+    checks = []
+    for constraint in sorted(table.constraints, key=_sort_key):
+        # Those of the columns and types are created by them
+        if getattr(constraint, "_column_flag", False):
+            continue
+        if getattr(constraint, "_type_bound", False):
+            continue
+        kwargs = []
+        if constraint.name:
+            kwargs.append("name=%s" % _string(constraint.name))
+        for option in ["deferrable", "initially"]:
+            if getattr(constraint, option) is not None:
+                value = module.value(getattr(constraint, option))
+                kwargs.append("%s=%s" % (option, value))
+        if isinstance(constraint, UniqueConstraint):
+            columns = [_string(column.name) for column in constraint.columns]
+            function = module.add_import("sqlalchemy", "UniqueConstraint")
+            args.append(module.call(function, columns + kwargs))
+        elif isinstance(constraint, CheckConstraint):
+            checks.append([module.expression(constraint.sqltext)] + kwargs)
+    if table.schema:
+        args.append("schema=%s" % _string(table.schema))
+    function = module.add_import("sqlalchemy", "Table")
+    lines = ["%s = %s" % (name, module.call(function, args, split=True))]
+
+    # The conditions of checks and indexes are expressions of the columns
+    for check in checks:
+        function = module.add_import("sqlalchemy", "CheckConstraint")
+        lines.append("%s.append_constraint(%s)" % (name, module.call(function, check)))
+    for index in sorted(table.indexes, key=_sort_key):
+        if getattr(index, "_column_flag", False):
+            continue
+        args = [_string(index.name)]
+        args += [module.expression(expression) for expression in index.expressions]
+        if index.unique:
+            args.append("unique=True")
+        for option, value in sorted(index.dialect_kwargs.items()):
+            if isinstance(value, elements.ClauseElement):
+                value = module.expression(value)
+            else:
+                value = module.value(value)
+            args.append("%s=%s" % (option, value))
+        lines.append(module.call(module.add_import("sqlalchemy", "Index"), args))
+    return lines
+
+
+def _render_hint(module, python_type):
+    if python_type.__module__ == "builtins":
+        return python_type.__name__
+    return module.name(python_type)
+
+
+def _column_hint(module, column):
+    """Return the type hint of the attribute of a column."""
+    typing = module.add_import("typing")
+    try:
+        if isinstance(column.type, types.JSON):
+            # Any JSON value
+            raise NotImplementedError
+        if isinstance(column.type, types.ARRAY):
+            item_type = column.type.item_type.python_type
+            hint = "%s.List[%s]" % (typing, _render_hint(module, item_type))
+        else:
+            hint = _render_hint(module, column.type.python_type)
+    except NotImplementedError:
+        hint = "%s.Any" % typing
+    if column.nullable:
+        hint = "%s.Optional[%s]" % (typing, hint)
+    return hint
+
+
+def _relationship_hints(module, models, plans, tables, sa_names):
+    """Yield ``(model, name, hint)`` of the relationships and backrefs."""
+    typing = module.add_import("typing")
+    for model in models:
+        table = tables[plans[model]["table"]]
+        for name, rel in plans[model]["relationships"].items():
+            remote = apps.get_model(rel["model"])
+            target = _string(sa_names[remote])
+            if "secondary" in rel:
+                yield model, name, "%s.List[%s]" % (typing, target)
+                continue
+            if table.c[rel["foreign_key"]].nullable:
+                target = "%s.Optional[%s]" % (typing, target)
+            yield model, name, target
+            if rel.get("backref"):
+                source = _string(sa_names[model])
+                if rel["backref_uselist"] is False:
+                    hint = "%s.Optional[%s]" % (typing, source)
+                else:
+                    hint = "%s.List[%s]" % (typing, source)
+                yield remote, rel["backref"], hint
+
+
+def _bases(module, model, parent_bases):
+    """Return the rendered bases of the class of a model, and the classes.
+
+    Like ``_make_sa_model``, the mixin of the model is added unless a base
+    class already has it.
+    """
+    mixin = getattr(model, "aldjemy_mixin", None)
+    if parent_bases is None:
+        base = module.add_import("aldjemy.apps", "BaseSQLAModel")
+        classes = [BaseSQLAModel]
+    else:
+        base, classes = parent_bases
+    if mixin and not any(issubclass(cls, mixin) for cls in classes):
+        if _resolves(mixin):
+            name = module.name(mixin)
+        else:
+            # Created on the fly, like those of ``AldjemyMeta``
+            name = "%s.aldjemy_mixin" % module.name(model)
+        return [name, base], classes + [mixin]
+    return [base], classes
+
+
+def _render_relationship(module, model, table, name, rel, tables, sa_names):
+    """Render a relationship, like ``_build_relationship_attrs``."""
+    remote_model = apps.get_model(rel["model"])
+    remote = tables[rel["remote_table"]]
+    remote_column = module.column(remote.c[rel["remote_column"]])
+    default = getattr(settings, "ALDJEMY_DEFAULT_LOADING", None)
+    args = [sa_names[remote_model]]
+    if "secondary" in rel:
+        secondary = tables[rel["secondary"]]
+        args += [
+            "secondary=%s" % module.table_names[secondary],
+            "primaryjoin=%s == %s"
+            % (
+                module.column(secondary.c[rel["secondary_column"]]),
+                module.column(table.c[rel["local_column"]]),
+            ),
+            "secondaryjoin=%s == %s"
+            % (
+                module.column(secondary.c[rel["secondary_remote_column"]]),
+                remote_column,
+            ),
+            "overlaps=%s" % _string(rel["overlaps"]),
+        ]
+    else:
+        column = module.column(table.c[rel["foreign_key"]])
+        args += [
+            "foreign_keys=[%s]" % column,
+            "primaryjoin=%s == %s" % (column, remote_column),
+            "remote_side=%s" % remote_column,
+        ]
+        if rel.get("backref"):
+            backref = [_string(rel["backref"])]
+            if rel["backref_uselist"] is not None:
+                backref.append("uselist=%r" % rel["backref_uselist"])
+            lazy = get_loading(remote_model).get(rel["backref"], default)
+            if lazy:
+                backref.append("lazy=%s" % _string(lazy))
+            if len(backref) > 1:
+                backref = [module.call("orm.backref", backref)]
+            args.append("backref=%s" % backref[0])
+    lazy = get_loading(model).get(name, default)
+    if lazy:
+        args.append("lazy=%s" % _string(lazy))
+    return module.call("orm.relationship", args)
+
+
+def _render_mapper_kwargs(module, plan, plans, tables, sa_names):
+    """Render the inheritance arguments, like ``_build_mapper_kwargs``."""
+    table = tables[plan["table"]]
+    kwargs = []
+    if "inherits" in plan:
+        inherits = plan["inherits"]
+        parent = apps.get_model(inherits["model"])
+        parent_table = tables[plans[parent]["table"]]
+        kwargs += [
+            "inherits=%s" % sa_names[parent],
+            "inherit_condition=%s == %s"
+            % (
+                module.column(table.c[inherits["column"]]),
+                module.column(parent_table.c[inherits["remote_column"]]),
+            ),
+        ]
+    if "polymorphic_identity" in plan:
+        kwargs += [
+            "polymorphic_identity=%s" % _string(plan["polymorphic_identity"]),
+            'with_polymorphic="*"',
+        ]
+    if "polymorphic_on" in plan:
+        literal = module.add_import("sqlalchemy", "literal")
+        cases = [
+            "(%s.isnot(None), %s(%s))"
+            % (module.column(tables[name].c[column]), literal, _string(label))
+            for name, column, label in plan["polymorphic_on"]
+        ]
+        cases.append("else_=%s(%s)" % (literal, _string(plan["polymorphic_identity"])))
+        function = module.add_import("sqlalchemy", "case")
+        kwargs.append("polymorphic_on=%s" % module.call(function, cases))
+    return kwargs
+
+
+def _render_models(module, models, plans):
+    """Render the classes of the models, their mappings and ``MODELS``."""
+    tables = {table.key: table for table in module.table_names}
+    module.add_import("sqlalchemy", "orm")
+    module.add_import("sqlalchemy.orm", "Mapped")
+    module.add_import("sqlalchemy.orm", "registry")
+
+    taken = set()
+    sa_names = {}
+    for model in models:
+        opts = model._meta
+        app = "".join(part.title() for part in opts.app_label.split("_"))
+        sa_names[model] = _unique(_identifier(app + opts.object_name), taken)
+
+    hints = {model: {} for model in models}
+    for model in models:
+        table = tables[plans[model]["table"]]
+        for name, column in plans[model]["columns"].items():
+            hints[model][name] = _column_hint(module, table.c[column])
+    for model, name, hint in _relationship_hints(
+        module, models, plans, tables, sa_names
+    ):
+        hints[model].setdefault(name, hint)
+
+    lines = ["mapper_registry = registry()", ""]
+    bases = {}
+    for model in models:
+        parent = _get_parent(model)
+        parent_bases = parent and (sa_names[parent], bases[parent][1])
+        bases[model] = _bases(module, model, parent_bases)
+        lines += [
+            "",
+            "class %s(%s):" % (sa_names[model], ", ".join(bases[model][0])),
+            "    __alias__ = %s" % _string(router.db_for_read(model)),
+            "",
+        ]
+        lines += [
+            "    %s: Mapped[%s]" % (name, hint)
+            for name, hint in hints[model].items()
+            if _is_attribute(name)
+        ]
+        lines.append("")
+
+    for model in models:
+        plan = plans[model]
+        table = tables[plan["table"]]
+        properties = [
+            "%s: orm.column_property(%s)"
+            % (_string(name), module.column(table.c[column]))
+            for name, column in plan["columns"].items()
+        ]
+        properties += [
+            "%s: %s"
+            % (
+                _string(name),
+                _render_relationship(module, model, table, name, rel, tables, sa_names),
+            )
+            for name, rel in plan["relationships"].items()
+        ]
+        args = [sa_names[model], module.table_names[table]]
+        if properties:
+            args.append(
+                "properties={%s\n}" % "".join("\n    %s," % item for item in properties)
+            )
+        args += _render_mapper_kwargs(module, plan, plans, tables, sa_names)
+        call = module.call("mapper_registry.map_imperatively", args, split=True)
+        lines += ["", call]
+
+    lines += ["", "MODELS = {"]
+    lines += [
+        "    %s: %s," % (_string(model._meta.label_lower), sa_names[model])
+        for model in models
+    ]
+    lines.append("}")
+    return lines
+
+
+def generate_modules():
+    """Return the source of the modules of the generated package, by file name.
+
+    ``tables`` declares the tables of ``generate_tables`` in its ``metadata``,
+    ``models`` the SQLAlchemy models mapped like ``construct_models`` does,
+    and ``MODELS`` maps the labels of the Django models to them.
+    """
+    metadata = MetaData()
+    generate_tables(metadata)
+    models = [
+        model
+        for model in apps.get_models(include_auto_created=True)
+        if not model._meta.proxy
+    ]
+    # Parent classes are mapped before their children
+    models.sort(key=lambda model: len(model._meta.get_parent_list()))
+    plans = {model: get_model_plan(metadata, model) for model in models}
+
+    taken = set()
+    table_names = {
+        table: _unique(_identifier(key, "t_"), taken)
+        for key, table in metadata.tables.items()
+    }
+    tables = _Module(table_names)
+    tables.add_import("sqlalchemy", "MetaData")
+    tables.lines.append("metadata = MetaData()")
+    for table in metadata.tables.values():
+        tables.lines += ["", *_render_table(tables, table)]
+
+    models_module = _Module(table_names)
+    models_module.lines = _render_models(models_module, models, plans)
+    for name in table_names.values():
+        models_module.add_import(".tables", name)
+    return {
+        "__init__.py": HEADER,
+        "tables.py": tables.source(),
+        "models.py": models_module.source(),
+    }
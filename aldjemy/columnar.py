@@ -0,0 +1,108 @@
+"""Fetch the results of a statement as columns of arrays.
+
+Rows are read by chunks with ``Result.partitions()`` and stored column by
+column, without keeping a result row per database row. NumPy arrays are
+returned when NumPy is installed, else ``array.array`` for the numeric
+columns and lists for the others. NumPy is imported by the first call.
+"""
+
+import array
+import datetime
+
+from .session import server_side_cursor_block
+from .table import get_column_dtype
+
+__all__ = ["fetch_columns"]
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover
+        return None
+    return numpy
+
+
+class _Column:
+    def __init__(self, typ, numpy=None):
+        self.dtype, self.typecode = get_column_dtype(typ)
+        self.numeric = self.typecode is not None
+        self.numpy = numpy
+        self.chunks = []
+
+    def add(self, values):
+        if self.numpy is not None:
+            self.chunks.append(self._numpy_chunk(values))
+        else:
+            self.chunks.append(self._array_chunk(values))
+
+    def _numpy_chunk(self, values):
+        dtype = self.dtype
+        if self.numeric and None in values:
+            # NULL is NaN, booleans keep their None
+            dtype = "float64" if self.typecode != "b" else None
+        elif dtype == "datetime64[us]":
+            values = [_naive(v) for v in values]
+        if dtype is None:
+            chunk = self.numpy.empty(len(values), dtype=object)
+            chunk[:] = values
+            return chunk
+        return self.numpy.array(values, dtype=dtype)
+
+    def _array_chunk(self, values):
+        if not self.numeric:
+            return values
+        if None in values:
+            if self.typecode == "b":
+                return list(values)
+            return array.array("d", [float("nan") if v is None else v for v in values])
+        return array.array(self.typecode, values)
+
+    def result(self):
+        if self.numpy is not None:
+            if not self.chunks:
+                return self.numpy.empty(0, dtype=self.dtype or object)
+            return self.numpy.concatenate(self.chunks)
+        if not self.numeric or any(isinstance(c, list) for c in self.chunks):
+            return [v for chunk in self.chunks for v in chunk]
+        # Integer chunks with NULL values turned the column into floats
+        typecodes = {chunk.typecode for chunk in self.chunks} or {self.typecode}
+        typecode = typecodes.pop() if len(typecodes) == 1 else "d"
+        result = array.array(typecode)
+        for chunk in self.chunks:
+            result.extend(chunk if chunk.typecode == typecode else map(float, chunk))
+        return result
+
+
+def _naive(value):
+    """Convert an aware datetime to UTC, datetime64 has no time zone."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def fetch_columns(sa_model, statement, params=None, chunk_size=10000, use_numpy=None):
+    """Execute a statement, return a dict of arrays keyed by column name.
+
+    The arrays types come from the column types of the statement: integers,
+    floats and booleans are stored natively, dates and datetimes as
+    ``datetime64`` with NumPy, other values as Python objects. Integer
+    columns with NULL values are stored as floats, NULL being NaN.
+    """
+    numpy = _import_numpy() if use_numpy or use_numpy is None else None
+    if use_numpy and numpy is None:  # pragma: no cover
+        raise ImportError("use_numpy requires NumPy")
+    engine = sa_model.get_session().get_bind(clause=statement)
+    with server_side_cursor_block(engine), engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(
+            statement, params or {}
+        )
+        try:
+            columns = [_Column(c.type, numpy) for c in statement.selected_columns]
+            # The values are processed by their types, like NULL booleans
+            for rows in result.partitions(chunk_size):
+                for column, values in zip(columns, zip(*rows)):
+                    column.add(values)
+            return {key: column.result() for key, column in zip(result.keys(), columns)}
+        finally:
+            result.close()
@@ -1,4 +1,4 @@
-import functools
+import threading
 import time
 from collections import deque
 
@@ -9,16 +9,18 @@ from sqlalchemy.engine import base
 from sqlalchemy.pool import NullPool
 from sqlalchemy.pool import _ConnectionRecord as _ConnectionRecordBase
 
-from .sqlite import SqliteWrapper
-from .wrapper import Wrapper
+from . import result_cache
+from .sqlite import configure_dialect
+from .wrapper import get_wrapper
 
-__all__ = ["get_engine"]
+__all__ = ["CompiledCache", "get_compiled_cache", "get_engine"]
 
 
 class Cache:
     """Module level cache"""
 
     engines = {}
+    lock = threading.Lock()
 
 
 SQLALCHEMY_ENGINES = {
@@ -30,6 +32,32 @@ SQLALCHEMY_ENGINES = {
 }
 SQLALCHEMY_ENGINES.update(getattr(settings, "ALDJEMY_ENGINES", {}))
 SQLALCHEMY_USE_FUTURE = getattr(settings, "ALDJEMY_SQLALCHEMY_USE_FUTURE", None)
+QUERY_CACHE_SIZE = getattr(settings, "ALDJEMY_QUERY_CACHE_SIZE", 500)
+
+
+class CompiledCache(util.LRUCache):
+    """Cache of compiled statements counting its hits and misses."""
+
+    def __init__(self, capacity=QUERY_CACHE_SIZE):
+        super().__init__(capacity)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        if value is default:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "capacity": self.capacity,
+        }
 
 
 def get_engine_string(alias):
@@ -44,25 +72,48 @@ def get_connection_string(alias="default"):
 
 
 def get_engine(alias="default", **kwargs):
-    if alias not in Cache.engines:
-        engine_string = get_engine_string(alias)
-        if engine_string == "sqlite3":
-            kwargs["native_datetime"] = True
-
-        pool = DjangoPool(alias=alias, creator=None)
-        if SQLALCHEMY_USE_FUTURE is not None:
-            kwargs["future"] = SQLALCHEMY_USE_FUTURE  # pragma: no cover
-        Cache.engines[alias] = create_engine(
-            get_connection_string(alias), pool=pool, **kwargs
-        )
-    return Cache.engines[alias]
+    engine = Cache.engines.get(alias)
+    if engine is None:
+        with Cache.lock:
+            engine = Cache.engines.get(alias)
+            if engine is None:
+                engine = _create_engine(alias, **kwargs)
+                # Published once configured, other threads read it unlocked
+                Cache.engines[alias] = engine
+    return engine
+
+
+def _create_engine(alias, **kwargs):
+    engine_string = get_engine_string(alias)
+    if engine_string == "sqlite3":
+        kwargs["native_datetime"] = True
+
+    pool = DjangoPool(alias=alias, creator=None)
+    compiled_cache = CompiledCache() if QUERY_CACHE_SIZE else None
+    kwargs["execution_options"] = {
+        "compiled_cache": compiled_cache,
+        **kwargs.get("execution_options", {}),
+    }
+    if SQLALCHEMY_USE_FUTURE is not None:
+        kwargs["future"] = SQLALCHEMY_USE_FUTURE  # pragma: no cover
+    engine = create_engine(get_connection_string(alias), pool=pool, **kwargs)
+    replace_first_connect(engine)
+    if engine_string == "sqlite3":
+        configure_dialect(engine.dialect)
+    if getattr(settings, "ALDJEMY_RESULT_CACHE", None):
+        result_cache.listen_engine(engine)
+    return engine
+
+
+def get_compiled_cache(alias="default"):
+    """Return the cache of compiled statements of an alias's engine."""
+    return get_engine(alias).get_execution_options()["compiled_cache"]
 
 
 class DjangoPool(NullPool):
     def __init__(self, alias, *args, **kwargs):
         super(DjangoPool, self).__init__(*args, **kwargs)
         self.alias = alias
-        self._aldjemy_handlers_init = False
 
     def status(self):
         return "DjangoPool"
@@ -101,6 +152,43 @@ def first_connect(engine, dbapi_connection, connection_record):
     engine.dialect.initialize(c)
 
 
+class _FirstConnect:
+    """Run ``first_connect`` once, other threads wait until it succeeded.
+
+    SQLAlchemy's ``_once_unless_exception`` lets concurrent connections go
+    on before the dialect is initialized. Once it is, no lock is taken.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.done = False
+
+    def __call__(self, dbapi_connection, connection_record):
+        if self.done:
+            return
+        with self.lock:
+            if not self.done:
+                first_connect(self.engine, dbapi_connection, connection_record)
+                self.done = True
+
+
+def replace_first_connect(engine):
+    """Replace the first connect handler of SQLAlchemy with ours.
+
+    Called on new engines, before they are shared between threads.
+    """
+    pool = engine.pool
+    # we assume it's the last one
+    previous_handler_wrapper = pool.dispatch.connect.listeners.pop()
+    assert (
+        previous_handler_wrapper.__name__ == "go"
+    )  # wrapped by _once_unless_exception=True
+    handler = previous_handler_wrapper.__closure__[0].cell_contents
+    assert handler.__name__ == "first_connect", (handler, handler.__name__)
+    event.listen(pool, "connect", _FirstConnect(engine))
+
+
 class _ConnectionRecord(_ConnectionRecordBase):
     def __init__(self, pool, alias):
         self.__pool = pool
@@ -110,24 +198,6 @@ class _ConnectionRecord(_ConnectionRecordBase):
 
         self.alias = alias
         self.wrap = False
-        # Replace sqlalchemy's handler with ours
-        if not pool._aldjemy_handlers_init:
-            # we assume it's the last one
-            previous_handler_wrapper = pool.dispatch.connect.listeners.pop()
-            assert (
-                previous_handler_wrapper.__name__ == "go"
-            )  # wrapped by _once_unless_exception=True
-            handler = previous_handler_wrapper.__closure__[0].cell_contents
-            assert handler.__name__ == "first_connect", (handler, handler.__name__)
-
-            engine = get_engine(self.alias)
-            event.listen(
-                pool,
-                "connect",
-                functools.partial(first_connect, engine),
-                _once_unless_exception=True,
-            )
-            pool._aldjemy_handlers_init = True
         pool.dispatch.connect(self.connection, self)
         self.wrap = True
 
@@ -136,10 +206,8 @@ class _ConnectionRecord(_ConnectionRecordBase):
         connection = connections[self.alias]
         if connection.connection is None:
             connection._cursor()
-        if connection.vendor == "sqlite":
-            return SqliteWrapper(connection.connection)
         if self.wrap:
-            return Wrapper(connection.connection)
+            return get_wrapper(connection)
         return connection.connection
 
     def close(self):
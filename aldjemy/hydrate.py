@@ -0,0 +1,159 @@
+"""Build Django model instances from SQLAlchemy results.
+
+The instances are created with ``Model.from_db``, like the ones of a
+queryset, so they can be used by templates, forms and serializers without
+querying the database again.
+"""
+
+from django.db import router
+from django.db.models import DEFERRED
+from sqlalchemy import inspect
+
+__all__ = ["hydrate"]
+
+
+class _Layout:
+    """How to read the fields and relations of a model from a mapped object."""
+
+    def __init__(self, model, mapper):
+        self.model = model
+        # Inherited fields are in the tables of the parent classes
+        tables = {table.name: table for table in mapper.tables}
+        self.field_names = []
+        self.keys = []  # Mapped attribute of each field, or None
+        for f in model._meta.concrete_fields:
+            self.field_names.append(f.attname)
+            table = tables.get(f.model._meta.db_table)
+            if table is not None and f.column in table.c:
+                self.keys.append(mapper.get_property_by_column(table.c[f.column]).key)
+            else:
+                self.keys.append(None)
+        self.row_keys = [
+            (f.attname, f.name, f.column) for f in model._meta.concrete_fields
+        ]
+
+        relationships = mapper.relationships
+        # (name, field) of forward foreign keys and one to ones
+        self.related = [
+            (f.name, f)
+            for f in model._meta.concrete_fields
+            if f.is_relation and f.name in relationships
+        ]
+        # (name, relation) of reverse foreign keys and one to ones
+        self.reverse = []
+        for rel in model._meta.related_objects:
+            accessor = rel.get_accessor_name()
+            if accessor and not rel.many_to_many and accessor.lower() in relationships:
+                self.reverse.append((accessor.lower(), rel))
+        self.many_to_many = [
+            f for f in model._meta.many_to_many if f.name in relationships
+        ]
+
+
+class _Hydrator:
+    def __init__(self, using):
+        self.using = using
+        self.layouts = {}
+        # Each mapped object gives one instance, shared by its relations.
+        # Objects are kept alive so that their ids are not reused.
+        self.instances = {}
+
+    def layout(self, mapper):
+        layout = self.layouts.get(mapper)
+        if layout is None:
+            model = mapper.class_.__model__
+            layout = self.layouts[mapper] = _Layout(model, mapper)
+        return layout
+
+    def _using(self, model):
+        return self.using or router.db_for_read(model)
+
+    def from_row(self, layout, row):
+        mapping = getattr(row, "_mapping", row)
+        values = []
+        for keys in layout.row_keys:
+            for key in keys:
+                if key in mapping:
+                    values.append(mapping[key])
+                    break
+            else:
+                values.append(DEFERRED)
+        model = layout.model
+        return model.from_db(self._using(model), layout.field_names, values)
+
+    def from_object(self, obj):
+        if id(obj) in self.instances:
+            return self.instances[id(obj)][1]
+        state = inspect(obj)
+        loaded = state.dict
+        layout = self.layout(state.mapper)
+        values = [
+            loaded[key] if key is not None and key in loaded else DEFERRED
+            for key in layout.keys
+        ]
+        model = layout.model
+        instance = model.from_db(self._using(model), layout.field_names, values)
+        self.instances[id(obj)] = (obj, instance)
+        # Only the relations loaded by the query are copied, without lazy loads
+        for name, field in layout.related:
+            if name in loaded:
+                related = self.from_optional(loaded[name])
+                field.set_cached_value(instance, related)
+                if related is not None and field.one_to_one:
+                    field.remote_field.set_cached_value(related, instance)
+        for name, rel in layout.reverse:
+            if name not in loaded:
+                continue
+            value = loaded[name]
+            if rel.one_to_one:
+                if isinstance(value, list):
+                    # One to one backrefs are lists by default
+                    value = value[0] if value else None
+                related = self.from_optional(value)
+                rel.set_cached_value(instance, related)
+                if related is not None:
+                    rel.field.set_cached_value(related, instance)
+            else:
+                related = [self.from_object(o) for o in value]
+                for child in related:
+                    rel.field.set_cached_value(child, instance)
+                self.set_prefetched(instance, rel.get_accessor_name(), related)
+        for field in layout.many_to_many:
+            if field.name in loaded:
+                related = [self.from_object(o) for o in loaded[field.name]]
+                self.set_prefetched(instance, field.name, related)
+        return instance
+
+    def from_optional(self, obj):
+        return None if obj is None else self.from_object(obj)
+
+    def set_prefetched(self, instance, name, related):
+        # Same as prefetch_related_objects
+        queryset = getattr(instance, name).get_queryset()
+        queryset._result_cache = related
+        queryset._prefetch_done = True
+        if not hasattr(instance, "_prefetched_objects_cache"):
+            instance._prefetched_objects_cache = {}
+        instance._prefetched_objects_cache[name] = queryset
+
+
+def hydrate(sa_model, rows, using=None):
+    """Return Django instances of the model of ``sa_model`` for ``rows``.
+
+    Rows are instances of ``sa_model`` or rows of columns, keyed by field
+    name, attname or column name. Missing fields are deferred. The
+    relationships loaded on the instances fill the cache of the related
+    objects, as ``select_related`` does, and the prefetch cache of the
+    related managers, as ``prefetch_related`` does.
+
+    ``using`` defaults to the database returned by ``db_for_read``.
+    """
+    hydrator = _Hydrator(using)
+    layout = hydrator.layout(inspect(sa_model))
+    instances = []
+    for row in rows:
+        if isinstance(row, sa_model):
+            instances.append(hydrator.from_object(row))
+        else:
+            instances.append(hydrator.from_row(layout, row))
+    return instances
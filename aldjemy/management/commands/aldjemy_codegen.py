@@ -0,0 +1,72 @@
+import importlib.util
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from aldjemy.codegen import generate_modules
+
+
+def _package_directory(package):
+    """Return the directory of a package, which may not exist yet."""
+    parent, _, name = package.rpartition(".")
+    if not parent:
+        return os.path.abspath(name)
+    try:
+        spec = importlib.util.find_spec(parent)
+    except ImportError:
+        spec = None
+    if spec is None or not spec.submodule_search_locations:
+        raise CommandError("Cannot find the package %r." % parent)
+    return os.path.join(list(spec.submodule_search_locations)[0], name)
+
+
+class Command(BaseCommand):
+    help = "Write the SQLAlchemy tables and models as Python modules."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directory",
+            nargs="?",
+            help="Directory of the generated package, "
+            "by default the package of ALDJEMY_USE_GENERATED.",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail if the modules are out of date, without writing them.",
+        )
+
+    def handle(self, *args, directory, check, **options):
+        if directory is None:
+            package = getattr(settings, "ALDJEMY_USE_GENERATED", None)
+            if not package:
+                raise CommandError(
+                    "Give the directory of the generated package, "
+                    "or set ALDJEMY_USE_GENERATED."
+                )
+            directory = _package_directory(package)
+
+        stale = []
+        for name, source in generate_modules().items():
+            path = os.path.join(directory, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    if f.read() == source:
+                        continue
+            except FileNotFoundError:
+                pass
+            stale.append((path, source))
+
+        if check:
+            for path, _ in stale:
+                self.stderr.write("%s is out of date." % path)
+            if stale:
+                raise CommandError("The generated modules are out of date.")
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        for path, source in stale:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(source)
+            self.stdout.write("Wrote %s" % path)
@@ -0,0 +1,184 @@
+import json
+import time
+import tracemalloc
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from sqlalchemy import MetaData, orm
+from sqlalchemy.orm import registry
+
+from aldjemy.apps import _make_sa_model
+from aldjemy.orm import (
+    _build_mapper_kwargs,
+    _extract_model_attrs,
+    _get_parent,
+    _get_table,
+    get_model_plan,
+)
+from aldjemy.table import generate_table, get_data_types
+
+
+def _build(models, stats=None):
+    """Map the models like ``construct_models``, timing each step."""
+    clock = time.perf_counter
+    metadata = MetaData()
+    data_types = get_data_types()
+    totals = {}
+
+    start = clock()
+    for model in models:
+        step = clock()
+        generate_table(metadata, model, data_types)
+        if stats is not None:
+            stats[model]["table"] = clock() - step
+    totals["generate_tables"] = clock() - start
+
+    # Parent classes are mapped before their children
+    models = sorted(models, key=lambda model: len(model._meta.get_parent_list()))
+    sa_models = {}
+    for model in models:
+        parent = _get_parent(model)
+        sa_models[model] = _make_sa_model(model, parent and sa_models[parent])
+    mapper_registry = registry()
+    totals["extract_model_attrs"] = totals["map_imperatively"] = 0
+    for model in models:
+        step = clock()
+        plan = get_model_plan(metadata, model)
+        attrs = _extract_model_attrs(metadata, model, sa_models, plan)
+        extract = clock() - step
+        step = clock()
+        mapper_registry.map_imperatively(
+            sa_models[model],
+            local_table=_get_table(metadata, model),
+            properties=attrs,
+            **_build_mapper_kwargs(metadata, plan, sa_models),
+        )
+        mapping = clock() - step
+        totals["extract_model_attrs"] += extract
+        totals["map_imperatively"] += mapping
+        if stats is not None:
+            relationships = [
+                prop
+                for prop in attrs.values()
+                if isinstance(prop, orm.RelationshipProperty)
+            ]
+            stats[model].update(
+                attrs=extract,
+                mapping=mapping,
+                columns=len(_get_table(metadata, model).c),
+                relationships=len(relationships),
+                backrefs=sum(1 for prop in relationships if prop.backref),
+            )
+
+    step = clock()
+    mapper_registry.configure()
+    totals["configure_mappers"] = clock() - step
+    return mapper_registry, totals
+
+
+def profile_startup(memory=True):
+    """Return the startup costs of aldjemy for the installed models.
+
+    ``models`` maps model labels to their costs in seconds and counts,
+    ``totals`` has the cost of each step, ``memory`` the bytes retained by
+    the metadata and the registry.
+    """
+    models = [
+        model
+        for model in apps.get_models(include_auto_created=True)
+        if not model._meta.proxy
+    ]
+    stats = {model: {} for model in models}
+    _, totals = _build(models, stats)
+
+    result = {
+        "models": {
+            model._meta.label: dict(
+                stats[model],
+                total=stats[model]["table"]
+                + stats[model]["attrs"]
+                + stats[model]["mapping"],
+            )
+            for model in models
+        },
+        "totals": totals,
+        "memory": None,
+    }
+    if memory:
+        # Measured apart, tracing allocations slows everything down
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            mapper_registry, _ = _build(models)
+            result["memory"] = tracemalloc.get_traced_memory()[0] - baseline
+            del mapper_registry
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+class Command(BaseCommand):
+    help = "Profile the construction of the SQLAlchemy models."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Number of models listed."
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            dest="as_json",
+            help="Output the whole profile as JSON.",
+        )
+        parser.add_argument(
+            "--no-memory",
+            action="store_false",
+            dest="memory",
+            help="Do not measure the memory retained by the registry.",
+        )
+
+    def handle(self, *args, limit, as_json, memory, **options):
+        profile = profile_startup(memory=memory)
+        if as_json:
+            self.stdout.write(json.dumps(profile, indent=2, sort_keys=True))
+            return
+
+        self.stdout.write(
+            "%-40s %9s %9s %9s %9s %5s %5s %5s"
+            % (
+                "model",
+                "total ms",
+                "table",
+                "attrs",
+                "mapping",
+                "cols",
+                "rels",
+                "brefs",
+            )
+        )
+        models = sorted(
+            profile["models"].items(), key=lambda item: item[1]["total"], reverse=True
+        )
+        for label, stats in models[:limit]:
+            self.stdout.write(
+                "%-40s %9.3f %9.3f %9.3f %9.3f %5d %5d %5d"
+                % (
+                    label,
+                    stats["total"] * 1e3,
+                    stats["table"] * 1e3,
+                    stats["attrs"] * 1e3,
+                    stats["mapping"] * 1e3,
+                    stats["columns"],
+                    stats["relationships"],
+                    stats["backrefs"],
+                )
+            )
+        self.stdout.write("")
+        self.stdout.write(
+            "%d models in %.1f ms"
+            % (len(models), sum(profile["totals"].values()) * 1e3)
+        )
+        for step, duration in profile["totals"].items():
+            self.stdout.write("%-20s %9.1f ms" % (step, duration * 1e3))
+        if profile["memory"] is not None:
+            self.stdout.write("%-20s %9.1f KiB" % ("memory", profile["memory"] / 1024))
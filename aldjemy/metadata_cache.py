@@ -0,0 +1,170 @@
+"""On-disk cache of the generated tables and mapping plans.
+
+The cache file is named after a fingerprint of everything the generation
+depends on, so a changed model, field or data type is never served stale.
+Enable it with the ``ALDJEMY_METADATA_CACHE`` setting, a directory path.
+Loading a pickle can run arbitrary code: the files are only loaded when they
+are owned by the current user and not writable by others.
+"""
+
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import warnings
+from decimal import Decimal
+
+import django
+import sqlalchemy
+from django.apps import apps
+from django.utils.functional import Promise
+from sqlalchemy import MetaData
+
+from .orm import get_model_plan, is_polymorphic
+from .table import generate_tables, get_data_types
+
+__all__ = ["get_fingerprint", "load_metadata"]
+
+# Bump when the layout of the cached data changes
+CACHE_FORMAT = 5
+
+
+def _qualified_name(obj):
+    name = "%s.%s" % (obj.__module__, obj.__qualname__)
+    code = getattr(obj, "__code__", None)
+    if code is not None:
+        # Tell apart lambdas and redefined functions
+        name += ":" + hashlib.sha256(code.co_code).hexdigest()[:16]
+    return name
+
+
+def _stable_repr(value):
+    """Represent a value identically across processes."""
+    if isinstance(value, dict):
+        items = sorted((_stable_repr(k), _stable_repr(v)) for k, v in value.items())
+        return "{%s}" % ",".join("%s:%s" % item for item in items)
+    if isinstance(value, (set, frozenset)):
+        return "{%s}" % ",".join(sorted(_stable_repr(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return "[%s]" % ",".join(_stable_repr(v) for v in value)
+    if isinstance(value, Promise):
+        return repr(str(value))
+    if value is None or isinstance(value, (str, bytes, int, float, Decimal)):
+        return repr(value)
+    if isinstance(value, type):
+        return _qualified_name(value)
+    if hasattr(value, "deconstruct"):
+        return _stable_repr(value.deconstruct())
+    if hasattr(value, "__qualname__"):
+        return _qualified_name(value)
+    return _qualified_name(type(value))
+
+
+def _field_signature(field):
+    name, path, args, kwargs = field.deconstruct()
+    signature = [path, name, field.column, args, kwargs]
+    if field.many_to_many:
+        signature.append(field.m2m_db_table())
+    return signature
+
+
+def _column_types(model, data_types):
+    """Represent the types the data types give to the fields of a model.
+
+    The data types are functions, whose closures and constants are not
+    part of their names, so the types they return are compared instead.
+    """
+    types = []
+    for field in model._meta.local_fields:
+        internal_type = field.get_internal_type()
+        if internal_type in data_types:
+            types.append(repr(data_types[internal_type](field)))
+    return types
+
+
+def get_fingerprint(metadata, models=None, data_types=None):
+    """Return a key of the Django models and of the aldjemy configuration."""
+    if models is None:
+        models = apps.get_models(include_auto_created=True)
+    if data_types is None:
+        data_types = get_data_types()
+    state = [
+        CACHE_FORMAT,
+        django.__version__,
+        sqlalchemy.__version__,
+        metadata.schema,
+        data_types,
+    ]
+    for model in models:
+        opts = model._meta
+        state.append(
+            [
+                opts.label_lower,
+                opts.db_table,
+                [_field_signature(f) for f in opts.fields + opts.many_to_many],
+                opts.unique_together,
+                opts.indexes,
+                opts.constraints,
+                is_polymorphic(model),
+                _column_types(model, data_types),
+            ]
+        )
+    return hashlib.sha256(_stable_repr(state).encode()).hexdigest()
+
+
+def load_metadata(cache_dir, metadata=None):
+    """Return the metadata with its tables, and the mapping plans.
+
+    They are read from ``cache_dir`` when a cache of the current models
+    exists, otherwise they are generated and written there.
+    """
+    if metadata is None:
+        metadata = MetaData()
+    models = [
+        model
+        for model in apps.get_models(include_auto_created=True)
+        if not model._meta.proxy
+    ]
+    fingerprint = get_fingerprint(metadata, models)
+    path = os.path.join(cache_dir, "aldjemy-%s.pickle" % fingerprint)
+    try:
+        with open(path, "rb") as f:
+            if _is_trusted(f):
+                return pickle.load(f)
+            warnings.warn(
+                "Ignoring %s, which other users can write." % path, RuntimeWarning
+            )
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        pass
+
+    generate_tables(metadata)
+    plans = {
+        model._meta.label_lower: get_model_plan(metadata, model) for model in models
+    }
+    _write(path, (metadata, plans))
+    return metadata, plans
+
+
+def _is_trusted(f):
+    """Return whether only the current user can have written an open file."""
+    if not hasattr(os, "getuid"):  # pragma: no cover
+        return True  # Windows, whose permissions are ACLs
+    st = os.fstat(f.fileno())
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _write(path, data):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write atomically, processes may be starting concurrently
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    except OSError:  # pragma: no cover
+        return  # A read-only cache directory only loses the speedup
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,16 @@
+from .session import session_scope
+
+
+class AldjemySessionMiddleware:
+    """Run each request in a ``session_scope``.
+
+    The sessions are closed when the response is returned, before the
+    content of streaming responses is iterated.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with session_scope():
+            return self.get_response(request)
@@ -1,32 +1,108 @@
+import threading
 from typing import Callable
 
 from django.apps import apps
+from django.conf import settings
 from django.db.models.fields.related import ForeignKey, ManyToManyField, OneToOneField
-from sqlalchemy import orm
+from sqlalchemy import case, literal, orm
 from sqlalchemy.orm import registry
+from sqlalchemy.orm.mapper import _CONFIGURE_MUTEX
 
-from .table import generate_tables
+from .table import generate_table, generate_tables, get_data_types
 
 
-def _extract_model_attrs(metadata, model, sa_models):
-    tables = metadata.tables
+def _qualname(metadata, name):
+    return (metadata.schema + "." + name) if metadata.schema else name
+
+
+def _get_table(metadata, model):
+    return metadata.tables[_qualname(metadata, model._meta.db_table)]
+
+
+def _get_parent(model):
+    """Return the parent of a multi-table inheritance child, or None.
+
+    Only the parent linked by the primary key is mapped as the parent class,
+    the fields of other parents are left out.
+    """
+    pk = model._meta.pk
+    if pk.one_to_one and pk.remote_field.parent_link:
+        return pk.remote_field.model._meta.concrete_model
+    return None
+
+
+def _get_children(model):
+    """Return the multi-table inheritance children of a model."""
+    return [
+        rel.related_model
+        for rel in model._meta.related_objects
+        if rel.parent_link
+        and rel.model is model
+        and rel.related_model._meta.pk is rel.field
+    ]
+
+
+def _get_root(model):
+    parent = _get_parent(model)
+    return model if parent is None else _get_root(parent)
+
+
+def is_polymorphic(model):
+    """Return whether queries of the hierarchy of ``model`` load subclasses."""
+    return getattr(_get_root(model), "aldjemy_polymorphic", False)
+
+
+def _polymorphic_cases(metadata, model):
+    """Yield ``(table, column, label)`` of the descendants, deepest first."""
+    for child in _get_children(model):
+        yield from _polymorphic_cases(metadata, child)
+        yield (
+            _qualname(metadata, child._meta.db_table),
+            child._meta.pk.column,
+            child._meta.label_lower,
+        )
+
+
+def _get_inheritance_plan(metadata, model):
+    parent = _get_parent(model)
+    plan = {}
+    if parent is not None:
+        plan["inherits"] = {
+            "model": parent._meta.label_lower,
+            "column": model._meta.pk.column,
+            "remote_column": model._meta.pk.target_field.column,
+        }
+    if is_polymorphic(model):
+        plan["polymorphic_identity"] = model._meta.label_lower
+        cases = list(_polymorphic_cases(metadata, model))
+        if cases:
+            plan["polymorphic_on"] = cases
+    return plan
 
-    name = model._meta.db_table
-    qualname = (metadata.schema + "." + name) if metadata.schema else name
-    table = tables[qualname]
+
+def get_model_plan(metadata, model):
+    """Describe the mapping of a model as plain, picklable data.
+
+    The tables of the model and of its relationships must be in ``metadata``.
+    """
+    table = _get_table(metadata, model)
     fks = [t for t in model._meta.fields if isinstance(t, (ForeignKey, OneToOneField))]
-    attrs = {}
+    columns = {}
+    relationships = {}
     rel_fields = fks + list(model._meta.many_to_many)
+    parent = _get_parent(model)
 
     for f in model._meta.fields:
         if not isinstance(f, (ForeignKey, OneToOneField)):
             if f.model != model or f.column not in table.c:
-                continue  # Fields from parent model are not supported
-            attrs[f.name] = orm.column_property(table.c[f.column])
+                continue  # Inherited from the parent class, or another parent
+            columns[f.name] = f.column
 
     for fk in rel_fields:
         if fk.column not in table.c and not isinstance(fk, ManyToManyField):
             continue
+        if fk.model is not model and parent and issubclass(parent, fk.model):
+            continue  # Inherited from the parent class
 
         parent_model = fk.remote_field.model
 
@@ -35,35 +111,23 @@ def _extract_model_attrs(metadata, model, sa_models):
         if parent_model_meta.proxy:
             continue
 
-        p_table_name = parent_model_meta.db_table
-        p_table_qualname = (
-            metadata.schema + "." + p_table_name if metadata.schema else p_table_name
-        )
-        p_table = tables[p_table_qualname]
-        p_name = parent_model_meta.pk.column
-
         related_name = fk.remote_field.get_accessor_name()
         disable_backref = related_name and related_name.endswith("+")
         backref = related_name.lower().strip("+") if related_name else None
+        backref_uselist = None
         if not backref and not disable_backref:
             backref = model._meta.object_name.lower()
             if not isinstance(fk, OneToOneField):
                 backref = backref + "_set"
         elif backref and isinstance(fk, OneToOneField):
-            backref = orm.backref(backref, uselist=False)
+            backref_uselist = False
 
-        kwargs = {}
+        plan = {
+            "model": parent_model_meta.label_lower,
+            "remote_table": _qualname(metadata, parent_model_meta.db_table),
+            "remote_column": parent_model_meta.pk.column,
+        }
         if isinstance(fk, ManyToManyField):
-            model_pk = model._meta.pk.column
-            sec_table_name = fk.remote_field.field.m2m_db_table()
-            sec_table_qualname = (
-                metadata.schema + "." + sec_table_name
-                if metadata.schema
-                else sec_table_name
-            )
-            sec_table = tables[sec_table_qualname]
-            sec_column = fk.m2m_column_name()
-            p_sec_column = fk.m2m_reverse_name()
             overlaps = [
                 fk.m2m_field_name(),
                 fk.m2m_reverse_field_name(),
@@ -75,62 +139,272 @@ def _extract_model_attrs(metadata, model, sa_models):
                     fk.m2m_reverse_field_name()
                 ).remote_field.get_accessor_name(),
             ]
+            plan.update(
+                through=fk.remote_field.through._meta.label_lower,
+                secondary=_qualname(metadata, fk.remote_field.field.m2m_db_table()),
+                local_column=model._meta.pk.column,
+                secondary_column=fk.m2m_column_name(),
+                secondary_remote_column=fk.m2m_reverse_name(),
+                overlaps=",".join(overlaps),
+            )
+        else:
+            plan.update(foreign_key=fk.column)
+            if backref and not disable_backref:
+                plan.update(backref=backref, backref_uselist=backref_uselist)
+        relationships[fk.name] = plan
+
+    return {
+        "table": table.key,
+        "columns": columns,
+        "relationships": relationships,
+        **_get_inheritance_plan(metadata, model),
+    }
+
+
+def _build_column_attrs(metadata, plan):
+    table = metadata.tables[plan["table"]]
+    return {
+        name: orm.column_property(table.c[column])
+        for name, column in plan["columns"].items()
+    }
+
+
+def get_loading(model):
+    """Return the loading strategies of the relationships of a model.
+
+    They are keyed by the name of the relationship or backref, from the
+    ``aldjemy_loading`` attribute of the model, overridden by the entry of
+    the model in the ``ALDJEMY_LOADING`` setting.
+    """
+    loading = dict(getattr(model, "aldjemy_loading", None) or {})
+    configured = getattr(settings, "ALDJEMY_LOADING", None) or {}
+    for label, strategies in configured.items():
+        if label.lower() == model._meta.label_lower:
+            loading.update(strategies)
+    return loading
+
+
+def _build_relationship_attrs(metadata, model, plan, sa_models):
+    tables = metadata.tables
+    table = tables[plan["table"]]
+    default = getattr(settings, "ALDJEMY_DEFAULT_LOADING", None)
+    loading = get_loading(model)
+    attrs = {}
+    for name, rel in plan["relationships"].items():
+        remote_model = apps.get_model(rel["model"])
+        p_table = tables[rel["remote_table"]]
+        p_column = p_table.c[rel["remote_column"]]
+        kwargs = {}
+        if "secondary" in rel:
+            sec_table = tables[rel["secondary"]]
             kwargs.update(
                 secondary=sec_table,
-                primaryjoin=(sec_table.c[sec_column] == table.c[model_pk]),
-                secondaryjoin=(sec_table.c[p_sec_column] == p_table.c[p_name]),
-                overlaps=",".join(overlaps),
+                primaryjoin=(
+                    sec_table.c[rel["secondary_column"]] == table.c[rel["local_column"]]
+                ),
+                secondaryjoin=(sec_table.c[rel["secondary_remote_column"]] == p_column),
+                overlaps=rel["overlaps"],
             )
-            if fk.model() != model:
-                backref = None
         else:
+            column = table.c[rel["foreign_key"]]
             kwargs.update(
-                foreign_keys=[table.c[fk.column]],
-                primaryjoin=(table.c[fk.column] == p_table.c[p_name]),
-                remote_side=p_table.c[p_name],
+                foreign_keys=[column],
+                primaryjoin=(column == p_column),
+                remote_side=p_column,
             )
-            if backref and not disable_backref:
+            if rel.get("backref"):
+                backref = rel["backref"]
+                backref_kwargs = {}
+                if rel["backref_uselist"] is not None:
+                    backref_kwargs.update(uselist=rel["backref_uselist"])
+                lazy = get_loading(remote_model).get(backref, default)
+                if lazy:
+                    backref_kwargs.update(lazy=lazy)
+                if backref_kwargs:
+                    backref = orm.backref(backref, **backref_kwargs)
                 kwargs.update(backref=backref)
-        attrs[fk.name] = orm.relationship(sa_models[parent_model], **kwargs)
+        lazy = loading.get(name, default)
+        if lazy:
+            kwargs.update(lazy=lazy)
+        attrs[name] = orm.relationship(sa_models[remote_model], **kwargs)
+    return attrs
+
+
+def _build_mapper_kwargs(metadata, plan, sa_models):
+    """Return the inheritance arguments of ``map_imperatively``."""
+    tables = metadata.tables
+    table = tables[plan["table"]]
+    kwargs = {}
+    if "inherits" in plan:
+        inherits = plan["inherits"]
+        parent = sa_models[apps.get_model(inherits["model"])]
+        parent_table = parent.__mapper__.local_table
+        kwargs.update(
+            inherits=parent,
+            inherit_condition=(
+                table.c[inherits["column"]] == parent_table.c[inherits["remote_column"]]
+            ),
+        )
+    if "polymorphic_identity" in plan:
+        # Django has no discriminator column, the most derived table with a
+        # row tells the class, so the queries join the tables of subclasses
+        kwargs.update(
+            polymorphic_identity=plan["polymorphic_identity"],
+            with_polymorphic="*",
+        )
+    if "polymorphic_on" in plan:
+        # Each class has its own expression, over the tables of its subclasses
+        cases = [
+            (tables[name].c[column].isnot(None), literal(label))
+            for name, column, label in plan["polymorphic_on"]
+        ]
+        kwargs.update(
+            polymorphic_on=case(*cases, else_=literal(plan["polymorphic_identity"]))
+        )
+    return kwargs
+
+
+def _extract_model_attrs(metadata, model, sa_models, plan=None):
+    if plan is None:
+        plan = get_model_plan(metadata, model)
+    attrs = _build_column_attrs(metadata, plan)
+    attrs.update(_build_relationship_attrs(metadata, model, plan, sa_models))
     return attrs
 
 
-def _default_make_sa_model(model):
-    """Create a custom class for the SQLAlchemy model."""
+def _related_models(plan):
+    """Yield the models whose tables the relationships of a plan use."""
+    for rel in plan["relationships"].values():
+        yield apps.get_model(rel["model"])
+        if "through" in rel:
+            yield apps.get_model(rel["through"])
+
+
+def _default_make_sa_model(model, parent=None):
+    """Create a custom class for the SQLAlchemy model.
+
+    ``parent`` is the class of the parent model, for inheritance.
+    """
     name = model._meta.object_name + ".__aldjemy__"
-    return type(name, (), {"__module__": model.__module__})
+    bases = (parent,) if parent else ()
+    return type(name, bases, {"__model__": model, "__module__": model.__module__})
 
 
-def construct_models(metadata, *, _make_sa_model: Callable = _default_make_sa_model):
+def construct_models(
+    metadata, *, plans=None, _make_sa_model: Callable = _default_make_sa_model
+):
+    """Map all Django models, return a dict of the SQLAlchemy models.
+
+    ``plans`` maps model labels to the result of ``get_model_plan``,
+    the models not in it are introspected.
+    """
     if not metadata.tables:
         generate_tables(metadata)
-    tables = metadata.tables
+    plans = plans or {}
     models = [
         model
         for model in apps.get_models(include_auto_created=True)
         if not model._meta.proxy
     ]
-
+    mapper_registry = registry()
     sa_models = {}
+    _map_models(metadata, models, plans, mapper_registry, _make_sa_model, sa_models)
+    return sa_models
+
+
+def _map_models(metadata, models, plans, mapper_registry, make_sa_model, sa_models):
+    """Map ``models`` in ``mapper_registry``, adding them to ``sa_models``.
+
+    The models they are related to must be in ``models`` or ``sa_models``.
+    """
+    tables = metadata.tables
+    # Parent classes are mapped before their children
+    models = sorted(models, key=lambda model: len(model._meta.get_parent_list()))
     for model in models:
-        table_name = (
-            metadata.schema + "." + model._meta.db_table
-            if metadata.schema
-            else model._meta.db_table
-        )
-        table = tables[table_name]
-        sa_models[model] = _make_sa_model(model)
+        parent = _get_parent(model)
+        sa_models[model] = make_sa_model(model, parent and sa_models[parent])
 
-    mapper_registry = registry()
     for model in models:
         sa_model = sa_models[model]
-        table_name = (
-            metadata.schema + "." + model._meta.db_table
-            if metadata.schema
-            else model._meta.db_table
+        table = tables[_qualname(metadata, model._meta.db_table)]
+        plan = plans.get(model._meta.label_lower)
+        if plan is None:
+            plan = get_model_plan(metadata, model)
+        attrs = _extract_model_attrs(metadata, model, sa_models, plan)
+        mapper_registry.map_imperatively(
+            sa_model,
+            local_table=table,
+            properties=attrs,
+            **_build_mapper_kwargs(metadata, plan, sa_models),
         )
-        table = tables[table_name]
-        attrs = _extract_model_attrs(metadata, model, sa_models)
-        mapper_registry.map_imperatively(sa_model, local_table=table, properties=attrs)
 
-    return sa_models
+
+class LazyModels:
+    """Construct the SQLAlchemy models on demand.
+
+    Requesting a model maps the models connected to it by relationships and
+    inheritance, all of them complete with their relationships and backrefs,
+    so a model returned once is never changed later. The mappers are built
+    and configured holding SQLAlchemy's configure lock, which other threads
+    take before configuring theirs.
+    """
+
+    def __init__(
+        self, metadata, *, plans=None, _make_sa_model: Callable = _default_make_sa_model
+    ):
+        self.metadata = metadata
+        self.models = [
+            model
+            for model in apps.get_models(include_auto_created=True)
+            if not model._meta.proxy
+        ]
+        self._make_sa_model = _make_sa_model
+        self._data_types = get_data_types()
+        self._plans = dict(plans or {})
+        self._registry = registry()
+        self._lock = threading.RLock()
+        self._sa_models = {}
+
+    def get(self, model):
+        """Return the SQLAlchemy model of ``model``, constructing it if needed."""
+        try:
+            return self._sa_models[model]
+        except KeyError:
+            pass
+        model = model._meta.concrete_model
+        with self._lock, _CONFIGURE_MUTEX:
+            if model not in self._sa_models:
+                component = self._get_component(model)
+                for related_model in component:
+                    generate_table(self.metadata, related_model, self._data_types)
+                sa_models = dict(self._sa_models)
+                _map_models(
+                    self.metadata,
+                    component,
+                    self._plans,
+                    self._registry,
+                    self._make_sa_model,
+                    sa_models,
+                )
+                self._registry.configure()
+                self._sa_models = sa_models
+        return self._sa_models[model]
+
+    def _get_component(self, model):
+        """Return the models connected to ``model``, including itself."""
+        installed = set(self.models)
+        component = {model}
+        pending = [model]
+        while pending:
+            for field in pending.pop()._meta.get_fields(include_hidden=True):
+                related_models = [field.related_model]
+                if field.many_to_many and not field.auto_created:
+                    related_models.append(field.remote_field.through)
+                for related_model in related_models:
+                    if related_model is None:
+                        continue
+                    related_model = related_model._meta.concrete_model
+                    if related_model in installed and related_model not in component:
+                        component.add(related_model)
+                        pending.append(related_model)
+        return list(component)
@@ -0,0 +1,202 @@
+"""PostgreSQL ``COPY`` of the rows of the generated tables.
+
+``COPY ... FROM STDIN`` loads rows much faster than ``INSERT``, and
+``COPY (query) TO STDOUT`` exports the results of a select. Both run on the
+Django connection borrowed by ``DjangoPool``, so they are part of the
+current ``atomic()`` block. Rows are encoded in the text format of COPY as
+they are read, and exported data is written to the file as it arrives, so
+neither is held in memory.
+"""
+
+import datetime
+import io
+
+from django.db import router
+from django.db.models.fields import AutoFieldMixin
+from sqlalchemy import select
+
+from .bulk import _RowConverter
+from .core import get_engine
+
+__all__ = ["copy_from", "copy_to"]
+
+FORMATS = {"text": "", "csv": " WITH (FORMAT csv)", "binary": " WITH (FORMAT binary)"}
+
+
+def _escape(text):
+    return (
+        text.replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\t", "\\t")
+    )
+
+
+def _format(value):
+    """Return the PostgreSQL input text of a value."""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\x" + bytes(value).hex()
+    if isinstance(value, datetime.timedelta):
+        return "%d days %d seconds %d microseconds" % (
+            value.days,
+            value.seconds,
+            value.microseconds,
+        )
+    if isinstance(value, (list, tuple)):
+        return "{%s}" % ",".join(_format_item(item) for item in value)
+    if hasattr(value, "isempty") and hasattr(value, "bounds"):
+        # Ranges of psycopg
+        if value.isempty:
+            return "empty"
+        lower = "" if value.lower is None else _format_item(value.lower)
+        upper = "" if value.upper is None else _format_item(value.upper)
+        return "%s%s,%s%s" % (value.bounds[0], lower, upper, value.bounds[1])
+    return str(value)
+
+
+def _format_item(value):
+    """Return the text of an item of an array or a range."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, (list, tuple)):
+        return _format(value)
+    return '"%s"' % _format(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _encoder(column, dialect):
+    """Return the function encoding the values of a column for COPY."""
+    processor = column.type.dialect_impl(dialect).bind_processor(dialect)
+
+    def encode(value):
+        if processor is not None:
+            value = processor(value)
+        return "\\N" if value is None else _escape(_format(value))
+
+    return encode
+
+
+def _lines(rows, converter, columns, dialect):
+    """Yield the lines of COPY's text format of the rows."""
+    encoders = [_encoder(column, dialect) for column in columns]
+    for row in rows:
+        if isinstance(row, (list, tuple)):
+            values = row
+        else:
+            values = converter(row)
+            values = [values.get(column.name) for column in columns]
+        text = "\t".join(encode(value) for encode, value in zip(encoders, values))
+        yield (text + "\n").encode()
+
+
+class _Reader:
+    """File object reading the lines of an iterator, for ``copy_expert``."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = b""
+        self.count = 0
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.count += 1
+            chunks.append(line)
+            length += len(line)
+        data = b"".join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def _get_engine(alias):
+    engine = get_engine(alias)
+    if engine.dialect.name != "postgresql":
+        raise NotImplementedError("COPY is only supported on PostgreSQL")
+    return engine
+
+
+def copy_from(sa_model, rows, columns=None):
+    """Load rows into the table of ``sa_model`` with ``COPY FROM STDIN``.
+
+    Rows are dicts, model instances or sequences of values in the order of
+    ``columns``, field names or column names. ``columns`` defaults to the
+    columns of the table, without an auto-incremented primary key.
+    Return the number of loaded rows.
+    """
+    model = sa_model.__model__
+    table = sa_model.__table__
+    converter = _RowConverter(model, table)
+    if columns is None:
+        auto_pk = isinstance(model._meta.pk, AutoFieldMixin)
+        columns = [c for c in table.c if not (auto_pk and c.primary_key)]
+    else:
+        columns = [table.c[converter.column(name)] for name in columns]
+
+    engine = _get_engine(router.db_for_write(model))
+    preparer = engine.dialect.identifier_preparer
+    sql = "COPY %s (%s) FROM STDIN" % (
+        preparer.format_table(table),
+        ", ".join(preparer.quote(column.name) for column in columns),
+    )
+    reader = _Reader(_lines(rows, converter, columns, engine.dialect))
+    with engine.begin() as connection:
+        cursor = connection.connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):
+                cursor.copy_expert(sql, reader)
+            else:
+                # psycopg 3
+                with cursor.copy(sql) as copy:
+                    for line in iter(lambda: reader.read(65536), b""):
+                        copy.write(line)
+        finally:
+            cursor.close()
+    return reader.count
+
+
+def _parameters(compiled):
+    """Return the parameters of a compiled statement, for the driver."""
+    parameters = compiled.construct_params()
+    for name, value in parameters.items():
+        type_ = compiled.binds[name].type.dialect_impl(compiled.dialect)
+        processor = type_.bind_processor(compiled.dialect)
+        if processor is not None:
+            parameters[name] = processor(value)
+    return parameters
+
+
+def copy_to(sa_model, statement, file, format="text"):
+    """Write the results of a select to ``file`` with ``COPY TO STDOUT``.
+
+    Without a statement, write all the rows of the table. ``format`` is
+    ``"text"``, ``"csv"`` or ``"binary"``. Return the number of rows.
+    """
+    model = sa_model.__model__
+    if statement is None:
+        statement = select(sa_model.__table__)
+    engine = _get_engine(router.db_for_read(model))
+    compiled = statement.compile(
+        dialect=engine.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    sql = "COPY (%s) TO STDOUT%s" % (compiled, FORMATS[format])
+    with engine.begin() as connection:
+        cursor = connection.connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):
+                cursor.copy_expert(cursor.mogrify(sql, _parameters(compiled)), file)
+                return cursor.rowcount
+            # psycopg 3
+            text = isinstance(file, io.TextIOBase)
+            with cursor.copy(sql, _parameters(compiled)) as copy:
+                for data in copy:
+                    file.write(bytes(data).decode() if text else data)
+            return cursor.rowcount
+        finally:
+            cursor.close()
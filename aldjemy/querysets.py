@@ -0,0 +1,225 @@
+"""Translate Django querysets to SQLAlchemy selects.
+
+Querysets reading the table of their model alone, filtered with simple
+lookups of its columns, become selects of the generated table. The others
+are compiled by Django and wrapped in a ``text()`` subquery. Either way
+the result is one ``Select``, usable as a subquery or a CTE.
+"""
+
+import re
+
+from django.core.exceptions import EmptyResultSet
+from django.db import models
+from django.db.models import lookups
+from django.db.models.expressions import Col, OrderBy, Ref
+from django.db.models.sql.where import AND, NothingNode, WhereNode
+from sqlalchemy import and_, column, false, inspect, literal, not_, or_, select, text
+from sqlalchemy.sql.expression import bindparam
+from sqlalchemy.types import NullType
+
+from .table import LOOKUPS as TABLE_LOOKUPS
+
+__all__ = ["select_from_queryset"]
+
+
+def _like(prefix, suffix, insensitive=False):
+    def lookup(column, value):
+        if not isinstance(value, str):
+            raise NotImplementedError("Unsupported value %r" % (value,))
+        value = value.replace("/", "//").replace("%", "/%").replace("_", "/_")
+        pattern = prefix + value + suffix
+        if insensitive:
+            return column.ilike(pattern, escape="/")
+        return column.like(pattern, escape="/")
+
+    return lookup
+
+
+# By class, lookups of other fields reuse the names with other meanings
+LOOKUPS = {
+    lookups.Exact: TABLE_LOOKUPS["exact"],
+    lookups.GreaterThan: TABLE_LOOKUPS["gt"],
+    lookups.GreaterThanOrEqual: TABLE_LOOKUPS["gte"],
+    lookups.LessThan: TABLE_LOOKUPS["lt"],
+    lookups.LessThanOrEqual: TABLE_LOOKUPS["lte"],
+    lookups.In: TABLE_LOOKUPS["in"],
+    lookups.IsNull: TABLE_LOOKUPS["isnull"],
+    lookups.IExact: _like("", "", True),
+    lookups.Contains: _like("%", "%"),
+    lookups.IContains: _like("%", "%", True),
+    lookups.StartsWith: _like("", "%"),
+    lookups.IStartsWith: _like("", "%", True),
+    lookups.EndsWith: _like("%", ""),
+    lookups.IEndsWith: _like("%", "", True),
+    lookups.Range: lambda column, value: column.between(*value),
+}
+
+# Case-sensitive pattern lookups, a LIKE on most databases but not on all
+CASE_SENSITIVE = (lookups.Contains, lookups.StartsWith, lookups.EndsWith)
+
+
+def _is_like(connection, lookup_name):
+    """Return whether Django compiles a lookup to a plain ``LIKE``.
+
+    On MySQL, ``LIKE`` follows the collation and Django uses ``LIKE BINARY``.
+    """
+    return connection.operators[lookup_name].split()[:2] == ["LIKE", "%s"]
+
+
+class _Translator:
+    def __init__(self, queryset, table):
+        self.query = queryset.query.clone()
+        self.table = table
+        self.compiler = self.query.get_compiler(queryset.db)
+
+    def translate(self):
+        query, compiler = self.query, self.compiler
+        if (
+            query.combinator
+            or query.distinct_fields
+            or query.extra
+            or query.group_by is not None
+            or query.select_for_update
+        ):
+            raise NotImplementedError("Unsupported queryset")
+        _, order_by, _ = compiler.pre_sql_setup()
+        if compiler.having or getattr(compiler, "qualify", None):
+            raise NotImplementedError("Unsupported queryset")
+        # Joins are only known once the query is set up
+        if query.count_active_tables() != 1:
+            raise NotImplementedError("Joins are not supported")
+        self.alias = query.get_initial_alias()
+        if query.alias_map[self.alias].table_name != self.table.name:
+            raise NotImplementedError("Unsupported table")
+
+        statement = select(*self.columns()).select_from(self.table)
+        where = self.where(compiler.where)
+        if where is not None:
+            statement = statement.where(where)
+        statement = statement.order_by(
+            *(self.order_by(expression) for expression, _ in order_by)
+        )
+        if query.distinct:
+            statement = statement.distinct()
+        if query.low_mark:
+            statement = statement.offset(query.low_mark)
+        if query.high_mark is not None:
+            statement = statement.limit(query.high_mark - query.low_mark)
+        return statement
+
+    def columns(self):
+        names = _names(self.query, self.compiler)
+        for (expression, _, _), name in zip(self.compiler.select, names):
+            value = self.expression(expression)
+            yield value if name == getattr(value, "name", None) else value.label(name)
+
+    def expression(self, expression):
+        if isinstance(expression, Col) and expression.alias == self.alias:
+            return self.table.c[expression.target.column]
+        if isinstance(expression, Ref):
+            return self.expression(expression.source)
+        if isinstance(expression, models.Value):
+            return literal(expression.value)
+        raise NotImplementedError("Unsupported expression %r" % (expression,))
+
+    def where(self, node):
+        if isinstance(node, NothingNode):
+            return false()
+        if isinstance(node, lookups.Lookup):
+            return self.lookup(node)
+        if not isinstance(node, WhereNode):
+            raise NotImplementedError("Unsupported condition %r" % (node,))
+        if not node.children:
+            return None
+        clauses = [self.where(child) for child in node.children]
+        clause = (and_ if node.connector == AND else or_)(*clauses)
+        return not_(clause) if node.negated else clause
+
+    def lookup(self, lookup):
+        for cls in type(lookup).__mro__:
+            if cls in LOOKUPS:
+                break
+        else:
+            raise NotImplementedError("Unsupported lookup %r" % lookup.lookup_name)
+        if issubclass(cls, CASE_SENSITIVE) and not _is_like(
+            self.compiler.connection, lookup.lookup_name
+        ):
+            raise NotImplementedError("Unsupported lookup %r" % lookup.lookup_name)
+        value = lookup.rhs
+        if hasattr(value, "resolve_expression"):
+            value = self.expression(value)
+        return LOOKUPS[cls](self.expression(lookup.lhs), value)
+
+    def order_by(self, order_by):
+        if not isinstance(order_by, OrderBy):
+            raise NotImplementedError("Unsupported ordering %r" % (order_by,))
+        value = self.expression(order_by.expression)
+        value = value.desc() if order_by.descending else value.asc()
+        if order_by.nulls_first:
+            value = value.nulls_first()
+        elif order_by.nulls_last:
+            value = value.nulls_last()
+        return value
+
+
+def _names(query, compiler):
+    """Return the names of the selected columns, like the queryset's rows."""
+    names = []
+    for i, (expression, _, alias) in enumerate(compiler.select):
+        if i < len(query.values_select):
+            names.append(query.values_select[i])
+        elif alias:
+            names.append(alias)
+        else:
+            names.append(expression.target.column)
+    return names
+
+
+def _compile(queryset, table):
+    """Wrap the SQL of a queryset compiled by Django in a subquery."""
+    query = queryset.query.clone()
+    compiler = query.get_compiler(queryset.db)
+    try:
+        sql, params = compiler.as_sql()
+    except EmptyResultSet:
+        sql, params = None, ()
+    columns = []
+    for (expression, _, _), name in zip(compiler.select, _names(query, compiler)):
+        target = getattr(expression, "target", None)
+        if target is not None and target.column in table.c:
+            columns.append(column(name, table.c[target.column].type))
+        else:
+            columns.append(column(name))
+    if sql is None:
+        # Django doesn't run querysets known to be empty
+        nulls = [literal(None, c.type).label(c.name) for c in columns]
+        return select(*nulls).where(false())
+
+    params = iter(params)
+    binds = []
+
+    def bind(match):
+        if match.group() == "%%":
+            return "%"
+        binds.append(bindparam("p%d" % len(binds), next(params), type_=NullType()))
+        return ":" + binds[-1].key
+
+    # Colons of the SQL must not be read as bind parameters
+    sql = re.sub("%s|%%", bind, sql.replace(":", "\\:"))
+    textual = text(sql).bindparams(*binds).columns(*columns)
+    return select(*textual.subquery().c)
+
+
+def select_from_queryset(sa_model, queryset):
+    """Return a select of the rows of a queryset of the model of ``sa_model``.
+
+    The columns are named like the keys of ``values()``, or like the
+    table's columns for querysets of instances.
+    """
+    mapper = inspect(sa_model)
+    if queryset.model._meta.concrete_model is not sa_model.__model__:
+        raise ValueError("%r is not a queryset of %s" % (queryset, sa_model.__name__))
+    try:
+        return _Translator(queryset, mapper.local_table).translate()
+    except NotImplementedError:
+        return _compile(queryset, mapper.local_table)
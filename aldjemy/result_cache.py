@@ -0,0 +1,289 @@
+"""Cache of query results in Django's cache framework.
+
+Results are keyed by their compiled SQL, parameters and the versions of the
+tables they read. A table's version changes whenever Django or SQLAlchemy
+writes to it, so cached results of the old versions are never read again.
+Versions change on the ``post_save``, ``post_delete`` and ``m2m_changed``
+signals, and on the statements seen by the ``execute_wrappers`` of Django's
+connections and by the engines' ``after_cursor_execute`` hooks, which bump
+every table when they can't tell what a statement writes.
+Enable it with the ``ALDJEMY_RESULT_CACHE`` setting, a cache alias.
+"""
+
+import hashlib
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import signals
+from sqlalchemy import Table, event, orm, util
+from sqlalchemy.orm import loading
+from sqlalchemy.orm.interfaces import UserDefinedOption
+from sqlalchemy.sql import Select, visitors
+
+from .wrapper import InstrumentedCursor
+
+__all__ = ["CachingQuery", "FromCache", "bump_tables"]
+
+KEY_PREFIX = "aldjemy:"
+
+# Version read by every result, bumped by the writes of unknown tables
+ALL_TABLES = "*"
+
+# Statements which don't write
+READ_RE = re.compile(
+    r"\s*(?:SELECT|VALUES|SHOW|EXPLAIN|PRAGMA|SET|BEGIN|START|COMMIT|ROLLBACK"
+    r"|SAVEPOINT|RELEASE)\b",
+    re.IGNORECASE,
+)
+# Common table expressions, which write if they have a DML statement
+WITH_RE = re.compile(r"\s*WITH\b", re.IGNORECASE)
+DML_RE = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+# The table an insert, update or delete statement writes, in any quotes
+WRITE_RE = re.compile(
+    r"\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+"
+    r'(?:"([^"]+)"|`([^`]+)`|\[([^\]]+)\]|(\w+))',
+    re.IGNORECASE,
+)
+
+# Statements compiled for their keys and the tables they read, by dialect
+# and cache key
+_compiled = util.LRUCache(500)
+
+
+def _get_cache():
+    alias = getattr(settings, "ALDJEMY_RESULT_CACHE", None)
+    if alias is None:
+        raise ImproperlyConfigured("Set ALDJEMY_RESULT_CACHE to cache results.")
+    return caches[alias]
+
+
+def _version_key(table_name):
+    # Oracle's quoted names are upper case
+    return KEY_PREFIX + "version:" + table_name.lower()
+
+
+def bump_tables(table_names):
+    """Change the version of tables, after they were written."""
+    # Random versions, a counter could go back to a previous value if evicted
+    _get_cache().set_many(
+        {_version_key(name): uuid.uuid4().hex for name in table_names}, None
+    )
+
+
+def _get_versions(cache, table_names):
+    keys = [_version_key(name) for name in sorted(table_names)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+class FromCache(UserDefinedOption):
+    """Option reading the results of a statement from the cache."""
+
+    propagate_to_loaders = True
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        super().__init__(timeout)
+        self.timeout = timeout
+
+
+class CachingQuery(orm.Query):
+    def cache(self, timeout=DEFAULT_TIMEOUT):
+        """Read the results of the query from the cache, for ``timeout``."""
+        return self.options(FromCache(timeout))
+
+
+def _tables(compiled):
+    """Return the names of the tables a compiled statement reads."""
+    # The compile state has the joins added by the ORM, like eager loads
+    state = compiled.compile_state
+    statement = compiled.statement if state is None else state.statement
+    tables = set()
+    for element in visitors.iterate(statement):
+        if isinstance(element, Table):
+            tables.add(element.name)
+        elif isinstance(element, Select) and element is not statement:
+            # Joins of ORM subqueries only appear when they are compiled
+            tables |= _tables(element.compile(dialect=compiled.dialect))
+    return tables
+
+
+def _compile(statement, bind):
+    """Return a statement compiled for a bind, and the tables it reads.
+
+    They are compiled once per cache key, like the engines do, with the
+    parameters of the statement extracted by the key.
+    """
+    cache_key = statement._generate_cache_key()
+    if cache_key is None:
+        compiled = statement.compile(bind)
+        return compiled, _tables(compiled), None
+    key = (bind.dialect, cache_key.key)
+    entry = _compiled.get(key)
+    if entry is None:
+        compiled = statement.compile(bind, cache_key=cache_key)
+        entry = _compiled[key] = (compiled, _tables(compiled))
+    return entry + (cache_key.bindparams,)
+
+
+def _result_key(cache, statement, bind, params):
+    compiled, tables, extracted = _compile(statement, bind)
+    params = compiled.construct_params(params, extracted_parameters=extracted)
+    key = [
+        compiled.dialect.name,
+        str(compiled),
+        sorted(params.items()),
+        _get_versions(cache, tables | {ALL_TABLES}),
+    ]
+    return KEY_PREFIX + "result:" + hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+def execute_from_cache(orm_execute_state):
+    """``do_orm_execute`` hook of the statements with ``FromCache``."""
+    for option in orm_execute_state.user_defined_options:
+        if isinstance(option, FromCache):
+            break
+    else:
+        return None
+    if not orm_execute_state.is_select:
+        return None
+
+    cache = _get_cache()
+    statement = orm_execute_state.statement
+    session = orm_execute_state.session
+    bind = session.get_bind(**orm_execute_state.bind_arguments)
+    key = _result_key(cache, statement, bind, orm_execute_state.parameters or {})
+
+    frozen = cache.get(key)
+    if frozen is None:
+        frozen = orm_execute_state.invoke_statement().freeze()
+        cache.set(key, frozen, option.timeout)
+    return loading.merge_frozen_result(session, statement, frozen, load=False)()
+
+
+def _written_tables(sql):
+    """Return the names of the tables an SQL statement may write.
+
+    Statements writing tables it can't tell, like ``TRUNCATE``, procedure
+    calls or common table expressions with DML statements, write
+    ``ALL_TABLES``.
+    """
+    if READ_RE.match(sql):
+        return []
+    match = WRITE_RE.match(sql)
+    if match is not None:
+        return [name for name in match.groups() if name]
+    if WITH_RE.match(sql) and not DML_RE.search(sql):
+        return []
+    return [ALL_TABLES]
+
+
+def _bump_written(alias, table_names):
+    bump_tables(table_names)
+    # Reads between the write and the commit may have cached the old data,
+    # there are none when the write is flushed as Django commits
+    if connections[alias].in_atomic_block:
+        transaction.on_commit(lambda: bump_tables(table_names), using=alias)
+
+
+def _bump_written_tables(conn, cursor, statement, parameters, context, executemany):
+    if context.isinsert or context.isupdate or context.isdelete:
+        table_names = [context.compiled.statement.table.name]
+    else:
+        # Textual statements
+        table_names = _written_tables(statement)
+    if table_names:
+        _bump_written(conn.engine.pool.alias, table_names)
+
+
+def _bump_executed_tables(execute, sql, params, many, context):
+    """Execute wrapper of Django's connections, bumping the tables written.
+
+    It sees the writes sending no signals, like ``QuerySet.update()``,
+    ``bulk_create()`` and raw SQL.
+    """
+    result = execute(sql, params, many, context)
+    # Those of instrumented engines are seen by ``_bump_written_tables``
+    if not isinstance(context["cursor"], InstrumentedCursor):
+        table_names = _written_tables(sql)
+        if table_names:
+            _bump_written(context["connection"].alias, table_names)
+    return result
+
+
+def listen_engine(engine):
+    event.listen(engine, "after_cursor_execute", _bump_written_tables)
+
+
+def listen_session(session_target):
+    event.listen(session_target, "do_orm_execute", execute_from_cache)
+
+
+def _model_tables(model):
+    opts = model._meta
+    return [opts.db_table] + [
+        parent._meta.db_table for parent in opts.get_parent_list()
+    ]
+
+
+def _bump_model(sender, **kwargs):
+    tables = _model_tables(sender)
+    bump_tables(tables)
+    transaction.on_commit(lambda: bump_tables(tables), using=kwargs.get("using"))
+
+
+def _bump_m2m(sender, action, **kwargs):
+    if action.startswith("post_"):
+        _bump_model(sender, **kwargs)
+
+
+def _add_execute_wrapper(sender, connection, **kwargs):
+    # First, ``execute_wrapper()`` removes the last wrapper when it exits
+    if _bump_executed_tables not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _bump_executed_tables)
+
+
+def install():
+    """Connect the signals and hooks bumping the versions of the tables.
+
+    ``AldjemyConfig.ready()`` calls it with ``ALDJEMY_RESULT_CACHE``, and
+    engines created afterwards are listened to when they are created.
+    """
+    from .core import Cache
+
+    signals.post_save.connect(_bump_model, dispatch_uid="aldjemy_result_cache")
+    signals.post_delete.connect(_bump_model, dispatch_uid="aldjemy_result_cache")
+    signals.m2m_changed.connect(_bump_m2m, dispatch_uid="aldjemy_result_cache")
+    connection_created.connect(
+        _add_execute_wrapper, dispatch_uid="aldjemy_result_cache"
+    )
+    for connection in connections.all(initialized_only=True):
+        _add_execute_wrapper(None, connection)
+    for engine in list(Cache.engines.values()):
+        if not event.contains(engine, "after_cursor_execute", _bump_written_tables):
+            listen_engine(engine)
+
+
+def uninstall():
+    """Disconnect what ``install()`` connected."""
+    from .core import Cache
+
+    signals.post_save.disconnect(dispatch_uid="aldjemy_result_cache")
+    signals.post_delete.disconnect(dispatch_uid="aldjemy_result_cache")
+    signals.m2m_changed.disconnect(dispatch_uid="aldjemy_result_cache")
+    connection_created.disconnect(dispatch_uid="aldjemy_result_cache")
+    for connection in connections.all(initialized_only=True):
+        if _bump_executed_tables in connection.execute_wrappers:
+            connection.execute_wrappers.remove(_bump_executed_tables)
+    for engine in list(Cache.engines.values()):
+        if event.contains(engine, "after_cursor_execute", _bump_written_tables):
+            event.remove(engine, "after_cursor_execute", _bump_written_tables)
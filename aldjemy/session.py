@@ -1,19 +1,470 @@
+import contextlib
+import functools
+import logging
+import random
+import re
+
+from asgiref.local import Local
+from asgiref.sync import sync_to_async
+from django.apps import apps
 from django.conf import settings
-from django.db import connections
-from sqlalchemy import orm
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from sqlalchemy import event, orm
+from sqlalchemy.sql import Delete, Insert, Update
+from sqlalchemy.sql.util import find_tables
 
 from .core import get_engine
+from .result_cache import CachingQuery, listen_session
+from .wrapper import InstrumentedCursor
 
 SQLALCHEMY_USE_FUTURE = getattr(settings, "ALDJEMY_SQLALCHEMY_USE_FUTURE", None)
 
+# The savepoint statements of Django, with the quoted name of the savepoint
+SAVEPOINT_RE = re.compile(
+    r"\s*(SAVEPOINT|RELEASE|ROLLBACK TO)\s+(?:SAVEPOINT\s+)?(\S+)", re.IGNORECASE
+)
+
+logger = logging.getLogger("aldjemy")
+_scopes = Local()
+
+
+@functools.lru_cache(maxsize=None)
+def get_sessionmaker(engine, batch_flush=False):
+    """Return the session factory of an engine, built once."""
+    kwargs = {"bind": engine}
+    result_cache = getattr(settings, "ALDJEMY_RESULT_CACHE", None)
+    if result_cache:
+        kwargs["query_cls"] = CachingQuery
+    if SQLALCHEMY_USE_FUTURE is not None:
+        kwargs["future"] = SQLALCHEMY_USE_FUTURE  # pragma: no cover
+    if batch_flush:
+        kwargs["class_"] = BatchSession
+    session = orm.sessionmaker(**kwargs)
+    if result_cache:
+        listen_session(session)
+    return session
+
 
 def get_session(alias="default", recreate=False, **kwargs):
+    """Return the session of the current thread's connection of ``alias``.
+
+    It is created on first use, and again after the connection was
+    reopened or with ``recreate``.
+    """
     connection = connections[alias]
-    if not hasattr(connection, "sa_session") or recreate:
-        engine = get_engine(alias, **kwargs)
-        kwargs = {"bind": engine}
+    session = vars(connection).get("sa_session")
+    if session is None or recreate:
+        batch_flush = getattr(settings, "ALDJEMY_BATCH_FLUSH", False)
+        maker = get_sessionmaker(get_engine(alias, **kwargs), batch_flush)
+        if batch_flush:
+            session = maker(info={"alias": alias, "savepoints": {}})
+            if follow_transaction not in connection.execute_wrappers:
+                connection.execute_wrappers.insert(0, follow_transaction)
+        else:
+            session = maker()
+            if follow_transaction in connection.execute_wrappers:
+                connection.execute_wrappers.remove(follow_transaction)
+        connection.sa_session = session
+    return session
+
+
+def clear_sessions():
+    """Close the sessions of the current thread's connections.
+
+    Return the number of objects their identity maps held, keyed by alias
+    (``"routing"`` for the routing session). It is logged, as a warning
+    above ``ALDJEMY_IDENTITY_MAP_WARNING`` objects.
+    """
+    threshold = getattr(settings, "ALDJEMY_IDENTITY_MAP_WARNING", None)
+    sizes = {}
+    for connection in connections.all(initialized_only=True):
+        for name, label in [
+            ("sa_session", connection.alias),
+            ("sa_routing_session", "routing"),
+        ]:
+            session = vars(connection).get(name)
+            if session is None:
+                continue
+            sizes[label] = size = len(session.identity_map)
+            session.close()
+            if threshold is not None and size > threshold:
+                logger.warning("%d objects in the %s session", size, label)
+            else:
+                logger.debug("%d objects in the %s session", size, label)
+    return sizes
+
+
+@contextlib.contextmanager
+def session_scope(alias="default"):
+    """Yield the session of ``alias``, close the sessions at the end.
+
+    The sessions live as long as their connection, which can be kept
+    across requests with ``CONN_MAX_AGE``, and so would their identity
+    maps. Requests, tasks and jobs run in a scope start with empty sessions
+    and don't keep their objects. Nested scopes close the sessions at the
+    end of the outermost one. It is a decorator too.
+    """
+    depth = getattr(_scopes, "depth", 0)
+    _scopes.depth = depth + 1
+    try:
+        yield get_session(alias)
+    finally:
+        _scopes.depth = depth
+        if not depth:
+            clear_sessions()
+
+
+class BatchSession(orm.Session):
+    """The session of ``ALDJEMY_BATCH_FLUSH``.
+
+    It doesn't autoflush in Django's atomic blocks: its pending changes are
+    flushed before Django creates or releases a savepoint, so Django's
+    savepoints cover the writes of the session, and when the outermost block
+    commits, in a transaction of their own. Rolling back a savepoint
+    expunges the objects added since and expires the others, like
+    ``Session.rollback()`` does for the whole transaction. Django sends
+    savepoint statements through ``follow_transaction``, one of its
+    ``execute_wrappers``, and has no hook to follow the commits and
+    rollbacks of the outermost block: the commit runs an ``on_commit``
+    callback, and the session is rolled back when it, or the connection, is
+    used again after a rollback.
+    """
+
+    @property
+    def autoflush(self):
+        connection = connections[self.info["alias"]]
+        return self._autoflush_enabled and not connection.in_atomic_block
+
+    @autoflush.setter
+    def autoflush(self, value):
+        self._autoflush_enabled = value
+
+    def join_transaction(self, discard=True):
+        """Follow the commit of the Django transaction the session is in.
+
+        With ``discard``, roll back the session if the transaction it
+        followed was rolled back.
+        """
+        connection = connections[self.info["alias"]]
+        current = self.info.get("django_transaction")
+        if current is not None and current.rolled_back():
+            del self.info["django_transaction"]
+            self.info["savepoints"].clear()
+            if discard:
+                self.rollback()
+            current = None
+        if current is None and connection.in_atomic_block:
+            current = self.info["django_transaction"] = DjangoTransaction(self)
+            transaction.on_commit(current, using=connection.alias)
+
+    def rollback_to_savepoint(self, name):
+        identities = self.info["savepoints"].pop(name, None)
+        if identities is None or not self.is_active:
+            # The transaction of the session began after the savepoint, or a
+            # flush failed and the session must be rolled back
+            self.rollback()
+            return
+        for obj in list(self.new):
+            self.expunge(obj)
+        for key, obj in list(self.identity_map.items()):
+            if key not in identities:
+                self.expunge(obj)
+        for obj in list(self.deleted):
+            self.add(obj)
+        self.expire_all()
+
+
+class DjangoTransaction:
+    """The ``on_commit`` callback committing a batch session."""
+
+    def __init__(self, session):
+        self.session = session
+        self.connection = connections[session.info["alias"]]
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        session = self.session
+        if session.info.get("django_transaction") is not self:
+            return
+        del session.info["django_transaction"]
+        session.info["savepoints"].clear()
+        if not session.in_transaction():
+            return
+        try:
+            with transaction.atomic(using=self.connection.alias):
+                session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    def rolled_back(self):
+        """Return whether Django dropped the callback, rolling back."""
+        return not self.done and all(
+            entry[1] is not self for entry in self.connection.run_on_commit
+        )
+
+
+def _join_transaction(session, *args):
+    session.join_transaction()
+
+
+def _join_executed_transaction(orm_execute_state):
+    orm_execute_state.session.join_transaction()
+
+
+def _join_begun_transaction(session, *args):
+    # Nothing to discard in the transaction the session just began
+    session.join_transaction(discard=False)
+
+
+event.listen(BatchSession, "before_attach", _join_transaction)
+event.listen(BatchSession, "do_orm_execute", _join_executed_transaction)
+event.listen(BatchSession, "after_begin", _join_begun_transaction)
+
+
+def follow_transaction(execute, sql, params, many, context):
+    """Execute wrapper following the savepoints of Django in batch sessions."""
+    connection = context["connection"]
+    session = vars(connection).get("sa_session")
+    if not isinstance(session, BatchSession) or isinstance(
+        context["cursor"], InstrumentedCursor
+    ):
+        return execute(sql, params, many, context)
+    session.join_transaction()
+    match = SAVEPOINT_RE.match(sql)
+    if match is None:
+        return execute(sql, params, many, context)
+    statement, name = match.groups()
+    statement = statement.upper()
+    if statement == "ROLLBACK TO":
+        result = execute(sql, params, many, context)
+        session.rollback_to_savepoint(name)
+        if connection.in_atomic_block:
+            # The callback of the savepoint is dropped with it
+            session.info.pop("django_transaction", None)
+            session.join_transaction(discard=False)
+        return result
+    if session.in_transaction():
+        try:
+            # Rolling back to the savepoint must keep the changes made before
+            session.flush()
+        except Exception:
+            session.rollback()
+            if statement == "RELEASE":
+                rollback = connection.ops.savepoint_rollback_sql(name)
+                execute(rollback, None, False, context)
+            raise
+    result = execute(sql, params, many, context)
+    if statement == "RELEASE":
+        session.info["savepoints"].pop(name, None)
+    elif session.in_transaction():
+        session.info["savepoints"][name] = set(session.identity_map.keys())
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def _models_by_table():
+    return {
+        model._meta.db_table: model
+        for model in apps.get_models(include_auto_created=True)
+        if not model._meta.proxy
+    }
+
+
+def _get_model(mapper, clause):
+    """Return the Django model a statement is about, if any."""
+    if mapper is not None:
+        model = getattr(mapper.class_, "__model__", None)
+        if model is not None:
+            return model
+        table = mapper.local_table
+    else:
+        tables = find_tables(clause, include_crud=True) if clause is not None else []
+        if not tables:
+            return None
+        table = tables[0]
+    return _models_by_table().get(getattr(table, "name", None))
+
+
+class RoutingSession(orm.Session):
+    """Session choosing the database of each statement with the routers.
+
+    Queries use ``router.db_for_read`` and flushes and DML statements use
+    ``router.db_for_write``, evaluated for every statement. Reads of an
+    alias in ``replicas`` are spread randomly across its replicas.
+
+    With ``pin_after_write``, reads use the write database once the session
+    wrote, to see its own writes, until the session commits, rolls back or
+    is closed, or the request finishes.
+    """
+
+    def __init__(self, replicas=None, pin_after_write=True, **kwargs):
+        result_cache = getattr(settings, "ALDJEMY_RESULT_CACHE", None)
+        if result_cache:
+            kwargs.setdefault("query_cls", CachingQuery)
+        super().__init__(**kwargs)
+        if result_cache:
+            listen_session(self)
+        self.replicas = replicas or {}
+        self.pin_after_write = pin_after_write
+        self.pinned = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        model = _get_model(mapper, clause)
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self.pinned = self.pin_after_write
+            alias = router.db_for_write(model) if model else DEFAULT_DB_ALIAS
+        elif self.pinned:
+            alias = router.db_for_write(model) if model else DEFAULT_DB_ALIAS
+        else:
+            alias = router.db_for_read(model) if model else DEFAULT_DB_ALIAS
+            if self.replicas.get(alias):
+                alias = random.choice(self.replicas[alias])
+        return get_engine(alias)
+
+    def close(self):
+        super().close()
+        self.pinned = False
+
+
+def _unpin(session, *args):
+    session.pinned = False
+
+
+event.listen(RoutingSession, "after_commit", _unpin)
+event.listen(RoutingSession, "after_rollback", _unpin)
+
+
+def unpin_routing_session(sender, **kwargs):
+    """Read the replicas again in the next request of the thread.
+
+    Connected to ``request_finished``, for the requests which don't go
+    through ``AldjemySessionMiddleware``.
+    """
+    session = vars(connections[DEFAULT_DB_ALIAS]).get("sa_routing_session")
+    if session is not None:
+        session.pinned = False
+
+
+def get_routing_session(recreate=False):
+    """Return the routing session of the current thread.
+
+    It is kept on the default connection, like ``get_session`` does.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if not hasattr(connection, "sa_routing_session") or recreate:
+        kwargs = {"replicas": getattr(settings, "ALDJEMY_READ_REPLICAS", None)}
         if SQLALCHEMY_USE_FUTURE is not None:
             kwargs["future"] = SQLALCHEMY_USE_FUTURE  # pragma: no cover
-        session = orm.sessionmaker(**kwargs)
-        connection.sa_session = session()
-    return connection.sa_session
+        connection.sa_routing_session = RoutingSession(**kwargs)
+    return connection.sa_routing_session
+
+
+def server_side_cursor_block(engine):
+    """Return the context in which an engine can fetch with a server side cursor.
+
+    PostgreSQL named cursors only live in a transaction, this is an
+    ``atomic()`` block without savepoint, joining the current one if any.
+    """
+    if engine.dialect.name == "postgresql":
+        return transaction.atomic(using=engine.pool.alias, savepoint=False)
+    return contextlib.nullcontext()
+
+
+def stream_partitions(session, statement, params=None, chunk_size=1000, **kwargs):
+    """Execute a statement, yield its rows by lists of ``chunk_size``.
+
+    Rows are fetched from the database one chunk at a time: PostgreSQL and
+    MySQL use server side cursors, SQLite cursors read rows as they are
+    fetched. ORM entities are loaded with ``yield_per``.
+
+    On PostgreSQL, the rows are fetched inside an ``atomic()`` block, see
+    ``server_side_cursor_block``. Closing the generator before the end
+    closes the cursor and leaves the block without rolling back.
+    """
+    engine = session.get_bind(clause=statement)
+    execution_options = dict(
+        kwargs.pop("execution_options", {}),
+        stream_results=True,
+        max_row_buffer=chunk_size,
+        yield_per=chunk_size,
+    )
+    with server_side_cursor_block(engine):
+        result = session.execute(
+            statement, params, execution_options=execution_options, **kwargs
+        )
+        try:
+            for partition in result.partitions(chunk_size):
+                try:
+                    yield partition
+                except GeneratorExit:
+                    return
+        finally:
+            result.close()
+
+
+def _execute(session, statement, params, kwargs):
+    result = session.execute(statement, params, **kwargs)
+    if not getattr(result, "returns_rows", True):
+        return result
+    # Fetch the rows before leaving the thread of the connection
+    return result.freeze()()
+
+
+class AsyncSession:
+    """Awaitable facade of the session of a database alias.
+
+    Calls run in Django's thread sensitive executor, so they use the same
+    connection and transaction as the ORM calls of the current context.
+    Each awaited call is a thread hop, use ``run_sync`` to run a unit of
+    work in a single one. Lazy loading from async code is not possible,
+    load the needed relationships eagerly.
+    """
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """Call ``fn`` with the session as first argument, in one hop."""
+
+        def call():
+            return fn(get_session(self.alias), *args, **kwargs)
+
+        return await sync_to_async(call, thread_sensitive=True)()
+
+    async def execute(self, statement, params=None, **kwargs):
+        """Execute a statement, return a result with all the rows fetched."""
+        return await self.run_sync(_execute, statement, params, kwargs)
+
+    async def scalars(self, statement, params=None, **kwargs):
+        result = await self.execute(statement, params, **kwargs)
+        return result.scalars()
+
+    async def scalar(self, statement, params=None, **kwargs):
+        result = await self.execute(statement, params, **kwargs)
+        return result.scalar()
+
+    async def get(self, entity, ident, **kwargs):
+        return await self.run_sync(lambda session: session.get(entity, ident, **kwargs))
+
+    async def stream(self, statement, params=None, *, chunk_size=1000, **kwargs):
+        """Iterate over the rows of a statement, fetched by chunks.
+
+        Each chunk is fetched in one hop, see ``stream_partitions``.
+        """
+        partitions = await self.run_sync(
+            stream_partitions, statement, params, chunk_size, **kwargs
+        )
+        next_partition = sync_to_async(next, thread_sensitive=True)
+        try:
+            while (rows := await next_partition(partitions, None)) is not None:
+                for row in rows:
+                    yield row
+        finally:
+            await sync_to_async(partitions.close, thread_sensitive=True)()
+
+
+def get_async_session(alias="default"):
+    """Return an awaitable facade of ``get_session(alias)``."""
+    return AsyncSession(alias)
@@ -1,24 +1,38 @@
-from .wrapper import Wrapper
+import datetime
 
+from sqlalchemy.dialects.sqlite import DATETIME, TIME
+from sqlalchemy.types import DateTime, Time
 
-class SqliteWrapper(Wrapper):
-    def wrapper(self, obj):
-        return sqlite_wrapper(obj)
 
+def _passthrough(process, python_type):
+    """Skip parsing values already converted by Django's sqlite3 converters."""
 
-def sqlite_wrapper(func):
-    from django.db.backends.sqlite3.base import Database
+    def result_processor(value):
+        if value is None or isinstance(value, python_type):
+            return value
+        return process(value)
 
-    def null_converter(s):
-        if isinstance(s, bytes):
-            return s.decode("utf-8")
-        return s
+    return result_processor
 
-    def wrapper(*args, **kwargs):
-        converter = Database.converters.pop("DATETIME")
-        Database.register_converter("datetime", null_converter)
-        res = func(*args, **kwargs)
-        Database.register_converter("DATETIME", converter)
-        return res
 
-    return wrapper
+class DjangoDateTime(DATETIME):
+    def result_processor(self, dialect, coltype):
+        process = super().result_processor(dialect, coltype)
+        return _passthrough(process, datetime.datetime)
+
+
+class DjangoTime(TIME):
+    def result_processor(self, dialect, coltype):
+        process = super().result_processor(dialect, coltype)
+        return _passthrough(process, datetime.time)
+
+
+def configure_dialect(dialect):
+    """Adapt a SQLite dialect to the connections opened by Django.
+
+    Django registers process-wide sqlite3 converters that parse columns
+    declared as ``datetime`` or ``time``. The dialect's own types only parse
+    strings, so results that went through the converters are passed as is.
+    """
+    dialect.colspecs = dict(dialect.colspecs)
+    dialect.colspecs.update({DateTime: DjangoDateTime, Time: DjangoTime})
@@ -1,7 +1,29 @@
+from decimal import Decimal
+
 from django.apps import apps
 from django.conf import settings
-from sqlalchemy import Column, ForeignKey, Table, types
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models.fields import AutoFieldMixin
+from django.db.models.functions import Now
+from sqlalchemy import (
+    CheckConstraint,
+    Column,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    Table,
+    UniqueConstraint,
+    and_,
+    func,
+    literal,
+    not_,
+    or_,
+    types,
+)
 from sqlalchemy.dialects.postgresql import ARRAY, DATERANGE, JSONB, UUID
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.compiler import compiles
 
 
 def simple(typ):
@@ -24,10 +46,42 @@ def foreign_key(field):
     if target_field is None:
         target_field = target.pk.column
 
-    target_internal_type = target.get_field(target_field).get_internal_type()
-    target_type = DATA_TYPES[target_internal_type](field)
+    target_model_field = target.get_field(target_field)
+    target_internal_type = target_model_field.get_internal_type()
+    target_type = DATA_TYPES[target_internal_type](target_model_field)
+    if isinstance(target_type, tuple):
+        # The target is itself a foreign key, like the parent link of a child
+        target_type = target_type[0]
+
+    return target_type, ForeignKey("%s.%s" % (target_table, target_model_field.column))
+
+
+def _deferrable(item):
+    """Return a foreign key checked at the end of transactions, like Django's."""
+    if not isinstance(item, ForeignKey):
+        return item
+    return ForeignKey(
+        item.target_fullname,
+        deferrable=True,
+        initially="DEFERRED",
+        info={"aldjemy_deferrable": True},
+    )
 
-    return target_type, ForeignKey("%s.%s" % (target_table, target_field))
+
+def _no_deferrability(constraint):
+    return ""
+
+
+@compiles(ForeignKeyConstraint, "mysql")
+def _compile_mysql_foreign_key(element, compiler, **kw):
+    # MySQL has no deferrable constraints. The clause is left out of this
+    # compilation only, the constraint is shared with the other dialects.
+    if any(fk.info.get("aldjemy_deferrable") for fk in element.elements):
+        compiler.define_constraint_deferrability = _no_deferrability
+    try:
+        return compiler.visit_foreign_key_constraint(element, **kw)
+    finally:
+        vars(compiler).pop("define_constraint_deferrability", None)
 
 
 def array_type(field):
@@ -58,13 +112,17 @@ DATA_TYPES = {
     "FloatField": simple(types.Float),
     "IntegerField": simple(types.Integer),
     "BigIntegerField": simple(types.BigInteger),
+    "BinaryField": simple(types.LargeBinary),
     "IPAddressField": lambda field: types.CHAR(length=15),
+    "GenericIPAddressField": lambda field: types.CHAR(length=39),
     "NullBooleanField": simple(types.Boolean),
     "OneToOneField": foreign_key,
     "ForeignKey": foreign_key,
+    "PositiveBigIntegerField": simple(types.BigInteger),
     "PositiveIntegerField": simple(types.Integer),
     "PositiveSmallIntegerField": simple(types.SmallInteger),
     "SlugField": varchar,
+    "SmallAutoField": simple(types.SmallInteger),
     "SmallIntegerField": simple(types.SmallInteger),
     "TextField": simple(types.Text),
     "TimeField": simple(types.Time),
@@ -76,40 +134,309 @@ DATA_TYPES = {
 }
 
 
-def generate_tables(metadata):
-    # Update with user specified data types
-    COMBINED_DATA_TYPES = dict(DATA_TYPES)
-    COMBINED_DATA_TYPES.update(getattr(settings, "ALDJEMY_DATA_TYPES", {}))
+# NumPy dtype and ``array`` typecode of the columns fetched by
+# ``fetch_columns``, by the SQLAlchemy types above. Subclasses come first.
+COLUMN_DTYPES = [
+    (types.Boolean, "bool", "b"),
+    (types.SmallInteger, "int16", "h"),
+    (types.BigInteger, "int64", "q"),
+    # Also the type of COUNT() and of SQLite integers, which have 64 bits
+    (types.Integer, "int64", "q"),
+    (types.Float, "float64", "d"),
+    (types.DateTime, "datetime64[us]", None),
+    (types.Date, "datetime64[D]", None),
+]
 
-    models = apps.get_models(include_auto_created=True)
-    for model in models:
-        name = model._meta.db_table
-        qualname = (metadata.schema + "." + name) if metadata.schema else name
-        if qualname in metadata.tables or model._meta.proxy:
+
+def get_column_dtype(typ):
+    """Return the NumPy dtype and ``array`` typecode of a column type.
+
+    They are None for the types stored as Python objects.
+    """
+    for base, dtype, typecode in COLUMN_DTYPES:
+        if isinstance(typ, base):
+            return dtype, typecode
+    return None, None
+
+
+def get_data_types():
+    """Return the built-in data types updated with ``ALDJEMY_DATA_TYPES``."""
+    combined = dict(DATA_TYPES)
+    combined.update(getattr(settings, "ALDJEMY_DATA_TYPES", {}))
+    return combined
+
+
+# Lookups of the conditions of indexes and constraints, other lookups and
+# expressions are not translated
+LOOKUPS = {
+    "exact": lambda column, value: column == value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+    "in": lambda column, value: column.in_(value),
+    "isnull": lambda column, value: column.is_(None) if value else column.isnot(None),
+}
+LITERAL_TYPES = (str, int, float, Decimal, type(None), list, tuple)
+
+
+def _get_column(model, table, name):
+    return table.c[model._meta.get_field(name).column]
+
+
+def _condition(model, table, q):
+    """Translate a ``Q`` object to an expression of the columns of ``table``.
+
+    Raise ``NotImplementedError`` when it has other lookups than ``LOOKUPS``,
+    spans relations, or compares with expressions other than ``F``.
+    """
+    clauses = []
+    for child in q.children:
+        if isinstance(child, models.Q):
+            clauses.append(_condition(model, table, child))
             continue
-        columns = []
-        model_fields = [
-            (f, f.model if f.model != model else None)
-            for f in model._meta.get_fields()
-            if not f.is_relation or f.one_to_one or (f.many_to_one and f.related_model)
-        ]
-        private_fields = model._meta.private_fields
-        for field, parent_model in model_fields:
-            if field not in private_fields:
-                if parent_model:
-                    continue
+        lookup, value = child
+        name, _, lookup_name = lookup.partition("__")
+        if (lookup_name or "exact") not in LOOKUPS:
+            raise NotImplementedError("Unsupported lookup %r" % lookup)
+        if isinstance(value, models.F):
+            value = _get_column(model, table, value.name)
+        elif isinstance(value, models.Value):
+            value = value.value
+        elif not isinstance(value, LITERAL_TYPES):
+            raise NotImplementedError("Unsupported value %r" % (value,))
+        column = _get_column(model, table, name)
+        clauses.append(LOOKUPS[lookup_name or "exact"](column, value))
+    if q.connector == models.Q.AND:
+        clause = and_(*clauses)
+    elif q.connector == models.Q.OR:
+        clause = or_(*clauses)
+    else:
+        raise NotImplementedError("Unsupported connector %r" % q.connector)
+    return not_(clause) if q.negated else clause
 
-                try:
-                    internal_type = field.get_internal_type()
-                except AttributeError:
-                    continue
 
-                if internal_type in COMBINED_DATA_TYPES and hasattr(field, "column"):
-                    typ = COMBINED_DATA_TYPES[internal_type](field)
-                    if not isinstance(typ, (list, tuple)):
-                        typ = [typ]
-                    columns.append(
-                        Column(field.column, *typ, primary_key=field.primary_key)
+def _index_kwargs(model, table, condition=None, include=(), opclasses=(), columns=()):
+    kwargs = {}
+    if condition is not None:
+        where = _condition(model, table, condition)
+        kwargs.update(postgresql_where=where, sqlite_where=where)
+    if include:
+        kwargs.update(
+            postgresql_include=[_get_column(model, table, f).name for f in include]
+        )
+    if opclasses:
+        kwargs.update(
+            postgresql_ops={
+                column.name: opclass for column, opclass in zip(columns, opclasses)
+            }
+        )
+    return kwargs
+
+
+def _server_default(field):
+    db_default = getattr(field, "db_default", models.NOT_PROVIDED)  # Django 5.0
+    if isinstance(db_default, models.Value):
+        db_default = db_default.value
+    if isinstance(db_default, Now):
+        return func.current_timestamp()
+    if isinstance(db_default, (str, int, float, Decimal)):
+        return literal(db_default)
+    return None
+
+
+def _generate_meta(model, table):
+    """Add the indexes and constraints of the model's ``Meta`` to the table.
+
+    Those using expressions or conditions which can't be translated are
+    left out, like those of fields not in the table.
+    """
+    opts = model._meta
+    for fields in opts.unique_together:
+        try:
+            columns = [_get_column(model, table, name) for name in fields]
+        except (FieldDoesNotExist, KeyError):
+            continue
+        table.append_constraint(UniqueConstraint(*columns))
+
+    for index in opts.indexes:
+        if index.expressions:
+            continue
+        try:
+            columns = [
+                _get_column(model, table, name) for name, _ in index.fields_orders
+            ]
+            kwargs = _index_kwargs(
+                model,
+                table,
+                index.condition,
+                index.include,
+                index.opclasses,
+                columns,
+            )
+        except (FieldDoesNotExist, KeyError, NotImplementedError):
+            continue
+        Index(
+            index.name,
+            *(
+                column.desc() if order == "DESC" else column
+                for column, (_, order) in zip(columns, index.fields_orders)
+            ),
+            **kwargs,
+        )
+
+    for constraint in opts.constraints:
+        try:
+            if isinstance(constraint, models.UniqueConstraint):
+                if constraint.expressions:
+                    continue
+                columns = [
+                    _get_column(model, table, name) for name in constraint.fields
+                ]
+                kwargs = _index_kwargs(
+                    model,
+                    table,
+                    constraint.condition,
+                    constraint.include,
+                    constraint.opclasses,
+                    columns,
+                )
+                if kwargs:
+                    # Created as unique indexes, like Django does
+                    Index(constraint.name, *columns, unique=True, **kwargs)
+                    continue
+                if constraint.deferrable is not None:
+                    kwargs.update(
+                        deferrable=True,
+                        initially=(
+                            "DEFERRED"
+                            if constraint.deferrable == models.Deferrable.DEFERRED
+                            else "IMMEDIATE"
+                        ),
+                    )
+                table.append_constraint(
+                    UniqueConstraint(*columns, name=constraint.name, **kwargs)
+                )
+            elif isinstance(constraint, models.CheckConstraint):
+                # ``check`` was renamed ``condition`` in Django 5.1
+                condition = getattr(constraint, "condition", None)
+                if condition is None:
+                    condition = constraint.check
+                table.append_constraint(
+                    CheckConstraint(
+                        _condition(model, table, condition), name=constraint.name
                     )
+                )
+        except (FieldDoesNotExist, KeyError, NotImplementedError):
+            continue
+
+
+class DatabaseType(types.UserDefinedType):
+    """A column type given by its SQL, the type Django creates for a field."""
+
+    cache_ok = True
+
+    def __init__(self, db_type):
+        self.db_type = db_type
+
+    def get_col_spec(self, **kw):
+        return self.db_type
+
 
-        Table(name, metadata, *columns)
+def _database_type(field, typ, connection):
+    """Return the type of a field in the tables ``migrate`` creates.
+
+    Fields without a data type, and those whose type the database can't
+    create, fall back to the type Django creates.
+    """
+    # Settings modules import this one to extend the data types, before
+    # ``core`` can read them
+    from .core import get_engine
+
+    dialect = get_engine(connection.alias).dialect
+    column_type = typ[0] if isinstance(typ, (list, tuple)) else typ
+    if column_type is not None:
+        if isinstance(field, AutoFieldMixin) and dialect.name == "sqlite":
+            # Only INTEGER primary keys are autoincremented, as Django knows
+            column_type = types.Integer()
+        else:
+            try:
+                column_type.compile(dialect=dialect)
+            except CompileError:
+                column_type = None
+    if column_type is None:
+        db_type = field.db_type(connection)
+        if db_type is None:
+            return None
+        column_type = DatabaseType(db_type)
+    if isinstance(typ, (list, tuple)):
+        return [column_type, *typ[1:]]
+    return column_type
+
+
+def generate_table(metadata, model, data_types, connection=None):
+    """Add the table of a single Django model to the metadata.
+
+    With a Django ``connection``, the table is the one ``migrate`` creates
+    in its database: the columns have its types, including the fields
+    without a data type, nullability, uniqueness, indexes and database
+    defaults, the foreign keys are deferred, and the indexes and constraints
+    of the model's ``Meta`` are added.
+    """
+    name = model._meta.db_table
+    qualname = (metadata.schema + "." + name) if metadata.schema else name
+    if qualname in metadata.tables or model._meta.proxy:
+        return metadata.tables.get(qualname)
+    columns = []
+    model_fields = [
+        (f, f.model if f.model != model else None)
+        for f in model._meta.get_fields()
+        if not f.is_relation or f.one_to_one or (f.many_to_one and f.related_model)
+    ]
+    private_fields = model._meta.private_fields
+    for field, parent_model in model_fields:
+        if field not in private_fields:
+            if parent_model:
+                continue
+
+            try:
+                internal_type = field.get_internal_type()
+            except AttributeError:
+                continue
+
+            if not hasattr(field, "column"):
+                continue
+            typ = None
+            if internal_type in data_types:
+                typ = data_types[internal_type](field)
+            kwargs = {}
+            if connection is not None:
+                typ = _database_type(field, typ, connection)
+                kwargs.update(
+                    nullable=field.null,
+                    unique=field.unique and not field.primary_key,
+                    index=field.db_index and not field.unique,
+                    server_default=_server_default(field),
+                )
+            if typ is not None:
+                if not isinstance(typ, (list, tuple)):
+                    typ = [typ]
+                if connection is not None:
+                    typ = [_deferrable(item) for item in typ]
+                columns.append(
+                    Column(field.column, *typ, primary_key=field.primary_key, **kwargs)
+                )
+
+    table = Table(name, metadata, *columns)
+    if connection is not None:
+        _generate_meta(model, table)
+    return table
+
+
+def generate_tables(metadata):
+    # Update with user specified data types
+    data_types = get_data_types()
+
+    models = apps.get_models(include_auto_created=True)
+    for model in models:
+        generate_table(metadata, model, data_types)
@@ -0,0 +1,79 @@
+"""Create test databases from the generated tables instead of migrations.
+
+Replaying the migrations of a large project takes much longer than creating
+its final schema, which ``MetaData.create_all`` does in a single pass.
+Data migrations are not run, only the ``post_migrate`` signal is sent.
+"""
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+from sqlalchemy import MetaData
+
+from .core import get_engine
+from .table import generate_table, get_data_types
+
+__all__ = ["create_all", "create_test_db", "get_metadata"]
+
+
+def get_metadata(using=DEFAULT_DB_ALIAS, metadata=None):
+    """Return the metadata of the tables ``migrate`` creates in ``using``.
+
+    The fields without a data type, or whose type the database can't
+    create, have the type Django creates.
+    """
+    if metadata is None:
+        metadata = MetaData()
+    data_types = get_data_types()
+    for model in apps.get_models(include_auto_created=True):
+        opts = model._meta
+        if opts.proxy or not opts.managed:
+            continue
+        if opts.auto_created and not opts.auto_created._meta.managed:
+            continue
+        if router.allow_migrate_model(using, model):
+            generate_table(metadata, model, data_types, connections[using])
+    return metadata
+
+
+def create_all(using=DEFAULT_DB_ALIAS, verbosity=0):
+    """Create the tables of the models in ``using``, as ``migrate`` would.
+
+    The migrations are recorded as applied, so that ``migrate`` only runs
+    the ones added later.
+    """
+    connection = connections[using]
+    metadata = get_metadata(using)
+    recorder = MigrationRecorder(connection)
+    # Created with the schema editor, which SQLite can't use in a transaction
+    recorder.ensure_schema()
+    with transaction.atomic(using=using):
+        metadata.create_all(get_engine(using))
+        loader = MigrationLoader(connection, ignore_no_migrations=True)
+        for app_label, name in loader.disk_migrations:
+            if (app_label, name) not in loader.applied_migrations:
+                recorder.record_applied(app_label, name)
+    emit_post_migrate_signal(verbosity, False, using)
+
+
+def create_test_db(using=DEFAULT_DB_ALIAS, verbosity=1, keepdb=False):
+    """Create the test database of ``using`` with ``create_all``.
+
+    Like ``connection.creation.create_test_db``, without the migrations.
+    Return the name of the original database, to pass to
+    ``connection.creation.destroy_test_db``.
+    """
+    connection = connections[using]
+    creation = connection.creation
+    old_name = connection.settings_dict["NAME"]
+    test_name = creation._create_test_db(verbosity, False, keepdb)
+    connection.close()
+    settings.DATABASES[using]["NAME"] = test_name
+    connection.settings_dict["NAME"] = test_name
+    create_all(using, verbosity=max(verbosity - 1, 0))
+    call_command("createcachetable", database=using)
+    return old_name
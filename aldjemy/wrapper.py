@@ -1,23 +1,146 @@
+import functools
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger("django.db.backends")
+
+
 class Wrapper:
-    "Wrapper to disable commit in sqla"
+    """Proxy of a DBAPI connection, disabling commit and rollback in sqla.
+
+    Transactions belong to Django. The methods on the execution path are
+    defined explicitly, any other attribute is read from the connection.
+    """
+
+    __slots__ = ("obj",)
 
     def __init__(self, obj):
         self.obj = obj
 
+    def cursor(self, *args, **kwargs):
+        return self.obj.cursor(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self.obj.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.obj.executemany(*args, **kwargs)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
     def __getattr__(self, attr):
-        if attr in ["commit", "rollback"]:
-            return lambda *args, **kwargs: None
-        obj = getattr(self.obj, attr)
-        if attr not in ["cursor", "execute"]:
-            return obj
-        if attr == "cursor":
-            return type(self)(obj)
-        return self.wrapper(obj)
-
-    def wrapper(self, obj):
-        "Implement if you need to make your customized wrapper"
-        return obj
-
-    def __call__(self, *args, **kwargs):
-        self.obj = self.obj(*args, **kwargs)
-        return self
+        return getattr(self.obj, attr)
+
+
+class InstrumentedCursor:
+    """Proxy of a DBAPI cursor running statements like Django's cursors do.
+
+    Statements go through the connection's ``execute_wrappers`` and are
+    added to its query log when queries are logged, with their parameters,
+    duration and row count.
+    """
+
+    __slots__ = ("cursor", "db")
+
+    def __init__(self, cursor, db):
+        self.cursor = cursor
+        self.db = db
+
+    def execute(self, sql, params=None):
+        return self._run(sql, params, False, self._execute)
+
+    def executemany(self, sql, param_list):
+        return self._run(sql, param_list, True, self._executemany)
+
+    def _run(self, sql, params, many, executor):
+        context = {"connection": self.db, "cursor": self}
+        for wrapper in reversed(self.db.execute_wrappers):
+            executor = functools.partial(wrapper, executor)
+        if not self.db.queries_logged:
+            return executor(sql, params, many, context)
+        start = time.monotonic()
+        try:
+            return executor(sql, params, many, context)
+        finally:
+            duration = time.monotonic() - start
+            self._log(sql, params, many, duration)
+
+    def _execute(self, sql, params, *ignored_wrapper_args):
+        if params is None:
+            return self.cursor.execute(sql)
+        return self.cursor.execute(sql, params)
+
+    def _executemany(self, sql, param_list, *ignored_wrapper_args):
+        return self.cursor.executemany(sql, param_list)
+
+    def _log(self, sql, params, many, duration):
+        rowcount = self.cursor.rowcount
+        if many:
+            try:
+                sql = "%s times: %s" % (len(params), sql)
+            except TypeError:
+                sql = "? times: %s" % sql
+        self.db.queries_log.append(
+            {
+                "sql": sql,
+                "params": params,
+                "time": "%.3f" % duration,
+                "rowcount": rowcount,
+            }
+        )
+        logger.debug(
+            "(%.3f) %s; args=%s; alias=%s",
+            duration,
+            sql,
+            params,
+            self.db.alias,
+            extra={
+                "duration": duration,
+                "sql": sql,
+                "params": params,
+                "alias": self.db.alias,
+                "rowcount": rowcount,
+            },
+        )
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+
+class InstrumentedWrapper(Wrapper):
+    """Wrapper whose cursors are instrumented, see ``InstrumentedCursor``."""
+
+    __slots__ = ("db",)
+
+    def __init__(self, obj, db):
+        super().__init__(obj)
+        self.db = db
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.obj.cursor(*args, **kwargs), self.db)
+
+
+def get_wrapper(connection):
+    """Return the wrapper of a Django connection's DBAPI connection.
+
+    It is created once per DBAPI connection and kept on the Django
+    connection, next to the session. With the ``ALDJEMY_INSTRUMENT``
+    setting, its cursors are instrumented.
+    """
+    wrapper = getattr(connection, "aldjemy_wrapper", None)
+    if wrapper is None or wrapper.obj is not connection.connection:
+        if getattr(settings, "ALDJEMY_INSTRUMENT", False):
+            wrapper = InstrumentedWrapper(connection.connection, connection)
+        else:
+            wrapper = Wrapper(connection.connection)
+        connection.aldjemy_wrapper = wrapper
+    return wrapper
@@ -1,5 +1,10 @@
+import datetime
+import io
+from decimal import Decimal
+
 import pytest
-from django.db import transaction
+from django.db import connections, transaction
+from psycopg2.extras import DateRange
 from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import array
 
@@ -144,3 +149,88 @@ class TestDjangoPool:
         """DjangoPool can be created and recreated without errors."""
         pool = DjangoPool("test_alias", creator=None)
         pool.recreate()
+
+
+@pytest.mark.django_db(databases=["pg"])
+class TestBulk:
+    def test_bulk_insert_returning_pks(self):
+        rows = [{"value": {"i": i}} for i in range(3)]
+        pks = JsonModel.sa.bulk_insert(rows, chunk_size=2, return_pks=True)
+        values = JsonModel.objects.filter(pk__in=pks).order_by("pk")
+        assert [v.value for v in values] == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+    def test_upsert_returning_pks(self):
+        existing = JsonModel.objects.create(value={"old": True})
+        rows = [{"id": existing.pk, "value": {"new": True}}]
+        pks = JsonModel.sa.upsert(rows, ["id"], return_pks=True)
+        assert pks == [existing.pk]
+        existing.refresh_from_db()
+        assert existing.value == {"new": True}
+
+
+@pytest.mark.django_db(transaction=True, databases=["pg"])
+class TestStream:
+    def test_stream_uses_named_cursor(self):
+        JsonModel.objects.bulk_create(JsonModel(value={"i": i}) for i in range(5))
+        session = get_session("pg")
+        statement = select(JsonModel.sa.value).order_by(JsonModel.sa.id)
+        rows = JsonModel.sa.stream(statement, chunk_size=2)
+        assert next(rows).value == {"i": 0}
+        assert connections["pg"].in_atomic_block
+        assert [row.value["i"] for row in rows] == [1, 2, 3, 4]
+        assert not connections["pg"].in_atomic_block
+        assert session.query(JsonModel.sa).count() == 5
+
+    def test_abandoned_stream_keeps_writes(self):
+        JsonModel.objects.bulk_create(JsonModel(value={"i": i}) for i in range(5))
+        instances = JsonModel.sa.stream(chunk_size=2)
+        next(instances)
+        JsonModel.objects.create(value={"written": True})
+        instances.close()
+        assert not connections["pg"].in_atomic_block
+        assert JsonModel.objects.count() == 6
+
+
+@pytest.mark.django_db(databases=["pg"])
+class TestCopy:
+    def test_copy_from(self):
+        rows = ({"value": {"i": i, "text": "a\tb\\c\n"}} for i in range(1000))
+        assert JsonModel.sa.copy_from(rows) == 1000
+        values = JsonModel.objects.order_by("pk").values_list("value", flat=True)
+        assert values[999] == {"i": 999, "text": "a\tb\\c\n"}
+
+    def test_copy_from_types(self):
+        ranges = [DateRange(datetime.date(2020, 1, 1), datetime.date(2020, 2, 1))]
+        assert DateRangeModel.sa.copy_from([(r,) for r in ranges]) == 1
+        assert DateRangeModel.objects.get().date_range == ranges[0]
+        arrays = [[Decimal("1.5"), None], [Decimal("-2")]]
+        DecimalArrayModel.sa.copy_from([values] for values in arrays)
+        assert [obj.array for obj in DecimalArrayModel.objects.order_by("pk")] == [
+            [Decimal("1.500"), None],
+            [Decimal("-2.000")],
+        ]
+        boards = [TicTacToeBoard(board=['"x"', "o,", "{}", "NULL", None])]
+        assert TicTacToeBoard.sa.copy_from(boards, columns=["board"]) == 1
+        assert TicTacToeBoard.objects.get().board == ['"x"', "o,", "{}", "NULL", None]
+
+    def test_copy_to(self):
+        JsonModel.objects.bulk_create(JsonModel(value={"i": i}) for i in range(3))
+        statement = (
+            select(JsonModel.sa.value)
+            .where(JsonModel.sa.value["i"].as_integer().in_([0, 2]))
+            .order_by(JsonModel.sa.id)
+        )
+        out = io.StringIO()
+        assert JsonModel.sa.copy_to(statement, out) == 2
+        assert out.getvalue() == '{"i": 0}\n{"i": 2}\n'
+        out = io.StringIO()
+        JsonModel.sa.copy_to(None, out, format="csv")
+        assert len(out.getvalue().splitlines()) == 3
+
+    def test_copy_joins_atomic(self):
+        with pytest.raises(RuntimeError):
+            with transaction.atomic(using="pg"):
+                JsonModel.sa.copy_from([{"value": {}}])
+                assert JsonModel.objects.count() == 1
+                raise RuntimeError
+        assert JsonModel.objects.count() == 0
@@ -1,3 +1,4 @@
+import django
 from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -113,3 +114,79 @@ class RelatedToItemViaPrimaryKey(models.Model):
 
 class RelatedToItemViaUniqueField(models.Model):
     item = models.ForeignKey(Item, to_field="legacy_id", on_delete=models.CASCADE)
+
+
+class Place(models.Model):
+    """Root of a multi-table inheritance hierarchy loaded polymorphically."""
+
+    name = models.CharField(max_length=100)
+    tags = models.ManyToManyField("Tag", related_name="places")
+
+    aldjemy_polymorphic = True
+
+
+class Restaurant(Place):
+    serves_pizza = models.BooleanField(default=False)
+
+
+class Pizzeria(Restaurant):
+    ovens = models.IntegerField(default=1)
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100)
+
+
+# ``db_default`` was added in Django 5.0, ``condition`` replaced ``check`` in 5.1
+PRICE_DEFAULT = {"db_default": 0} if django.VERSION >= (5, 0) else {"default": 0}
+CHECK = "condition" if django.VERSION >= (5, 1) else "check"
+
+
+class Ticket(models.Model):
+    """A model with indexes and constraints, to generate them in its table."""
+
+    code = models.CharField(max_length=20, db_index=True)
+    seat = models.IntegerField(null=True)
+    price = models.IntegerField(**PRICE_DEFAULT)
+    place = models.ForeignKey(Place, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [("code", "place")]
+        indexes = [models.Index(fields=["-seat", "code"], name="ticket_seat_code")]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["place", "seat"],
+                condition=models.Q(seat__isnull=False),
+                name="ticket_unique_seat",
+            ),
+            models.CheckConstraint(
+                name="ticket_price", **{CHECK: models.Q(price__gte=0)}
+            ),
+        ]
+
+
+class Event(models.Model):
+    """A model with fields set when it is saved."""
+
+    name = models.CharField(max_length=50)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class ColorField(models.Field):
+    """A field without a data type in aldjemy."""
+
+    def db_type(self, connection):
+        return "varchar(7)"
+
+
+class Device(models.Model):
+    """A model with fields whose types depend on the database."""
+
+    id = models.SmallAutoField(primary_key=True)
+    address = models.GenericIPAddressField(null=True)
+    counter = models.PositiveBigIntegerField(default=0)
+    payload = models.BinaryField(null=True)
+    token = models.UUIDField(null=True)
+    data = models.JSONField(null=True)
+    color = ColorField(null=True)
@@ -1,25 +1,109 @@
+import datetime
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
+import django
 import pytest
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.conf import settings as django_settings
 from django.contrib.auth import get_user_model
-from django.db import connections
-from sqlalchemy import MetaData
-from sqlalchemy.orm import aliased
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F, Q, signals
+from django.utils import timezone
+from sqlalchemy import (
+    Boolean,
+    CheckConstraint,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Time,
+    UniqueConstraint,
+    bindparam,
+    case,
+    create_engine,
+    event,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+    type_coerce,
+    update,
+)
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from sqlalchemy.orm import aliased, configure_mappers, joinedload, selectinload
+from sqlalchemy.schema import CreateTable
 
-from aldjemy.core import Cache, get_connection_string, get_engine
-from aldjemy.orm import construct_models
-from aldjemy.session import get_session
+from aldjemy import codegen, core, result_cache
+from aldjemy.apps import LazySAModel, new_session, use_generated
+from aldjemy.bulk import _RowConverter
+from aldjemy.columnar import fetch_columns
+from aldjemy.core import (
+    Cache,
+    CompiledCache,
+    get_compiled_cache,
+    get_connection_string,
+    get_engine,
+)
+from aldjemy.management.commands.aldjemy_profile import profile_startup
+from aldjemy.metadata_cache import _stable_repr, get_fingerprint, load_metadata
+from aldjemy.middleware import AldjemySessionMiddleware
+from aldjemy.orm import LazyModels, construct_models
+from aldjemy.pgcopy import _format, _lines, _Reader
+from aldjemy.result_cache import FromCache, _written_tables
+from aldjemy.session import (
+    RoutingSession,
+    clear_sessions,
+    follow_transaction,
+    get_async_session,
+    get_routing_session,
+    get_session,
+    get_sessionmaker,
+    session_scope,
+    stream_partitions,
+    unpin_routing_session,
+)
+from aldjemy.table import _condition, foreign_key, generate_tables
+from aldjemy.testing import create_test_db, get_metadata
+from aldjemy.wrapper import InstrumentedWrapper, Wrapper, get_wrapper
 from aldjemy_test.sample.models import (
+    ArticleAuthorAssociation,
     Author,
     Book,
     BookProxy,
     Chapter,
+    Event,
     Item,
     Log,
     Person,
+    Pizzeria,
+    Place,
     RelatedToItemViaPrimaryKey,
     RelatedToItemViaUniqueField,
+    Restaurant,
     Review,
     StaffAuthor,
     StaffAuthorProxy,
+    Ticket,
 )
 
 User = get_user_model()
@@ -73,6 +157,21 @@ class TestAliases:
         assert connections["logs"].sa_session == session_logs
         assert session_default != session_logs
 
+    def test_sessionmaker_is_cached(self):
+        session = get_session(recreate=True)
+        assert get_session(recreate=True) is not session
+        assert type(get_session()) is type(session)
+        assert get_sessionmaker(get_engine()) is get_sessionmaker(get_engine())
+        assert get_sessionmaker(get_engine()) is not get_sessionmaker(
+            get_engine("logs")
+        )
+
+    def test_new_connection(self):
+        session = get_session()
+        new_session(sender=None, connection=connections["default"])
+        assert "sa_session" not in vars(connections["default"])
+        assert get_session() is not session
+
     @pytest.mark.django_db(databases=["default", "logs"])
     def test_logs(self):
         Log.objects.create(record="1")
@@ -82,6 +181,46 @@ class TestAliases:
         Log.sa.query().all()[0].record == "1"
 
 
+@pytest.mark.django_db(transaction=True)
+class TestColdStart:
+    def test_concurrent_first_queries(self, monkeypatch):
+        """Threads querying a cold process share one initialized engine."""
+        Book.objects.create(title="title")
+        monkeypatch.setattr(Cache, "engines", {})
+        created = []
+        initialized = []
+
+        def slow(func, calls):
+            def wrapper(*args, **kwargs):
+                calls.append(args[0])
+                # Widen the window in which the other threads arrive
+                time.sleep(0.05)
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        monkeypatch.setattr(core, "_create_engine", slow(core._create_engine, created))
+        monkeypatch.setattr(
+            core, "first_connect", slow(core.first_connect, initialized)
+        )
+        barrier = threading.Barrier(16)
+
+        def query(i):
+            barrier.wait()
+            try:
+                get_session(recreate=True)
+                return Book.sa.query().count(), get_engine()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(query, range(64)))
+        assert created == ["default"]
+        assert len(initialized) == 1
+        assert {count for count, _ in results} == {1}
+        assert {engine for _, engine in results} == {Cache.engines["default"]}
+
+
 class TestAldjemyMeta:
     @pytest.mark.django_db(databases=["logs"])
     def test_meta(self):
@@ -160,3 +299,1533 @@ class TestForeignKey:
         assert foreign_column.table is item_table
         assert foreign_column.name == "legacy_id"
         assert foreign_column.type == item_table.c.legacy_id.type
+
+
+class TestSchema:
+    @pytest.fixture(scope="class")
+    @classmethod
+    def tables(cls):
+        """The tables ``migrate`` creates, those of ``aldjemy.testing``."""
+        return get_metadata().tables
+
+    def test_columns(self, tables):
+        chapter = tables["sample_chapter"]
+        assert not chapter.c.book_id.nullable
+        assert chapter.c.book_id.index
+        (foreign_key,) = chapter.c.book_id.foreign_keys
+        assert foreign_key.initially == "DEFERRED"
+        assert tables["sample_item"].c.legacy_id.unique
+        ticket = tables["sample_ticket"]
+        assert ticket.c.seat.nullable
+        assert ticket.c.code.index
+
+    def test_runtime_tables(self):
+        chapter = Chapter.sa.__table__
+        (foreign_key,) = chapter.c.book_id.foreign_keys
+        assert not foreign_key.deferrable
+        assert not chapter.c.book_id.index
+        ticket = Ticket.sa.__table__
+        assert ticket.c.price.server_default is None
+        assert not ticket.indexes
+        assert not [c for c in ticket.constraints if c.name]
+
+    def test_deferrable_foreign_keys(self, tables):
+        create = CreateTable(tables["sample_chapter"])
+        assert "DEFERRABLE" not in str(create.compile(dialect=mysql.dialect()))
+        # The constraint is left unchanged for the other dialects
+        postgresql_ddl = str(create.compile(dialect=postgresql.dialect()))
+        assert "DEFERRABLE INITIALLY DEFERRED" in postgresql_ddl
+
+    def test_other_deferrable_foreign_keys(self):
+        metadata = MetaData()
+        Table("parent", metadata, Column("id", Integer, primary_key=True))
+        child = Table(
+            "child",
+            metadata,
+            Column("id", Integer, primary_key=True),
+            Column("parent_id", Integer, ForeignKey("parent.id", deferrable=True)),
+        )
+        ddl = str(CreateTable(child).compile(dialect=mysql.dialect()))
+        assert "DEFERRABLE" in ddl
+
+    @pytest.mark.skipif(django.VERSION < (5, 0), reason="db_default is new in 5.0")
+    def test_server_default(self, tables):
+        default = tables["sample_ticket"].c.price.server_default
+        assert default.arg.compile(compile_kwargs={"literal_binds": True}).string == "0"
+
+    def test_meta(self, tables):
+        ticket = tables["sample_ticket"]
+        indexes = {index.name: index for index in ticket.indexes}
+        seat_code = indexes["ticket_seat_code"]
+        assert [str(e) for e in seat_code.expressions] == [
+            "sample_ticket.seat DESC",
+            "sample_ticket.code",
+        ]
+        unique_seat = indexes["ticket_unique_seat"]
+        assert unique_seat.unique
+        assert str(unique_seat.dialect_options["sqlite"]["where"]) == (
+            "sample_ticket.seat IS NOT NULL"
+        )
+        (check,) = [c for c in ticket.constraints if isinstance(c, CheckConstraint)]
+        assert check.name == "ticket_price"
+        assert str(check.sqltext) == "sample_ticket.price >= :price_1"
+        (unique_together,) = [
+            c for c in ticket.constraints if isinstance(c, UniqueConstraint)
+        ]
+        assert [c.name for c in unique_together.columns] == ["code", "place_id"]
+
+    def test_unsupported_conditions(self):
+        table = Chapter.sa.__table__
+        with pytest.raises(NotImplementedError):
+            _condition(Chapter, table, Q(book__title="title"))
+        with pytest.raises(NotImplementedError):
+            _condition(Chapter, table, Q(title__startswith="a"))
+        condition = _condition(Chapter, table, ~Q(title="a") | Q(book=F("id")))
+        assert str(condition) == (
+            "sample_chapter.title != :title_1 "
+            "OR sample_chapter.book_id = sample_chapter.id"
+        )
+
+    @pytest.mark.django_db
+    def test_same_schema_as_migrate(self):
+        def describe(inspector, table):
+            indexes = inspector.get_indexes(table)
+            return {
+                "indexes": {
+                    tuple(i["column_names"]) for i in indexes if not i["unique"]
+                },
+                "unique": {tuple(i["column_names"]) for i in indexes if i["unique"]}
+                | {
+                    tuple(c["column_names"])
+                    for c in inspector.get_unique_constraints(table)
+                },
+                "checks": {c["name"] for c in inspector.get_check_constraints(table)},
+                "columns": {
+                    c["name"]: (c["nullable"], str(c["type"]), c["default"])
+                    for c in inspector.get_columns(table)
+                },
+            }
+
+        engine = create_engine("sqlite://")
+        get_metadata().create_all(engine)
+        created = inspect(engine)
+        migrated = inspect(get_engine())
+        for table in [
+            "sample_chapter",
+            "sample_ticket",
+            "sample_author_books",
+            "sample_staffauthor",
+        ]:
+            assert describe(created, table) == describe(migrated, table)
+
+    @pytest.mark.django_db
+    def test_database_types(self):
+        def columns(inspector):
+            return {
+                c["name"]: str(c["type"]).lower()
+                for c in inspector.get_columns("sample_device")
+            }
+
+        engine = create_engine("sqlite://")
+        metadata = get_metadata()
+        metadata.create_all(engine)
+        created = columns(inspect(engine))
+        migrated = columns(inspect(get_engine()))
+        assert created.keys() == migrated.keys()
+        for name in ["id", "address", "token", "data", "color"]:
+            assert created[name] == migrated[name]
+        with engine.begin() as conn:
+            conn.execute(insert(metadata.tables["sample_device"]), {"counter": 1})
+            conn.execute(insert(metadata.tables["sample_device"]), {"counter": 2})
+            ids = conn.execute(text("SELECT id FROM sample_device")).scalars()
+            assert sorted(ids) == [1, 2]
+
+    def test_create_test_db(self, django_db_blocker):
+        alias = "create_all"
+        # The settings of the connections are the same dict
+        databases = django_settings.DATABASES
+        databases[alias] = {"ENGINE": "django.db.backends.sqlite3"}
+        connections.configure_settings(databases)
+        connection = connections[alias]
+        try:
+            with django_db_blocker.unblock():
+                old_name = create_test_db(alias, verbosity=0)
+                tables = connection.introspection.table_names()
+                assert {"sample_ticket", "auth_user", "django_migrations"} <= set(
+                    tables
+                )
+                # Not allowed by the database routers
+                assert not [t for t in tables if t.startswith("pg_")]
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM django_migrations")
+                    assert cursor.fetchone()[0] > 0
+                # Created by post_migrate
+                assert ContentType.objects.db_manager(alias).get_for_model(Ticket)
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            Cache.engines.pop(alias, None)
+            del connections[alias]
+            del databases[alias]
+
+
+class TestLazyModels:
+    def test_only_related_tables_are_generated(self):
+        lazy_models = LazyModels(MetaData())
+        lazy_models.get(Chapter)
+        tables = lazy_models.metadata.tables
+        assert "sample_chapter" in tables
+        assert "sample_book" in tables
+        assert "sample_log" not in tables
+
+    def test_relationships_and_backrefs(self):
+        lazy_models = LazyModels(MetaData())
+        sa_book = lazy_models.get(Book)
+        sa_chapter = lazy_models.get(Chapter)
+        assert sa_chapter.book.property.mapper.class_ is sa_book
+        assert sa_book.chapter_set.property.mapper.class_ is sa_chapter
+
+    def test_same_attributes_as_eager_models(self):
+        lazy_models = LazyModels(MetaData())
+        sa_models = construct_models(MetaData())
+        for model in lazy_models.models:
+            lazy_attrs = lazy_models.get(model).__mapper__.attrs.keys()
+            assert set(lazy_attrs) == set(sa_models[model].__mapper__.attrs.keys())
+
+    def test_related_models_are_complete(self):
+        lazy_models = LazyModels(MetaData())
+        sa_models = construct_models(MetaData())
+        association = lazy_models.get(ArticleAuthorAssociation)
+        sa_author = association.author.property.mapper.class_
+        assert set(sa_author.__mapper__.attrs.keys()) == set(
+            sa_models[Author].__mapper__.attrs.keys()
+        )
+        assert sa_author.user.property.mapper.class_ is lazy_models.get(User)
+
+    def test_proxy_model(self):
+        lazy_models = LazyModels(MetaData())
+        assert lazy_models.get(BookProxy) is lazy_models.get(Book)
+
+    def test_concurrent_access(self):
+        lazy_models = LazyModels(MetaData())
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lazy_models.get, [Author, Book, User] * 16))
+        assert len(set(results)) == 3
+
+    def test_descriptor(self, monkeypatch):
+        lazy_models = LazyModels(MetaData())
+        monkeypatch.setattr(Book, "sa", LazySAModel(lazy_models, Book))
+        assert BookProxy.sa is lazy_models.get(Book)
+        assert Book.__dict__["sa"] is lazy_models.get(Book)
+
+    @pytest.mark.django_db
+    def test_querying(self):
+        Book.objects.create(title="book title")
+        lazy_models = LazyModels(MetaData())
+        assert get_session().query(lazy_models.get(Book)).count() == 1
+
+
+class TestLoading:
+    def strategies(self, sa_models):
+        configure_mappers()
+        return (
+            sa_models[Chapter].book.property.lazy,
+            sa_models[Book].chapter_set.property.lazy,
+            sa_models[Author].books.property.lazy,
+        )
+
+    def test_default(self):
+        assert self.strategies(construct_models(MetaData())) == (
+            "select",
+            "select",
+            "select",
+        )
+
+    def test_model_attribute(self, monkeypatch):
+        monkeypatch.setattr(Chapter, "aldjemy_loading", {"book": "joined"}, False)
+        monkeypatch.setattr(Book, "aldjemy_loading", {"chapter_set": "selectin"}, False)
+        assert self.strategies(construct_models(MetaData())) == (
+            "joined",
+            "selectin",
+            "select",
+        )
+
+    def test_setting(self, settings, monkeypatch):
+        monkeypatch.setattr(Chapter, "aldjemy_loading", {"book": "joined"}, False)
+        settings.ALDJEMY_LOADING = {
+            "sample.Chapter": {"book": "subquery"},
+            "sample.author": {"books": "selectin"},
+        }
+        assert self.strategies(construct_models(MetaData())) == (
+            "subquery",
+            "select",
+            "selectin",
+        )
+
+    def test_global_default(self, settings):
+        settings.ALDJEMY_DEFAULT_LOADING = "raise"
+        settings.ALDJEMY_LOADING = {"sample.book": {"chapter_set": "selectin"}}
+        assert self.strategies(construct_models(MetaData())) == (
+            "raise",
+            "selectin",
+            "raise",
+        )
+
+    @pytest.mark.django_db
+    def test_raiseload(self, settings):
+        settings.ALDJEMY_DEFAULT_LOADING = "raise"
+        sa_models = construct_models(MetaData())
+        SAChapter = sa_models[Chapter]
+        Chapter.objects.create(title="1", book=Book.objects.create(title="title"))
+        session = get_session()
+        chapter = session.query(SAChapter).one()
+        with pytest.raises(InvalidRequestError):
+            chapter.book
+        chapter = session.query(SAChapter).options(joinedload(SAChapter.book)).one()
+        assert chapter.book.title == "title"
+
+    def test_lazy_models(self, settings):
+        settings.ALDJEMY_LOADING = {"sample.book": {"chapter_set": "selectin"}}
+        lazy_models = LazyModels(MetaData())
+        assert lazy_models.get(Book).chapter_set.property.lazy == "selectin"
+
+
+class TestMetadataCache:
+    def test_fingerprint_is_stable(self):
+        assert get_fingerprint(MetaData()) == get_fingerprint(MetaData())
+        # Instances must not be represented by their address
+        validator = UnicodeUsernameValidator
+        assert _stable_repr(validator()) == _stable_repr(validator())
+
+    def test_fingerprint_changes(self, settings):
+        fingerprint = get_fingerprint(MetaData())
+        assert get_fingerprint(MetaData(schema="other")) != fingerprint
+        settings.ALDJEMY_DATA_TYPES = {"AnotherFakeType": foreign_key}
+        assert get_fingerprint(MetaData()) != fingerprint
+
+    def test_fingerprint_includes_data_type_closures(self, settings):
+        def varchar(length):
+            return lambda field: String(length=length)
+
+        settings.ALDJEMY_DATA_TYPES = {"CharField": varchar(10)}
+        fingerprint = get_fingerprint(MetaData())
+        settings.ALDJEMY_DATA_TYPES = {"CharField": varchar(20)}
+        assert get_fingerprint(MetaData()) != fingerprint
+
+    def test_fingerprint_includes_meta(self, monkeypatch):
+        fingerprint = get_fingerprint(MetaData())
+        monkeypatch.setattr(Ticket._meta, "indexes", [])
+        assert get_fingerprint(MetaData()) != fingerprint
+
+    def test_cache_is_reused(self, tmp_path, monkeypatch):
+        metadata, plans = load_metadata(tmp_path)
+        assert len(list(tmp_path.iterdir())) == 1
+
+        def generate_tables(metadata):
+            raise AssertionError("The cache was not used")
+
+        monkeypatch.setattr("aldjemy.metadata_cache.generate_tables", generate_tables)
+        cached_metadata, cached_plans = load_metadata(tmp_path)
+        assert cached_plans == plans
+        assert cached_metadata.tables.keys() == metadata.tables.keys()
+
+    def test_cache_writable_by_others(self, tmp_path):
+        load_metadata(tmp_path)
+        (path,) = tmp_path.iterdir()
+        path.chmod(0o666)
+        with mock.patch(
+            "aldjemy.metadata_cache.generate_tables", wraps=generate_tables
+        ) as generate:
+            with pytest.warns(RuntimeWarning, match="other users"):
+                load_metadata(tmp_path)
+        generate.assert_called_once()
+        # Written again by the current user only
+        assert path.stat().st_mode & 0o777 == 0o600
+
+    @pytest.mark.django_db
+    def test_models_from_cache(self, tmp_path):
+        load_metadata(tmp_path)
+        metadata, plans = load_metadata(tmp_path)
+        sa_models = construct_models(metadata, plans=plans)
+
+        Chapter.objects.create(title="chapter", book=Book.objects.create(title="book"))
+        sa_chapter = sa_models[Chapter]
+        chapter = get_session().query(sa_chapter).join(sa_chapter.book).one()
+        assert chapter.book.title == "book"
+        assert chapter.book.chapter_set == [chapter]
+
+
+class TestSqliteConverters:
+    statement = "SELECT '2020-01-02 03:04:05.000006' AS \"value [datetime]\""
+    value = datetime.datetime(2020, 1, 2, 3, 4, 5, 6)
+
+    @pytest.mark.django_db
+    def test_datetime(self):
+        user = User.objects.create(username="staff")
+        StaffAuthor.objects.create(user=user, date=self.value)
+        assert StaffAuthor.sa.query(StaffAuthor.sa.date).scalar() == self.value
+        # Without a declared type, sqlite3 returns the raw string
+        max_date = StaffAuthor.sa.query(func.max(StaffAuthor.sa.date)).scalar()
+        assert max_date == self.value
+
+    @pytest.mark.django_db
+    def test_time(self):
+        statement = text("SELECT '03:04:05' AS \"value [time]\"")
+        with get_engine().connect() as sa_connection:
+            value = sa_connection.execute(statement.columns(value=Time)).scalar()
+        assert value == datetime.time(3, 4, 5)
+
+    @pytest.mark.django_db
+    def test_converters_are_not_swapped(self):
+        """Django and SQLAlchemy queries from many threads see their types."""
+
+        def django_query(i):
+            with connection.cursor() as cursor:
+                cursor.execute(self.statement)
+                return cursor.fetchone()[0]
+
+        def sa_query(i):
+            statement = text(self.statement).columns(value=DateTime)
+            with get_engine().connect() as sa_connection:
+                return sa_connection.execute(statement).scalar()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = [
+                executor.submit(query, i)
+                for i in range(200)
+                for query in (django_query, sa_query)
+            ]
+            assert all(result.result() == self.value for result in results)
+
+
+class TestWrapper:
+    def test_transactions_are_left_to_django(self):
+        dbapi_connection = mock.Mock()
+        wrapper = Wrapper(dbapi_connection)
+        wrapper.commit()
+        wrapper.rollback()
+        dbapi_connection.commit.assert_not_called()
+        dbapi_connection.rollback.assert_not_called()
+
+    def test_delegation(self):
+        dbapi_connection = mock.Mock()
+        wrapper = Wrapper(dbapi_connection)
+        assert wrapper.cursor("name") is dbapi_connection.cursor.return_value
+        dbapi_connection.cursor.assert_called_once_with("name")
+        assert wrapper.autocommit is dbapi_connection.autocommit
+        with pytest.raises(AttributeError):
+            wrapper.attribute = "value"
+
+    @pytest.mark.django_db
+    def test_wrapper_is_cached(self):
+        connection.ensure_connection()
+        wrapper = get_wrapper(connection)
+        assert get_wrapper(connection) is wrapper
+        assert wrapper.obj is connection.connection
+        with get_engine().connect() as sa_connection:
+            assert sa_connection.connection.dbapi_connection is wrapper
+
+
+@pytest.mark.django_db
+class TestInstrumentation:
+    @pytest.fixture(autouse=True)
+    def instrument(self, settings):
+        settings.ALDJEMY_INSTRUMENT = True
+        connection.ensure_connection()
+        # Open sessions keep the connection proxy they checked out
+        get_session().close()
+        vars(connections["default"]).pop("aldjemy_wrapper", None)
+        yield
+        get_session().close()
+        vars(connections["default"]).pop("aldjemy_wrapper", None)
+
+    def test_instrumented_wrapper(self):
+        assert isinstance(get_wrapper(connection), InstrumentedWrapper)
+
+    def test_queries_are_logged(self, django_assert_num_queries):
+        Book.objects.create(title="title")
+        with django_assert_num_queries(1) as context:
+            assert Book.sa.query().filter(Book.sa.title == "title").count() == 1
+        (query,) = context.captured_queries
+        assert "FROM sample_book" in query["sql"]
+        assert query["params"] == ("title",)
+        assert "rowcount" in query
+
+    def test_executemany_is_logged(self, django_assert_num_queries):
+        with django_assert_num_queries(1) as context:
+            Book.sa.bulk_insert([{"title": "1"}, {"title": "2"}])
+        assert context.captured_queries[0]["sql"].startswith("2 times: INSERT")
+
+    def test_execute_wrappers(self):
+        calls = []
+
+        def wrapper(execute, sql, params, many, context):
+            calls.append((sql, many, context["connection"]))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(wrapper):
+            Book.sa.query().all()
+        ((sql, many, wrapped_connection),) = calls
+        assert "FROM sample_book" in sql
+        assert not many
+        assert wrapped_connection is connections["default"]
+
+    def test_disabled(self, settings):
+        settings.ALDJEMY_INSTRUMENT = False
+        assert type(get_wrapper(connection)) is Wrapper
+
+
+@pytest.mark.django_db
+class TestAsyncSession:
+    def test_execute(self):
+        Book.objects.create(title="first")
+        Book.objects.create(title="second")
+
+        async def titles():
+            session = get_async_session()
+            result = await session.execute(select(Book.sa.title).order_by(Book.sa.id))
+            return result.scalars().all()
+
+        assert async_to_sync(titles)() == ["first", "second"]
+
+    def test_scalars_and_get(self):
+        book = Book.objects.create(title="title")
+
+        async def books():
+            session = get_async_session()
+            found = await session.get(Book.sa, book.pk)
+            return found, (await session.scalars(select(Book.sa))).all()
+
+        found, books = async_to_sync(books)()
+        assert books == [found]
+        assert found.title == "title"
+
+    def test_dml(self):
+        book = Book.objects.create(title="old")
+
+        async def rename():
+            session = get_async_session()
+            statement = update(Book.sa).values(title="new")
+            return (await session.execute(statement)).rowcount
+
+        assert async_to_sync(rename)() == 1
+        book.refresh_from_db()
+        assert book.title == "new"
+
+    def test_run_sync(self):
+        Book.objects.create(title="title")
+
+        async def count():
+            session = get_async_session()
+            return await session.run_sync(lambda s: s.query(Book.sa).count())
+
+        assert async_to_sync(count)() == 1
+
+    def test_stream(self):
+        for i in range(5):
+            Book.objects.create(title=str(i))
+
+        async def titles():
+            session = get_async_session()
+            statement = select(Book.sa.title).order_by(Book.sa.id)
+            return [row.title async for row in session.stream(statement, chunk_size=2)]
+
+        assert async_to_sync(titles)() == ["0", "1", "2", "3", "4"]
+
+
+class ReadWriteRouter:
+    """Read books from the logs database, and write them to default."""
+
+    def db_for_read(self, model, **hints):
+        return "logs" if model is Book else None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+
+class TestRoutingSession:
+    @pytest.fixture
+    def read_write_router(self, settings):
+        settings.DATABASE_ROUTERS = ["aldjemy_test.sample_test.ReadWriteRouter"]
+
+    def test_reads_and_writes(self, read_write_router):
+        session = RoutingSession(pin_after_write=False)
+        book_mapper = inspect(Book.sa)
+        assert session.get_bind(mapper=book_mapper) is get_engine("logs")
+        assert session.get_bind(mapper=inspect(Chapter.sa)) is get_engine("default")
+        assert session.get_bind(clause=select(Book.sa.id)) is get_engine("logs")
+        statement = update(Book.sa).values(title="title")
+        assert session.get_bind(clause=statement) is get_engine("default")
+        assert session.get_bind(mapper=book_mapper) is get_engine("logs")
+
+    def test_pin_after_write(self, read_write_router):
+        session = RoutingSession()
+        book_mapper = inspect(Book.sa)
+        statement = insert(Book.sa).values(title="title")
+        assert session.get_bind(clause=statement) is get_engine("default")
+        assert session.get_bind(mapper=book_mapper) is get_engine("default")
+        session.close()
+        assert session.get_bind(mapper=book_mapper) is get_engine("logs")
+
+    def test_unpin_after_transaction(self, read_write_router):
+        session = RoutingSession()
+        book_mapper = inspect(Book.sa)
+        statement = insert(Book.sa).values(title="title")
+        for end in [session.commit, session.rollback]:
+            session.begin()
+            session.get_bind(clause=statement)
+            assert session.get_bind(mapper=book_mapper) is get_engine("default")
+            end()
+            assert session.get_bind(mapper=book_mapper) is get_engine("logs")
+
+    def test_unpin_after_request(self, read_write_router):
+        session = get_routing_session(recreate=True)
+        session.get_bind(clause=insert(Book.sa).values(title="title"))
+        unpin_routing_session(sender=None)
+        assert session.get_bind(mapper=inspect(Book.sa)) is get_engine("logs")
+
+    def test_replicas(self):
+        session = RoutingSession(replicas={"logs": ["default"]})
+        assert session.get_bind(mapper=inspect(Log.sa)) is get_engine("default")
+
+    def test_statement_without_model(self):
+        session = RoutingSession()
+        assert session.get_bind(clause=text("SELECT 1")) is get_engine("default")
+
+    @pytest.mark.django_db(databases=["default", "logs"])
+    def test_query_several_databases(self, settings):
+        settings.ALDJEMY_ROUTING_SESSION = True
+        Log.objects.create(record="record")
+        session = get_routing_session()
+        session.add(Book.sa(title="title"))
+        session.flush()
+
+        assert Book.objects.get().title == "title"
+        assert Book.sa.query().count() == 1
+        assert Log.sa.query().one().record == "record"
+        assert Book.sa.get_session() is session
+        session.close()
+
+
+@pytest.mark.django_db
+class TestInheritance:
+    def test_inherits_parent_class(self):
+        assert issubclass(StaffAuthor.sa, Author.sa)
+        assert StaffAuthor.sa.__mapper__.inherits is Author.sa.__mapper__
+
+    def test_inherited_attributes(self):
+        user = User.objects.create(username="user")
+        date = datetime.datetime(2020, 1, 1)
+        staff = StaffAuthor.objects.create(name="staff", user=user, role="r", date=date)
+        staff.books.add(Book.objects.create(title="title"))
+        Author.objects.create(name="author", user=user)
+
+        statement = select(StaffAuthor.sa).where(
+            StaffAuthor.sa.name == "staff", StaffAuthor.sa.role == "r"
+        )
+        assert "JOIN sample_staffauthor" in str(statement)
+        (loaded,) = StaffAuthor.sa.get_session().execute(statement).scalars()
+        assert loaded.id == loaded.author_ptr_id == staff.pk
+        assert (loaded.name, loaded.role, loaded.date) == ("staff", "r", date)
+        assert loaded.user.username == "user"
+        assert [book.title for book in loaded.books] == ["title"]
+
+    def test_insert(self):
+        user = User.objects.create(username="user")
+        session = StaffAuthor.sa.get_session()
+        staff = StaffAuthor.sa(
+            name="staff",
+            biography="",
+            user_id=user.pk,
+            role="r",
+            date=datetime.datetime(2020, 1, 1),
+        )
+        session.add(staff)
+        session.commit()
+        assert StaffAuthor.objects.get(pk=staff.id).name == "staff"
+
+    def test_not_polymorphic_by_default(self):
+        user = User.objects.create(username="user")
+        date = datetime.datetime(2020, 1, 1)
+        StaffAuthor.objects.create(name="staff", user=user, role="r", date=date)
+        assert [type(a) for a in Author.sa.query()] == [Author.sa]
+
+    def test_polymorphic_loading(self):
+        Place.objects.create(name="place")
+        Restaurant.objects.create(name="restaurant")
+        Pizzeria.objects.create(name="pizzeria", ovens=2)
+        places = Place.sa.query().order_by(Place.sa.id).all()
+        assert [type(p) for p in places] == [Place.sa, Restaurant.sa, Pizzeria.sa]
+        assert places[2].ovens == 2
+        restaurants = Restaurant.sa.query().order_by(Restaurant.sa.id)
+        assert [type(r) for r in restaurants] == [Restaurant.sa, Pizzeria.sa]
+
+    def test_hydrate_inherited_fields(self):
+        Pizzeria.objects.create(name="pizzeria", serves_pizza=True, ovens=2)
+        (hydrated,) = Place.sa.hydrate(Place.sa.query())
+        assert isinstance(hydrated, Pizzeria)
+        assert (hydrated.name, hydrated.serves_pizza, hydrated.ovens) == (
+            "pizzeria",
+            True,
+            2,
+        )
+        assert not hydrated.get_deferred_fields()
+
+
+@pytest.mark.django_db
+class TestStream:
+    def test_stream_instances(self):
+        Book.objects.bulk_create(Book(title=str(i)) for i in range(5))
+        books = Book.sa.stream(chunk_size=2)
+        assert sorted(book.title for book in books) == ["0", "1", "2", "3", "4"]
+
+    def test_stream_statement(self):
+        Book.objects.bulk_create(Book(title=str(i)) for i in range(5))
+        statement = select(Book.sa.title).where(Book.sa.title > "2")
+        assert [row.title for row in Book.sa.stream(statement)] == ["3", "4"]
+
+    def test_partitions(self):
+        Book.objects.bulk_create(Book(title=str(i)) for i in range(5))
+        statement = select(Book.sa.title).order_by(Book.sa.id)
+        partitions = stream_partitions(get_session(), statement, chunk_size=2)
+        assert [len(rows) for rows in partitions] == [2, 2, 1]
+
+    def test_abandoned_stream_closes_result(self):
+        Book.objects.bulk_create(Book(title=str(i)) for i in range(5))
+        session = get_session()
+        results = []
+
+        def execute(*args, **kwargs):
+            results.append(session_execute(*args, **kwargs))
+            return results[-1]
+
+        session_execute = session.execute
+        statement = select(Book.sa.title).order_by(Book.sa.id)
+        with mock.patch.object(session, "execute", execute):
+            partitions = stream_partitions(session, statement, chunk_size=2)
+            assert len(next(partitions)) == 2
+            assert not results[0].closed
+            partitions.close()
+        assert results[0].closed
+        assert Book.sa.query().count() == 5
+
+
+@pytest.mark.django_db
+class TestHydrate:
+    def test_hydrate_instances(self):
+        book = Book.objects.create(title="title")
+        (hydrated,) = Book.sa.hydrate(Book.sa.query())
+        assert hydrated == book
+        assert hydrated.title == "title"
+        assert hydrated._state.db == "default"
+        assert not hydrated._state.adding
+
+    def test_hydrate_columns(self):
+        book = Book.objects.create(title="title")
+        rows = Book.sa.query(Book.sa.id)
+        (hydrated,) = Book.sa.hydrate(rows)
+        assert hydrated.pk == book.pk
+        assert hydrated.get_deferred_fields() == {"title"}
+
+    def test_related_objects(self, django_assert_num_queries):
+        book = Book.objects.create(title="title")
+        Chapter.objects.create(title="1", book=book)
+        Chapter.objects.create(title="2", book=book)
+        query = Chapter.sa.query().options(joinedload(Chapter.sa.book))
+        chapters = Chapter.sa.hydrate(query.order_by(Chapter.sa.id))
+        with django_assert_num_queries(0):
+            assert [c.book.title for c in chapters] == ["title", "title"]
+        assert chapters[0].book is chapters[1].book
+
+    def test_prefetched_objects(self, django_assert_num_queries):
+        user = User.objects.create(username="user")
+        author = Author.objects.create(name="author", user=user)
+        book = Book.objects.create(title="title")
+        author.books.add(book)
+        Chapter.objects.create(title="1", book=book)
+        query = Author.sa.query().options(
+            selectinload(Author.sa.books).selectinload(Book.sa.chapter_set)
+        )
+        (hydrated,) = Author.sa.hydrate(query)
+        with django_assert_num_queries(0):
+            (hydrated_book,) = hydrated.books.all()
+            (chapter,) = hydrated_book.chapter_set.all()
+            assert chapter.book is hydrated_book
+        assert hydrated_book == book
+        assert chapter.title == "1"
+
+    def test_unloaded_relationships_are_not_loaded(self):
+        book = Book.objects.create(title="title")
+        Chapter.objects.create(title="1", book=book)
+        sa_chapter = Chapter.sa.query().one()
+        (chapter,) = Chapter.sa.hydrate([sa_chapter])
+        assert "book" not in inspect(sa_chapter).dict
+        assert not Chapter.book.is_cached(chapter)
+        assert chapter.book == book
+
+
+@pytest.mark.django_db
+class TestFetchColumns:
+    def create_authors(self):
+        user = User.objects.create(username="user")
+        date = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        for i in range(5):
+            StaffAuthor.objects.create(name=str(i), user=user, role="r", date=date)
+        return date
+
+    def test_numpy_columns(self):
+        numpy = pytest.importorskip("numpy")
+        self.create_authors()
+        statement = select(
+            Author.sa.id, Author.sa.name, (Author.sa.id * 0.5).label("half")
+        ).order_by(Author.sa.id)
+        columns = Author.sa.fetch_columns(statement, chunk_size=2)
+        assert list(columns) == ["id", "name", "half"]
+        assert columns["id"].dtype == numpy.int64
+        assert columns["half"].dtype == numpy.float64
+        assert list(columns["half"]) == [i * 0.5 for i in columns["id"]]
+        assert list(columns["name"]) == ["0", "1", "2", "3", "4"]
+
+    def test_numpy_nulls_and_dates(self):
+        numpy = pytest.importorskip("numpy")
+        date = self.create_authors()
+        id_column = StaffAuthor.sa.author_ptr_id
+        statement = select(
+            case((id_column > 2, id_column), else_=None).label("id"),
+            StaffAuthor.sa.date,
+        ).order_by(id_column)
+        columns = StaffAuthor.sa.fetch_columns(statement, chunk_size=2)
+        assert columns["id"].dtype == numpy.float64
+        assert numpy.isnan(columns["id"][:2]).all()
+        assert list(columns["id"][2:]) == [3.0, 4.0, 5.0]
+        assert columns["date"].dtype == numpy.dtype("datetime64[us]")
+        assert columns["date"][0] == numpy.datetime64(date)
+
+    def test_numpy_empty(self):
+        numpy = pytest.importorskip("numpy")
+        columns = Book.sa.fetch_columns(select(Book.sa.id))
+        assert columns["id"].dtype == numpy.int64
+        assert len(columns["id"]) == 0
+
+    def test_arrays(self):
+        self.create_authors()
+        statement = select(
+            Author.sa.id,
+            case((Author.sa.id > 2, Author.sa.id), else_=None).label("nullable"),
+            Author.sa.name,
+        ).order_by(Author.sa.id)
+        columns = fetch_columns(Author.sa, statement, chunk_size=2, use_numpy=False)
+        assert columns["id"].typecode == "q"
+        assert list(columns["id"]) == [1, 2, 3, 4, 5]
+        assert columns["nullable"].typecode == "d"
+        assert list(columns["nullable"])[2:] == [3.0, 4.0, 5.0]
+        assert columns["name"] == ["0", "1", "2", "3", "4"]
+
+    @pytest.mark.parametrize("use_numpy", [True, False])
+    def test_boolean_nulls(self, use_numpy):
+        if use_numpy:
+            pytest.importorskip("numpy")
+        self.create_authors()
+        flag = case((Author.sa.id > 2, Author.sa.id > 3), else_=None)
+        statement = select(type_coerce(flag, Boolean).label("flag")).order_by(
+            Author.sa.id
+        )
+        columns = fetch_columns(Author.sa, statement, chunk_size=2, use_numpy=use_numpy)
+        assert list(columns["flag"]) == [None, None, False, True, True]
+
+    def test_numpy_imported_on_use(self):
+        code = "import django, sys; django.setup(); print('numpy' in sys.modules)"
+        output = subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True, text=True
+        ).stdout
+        assert output.strip() == "False"
+
+    def test_count(self):
+        self.create_authors()
+        statement = select(func.count(Author.sa.id))
+        columns = fetch_columns(Author.sa, statement, use_numpy=False)
+        assert list(columns["count_1"]) == [5]
+
+
+class TestQueryCache:
+    def test_compiled_cache_stats(self):
+        cache = CompiledCache(10)
+        cache["key"] = "compiled"
+        assert cache.get("key") == "compiled"
+        assert cache.get("other") is None
+        assert cache.stats() == {"hits": 1, "misses": 1, "size": 1, "capacity": 10}
+
+    @pytest.mark.django_db
+    def test_engine_cache(self):
+        Book.objects.create(title="title")
+        cache = get_compiled_cache()
+        statement = Book.sa.cached(
+            "by_title",
+            lambda: select(Book.sa).where(Book.sa.title == bindparam("title")),
+        )
+        session = Book.sa.get_session()
+        session.execute(statement, {"title": "other"}).all()
+        hits = cache.hits
+        (book,) = session.execute(statement, {"title": "title"}).scalars()
+        assert book.title == "title"
+        assert cache.hits == hits + 1
+
+    def test_cached_statement(self):
+        builder = mock.Mock(side_effect=lambda: select(Book.sa))
+        assert Book.sa.cached("all", builder) is Book.sa.cached("all", builder)
+        assert Book.sa.cached("all", builder) is not Chapter.sa.cached("all", builder)
+        assert builder.call_count == 2
+
+
+@pytest.mark.django_db
+class TestResultCache:
+    @pytest.fixture(autouse=True)
+    def enable(self, settings):
+        settings.ALDJEMY_RESULT_CACHE = "default"
+        result_cache.install()
+        get_sessionmaker.cache_clear()
+        get_session(recreate=True)
+        cache.clear()
+        yield
+        result_cache.uninstall()
+        del settings.ALDJEMY_RESULT_CACHE
+        get_sessionmaker.cache_clear()
+        get_session(recreate=True)
+
+    def titles(self):
+        query = Book.sa.query(Book.sa.title).order_by(Book.sa.title)
+        return [title for (title,) in query.cache()]
+
+    def test_results_are_cached(self):
+        book = Book.objects.create(title="old")
+        assert self.titles() == ["old"]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        assert self.titles() == ["old"]
+        book.title = "new"
+        book.save()
+        assert self.titles() == ["new"]
+
+    def test_queryset_writes_bump_version(self):
+        Book.objects.create(title="old")
+        assert self.titles() == ["old"]
+        Book.objects.update(title="new")
+        assert self.titles() == ["new"]
+        Book.objects.bulk_create([Book(title="bulk")])
+        assert self.titles() == ["bulk", "new"]
+        Book.objects.filter(title="bulk").delete()
+        assert self.titles() == ["new"]
+
+    def test_raw_sql_bumps_version(self):
+        Book.objects.create(title="old")
+        assert self.titles() == ["old"]
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE "sample_book" SET "title" = %s', ["new"])
+        assert self.titles() == ["new"]
+        Book.sa.get_session().execute(text("DELETE FROM sample_book"))
+        assert self.titles() == []
+
+    def test_written_tables(self):
+        assert _written_tables('INSERT INTO "sample_book" ("title")') == ["sample_book"]
+        assert _written_tables("update `sample_book` set title = 1") == ["sample_book"]
+        assert _written_tables("DELETE FROM [sample_book]") == ["sample_book"]
+        assert _written_tables("INSERT OR IGNORE INTO sample_book") == ["sample_book"]
+        assert _written_tables('SELECT * FROM "sample_book"') == []
+        assert _written_tables("with t as (select 1) select * from t") == []
+        assert _written_tables("RELEASE SAVEPOINT s1") == []
+        assert _written_tables('TRUNCATE "sample_book"') == ["*"]
+        assert _written_tables("WITH t AS (DELETE FROM a) SELECT 1") == ["*"]
+        assert _written_tables("CALL refresh()") == ["*"]
+
+    def test_statement_compiled_once(self):
+        Book.objects.create(title="a")
+        Book.objects.create(title="b")
+        size = len(result_cache._compiled)
+        for title in ["a", "b"]:
+            query = Book.sa.query(Book.sa.title).filter(Book.sa.title == title)
+            assert query.cache().all() == [(title,)]
+        assert len(result_cache._compiled) == size + 1
+
+    def test_cached_instances(self):
+        Book.objects.create(title="title")
+        statement = select(Book.sa).options(FromCache())
+        session = Book.sa.get_session()
+        session.execute(statement).scalars().all()
+        session.expunge_all()
+        (book,) = session.execute(statement).scalars()
+        assert book.title == "title"
+        assert book in session
+
+    def test_flush_bumps_version(self):
+        assert self.titles() == []
+        session = Book.sa.get_session()
+        session.add(Book.sa(title="title"))
+        session.flush()
+        assert self.titles() == ["title"]
+
+    def test_bulk_insert_bumps_version(self):
+        assert self.titles() == []
+        Book.sa.bulk_insert([{"title": "title"}])
+        assert self.titles() == ["title"]
+
+    def test_m2m_changed_bumps_version(self):
+        user = User.objects.create(username="user")
+        author = Author.objects.create(name="author", user=user)
+        book = Book.objects.create(title="title")
+        query = Author.sa.query().join(Author.sa.books).cache()
+        assert query.count() == 0
+        author.books.add(book)
+        assert query.count() == 1
+
+    def test_joined_tables_bump_version(self):
+        book = Book.objects.create(title="old")
+        Chapter.objects.create(book=book, title="chapter")
+        query = Chapter.sa.query().options(joinedload(Chapter.sa.book)).cache()
+        assert query.one().book.title == "old"
+        Book.objects.filter(pk=book.pk).update(title="new")
+        Book.sa.get_session().expunge_all()
+        assert query.one().book.title == "new"
+
+    def test_not_configured(self, settings):
+        settings.ALDJEMY_RESULT_CACHE = None
+        with pytest.raises(ImproperlyConfigured):
+            self.titles()
+
+    def test_signals_bump_version(self):
+        book = Book.objects.create(title="old")
+        assert self.titles() == ["old"]
+        # Written behind the back of the hooks
+        connection.connection.execute("UPDATE sample_book SET title = 'new'")
+        assert self.titles() == ["old"]
+        signals.post_save.send(sender=Book, instance=book, created=False)
+        assert self.titles() == ["new"]
+
+
+class TestResultCacheDisabled:
+    def test_not_installed(self):
+        assert not hasattr(django_settings, "ALDJEMY_RESULT_CACHE")
+        session = get_session(recreate=True)
+        assert not hasattr(session.query(Book.sa), "cache")
+        assert not event.contains(
+            type(session), "do_orm_execute", result_cache.execute_from_cache
+        )
+        assert not event.contains(
+            get_engine(), "after_cursor_execute", result_cache._bump_written_tables
+        )
+        assert result_cache._bump_executed_tables not in connection.execute_wrappers
+        assert not RoutingSession().dispatch.do_orm_execute
+
+
+class TestProfile:
+    def test_profile_startup(self):
+        profile = profile_startup(memory=False)
+        chapter = profile["models"]["sample.Chapter"]
+        assert chapter["columns"] == 3
+        assert chapter["relationships"] == 1
+        assert chapter["backrefs"] == 1
+        assert set(profile["totals"]) == {
+            "generate_tables",
+            "extract_model_attrs",
+            "map_imperatively",
+            "configure_mappers",
+        }
+        assert profile["memory"] is None
+
+    def test_command(self):
+        out = StringIO()
+        call_command("aldjemy_profile", "--limit", "3", stdout=out)
+        lines = out.getvalue().splitlines()
+        assert lines[0].startswith("model")
+        assert any(line.startswith("configure_mappers") for line in lines)
+        assert lines[-1].startswith("memory")
+
+    def test_command_json(self):
+        out = StringIO()
+        call_command("aldjemy_profile", "--json", "--no-memory", stdout=out)
+        assert "sample.Book" in json.loads(out.getvalue())["models"]
+
+
+@pytest.mark.django_db
+class TestBulk:
+    def test_bulk_insert(self):
+        rows = [{"title": str(i)} for i in range(5)]
+        assert Book.sa.bulk_insert(rows, chunk_size=2) == 5
+        assert list(Book.objects.values_list("title", flat=True)) == list("01234")
+
+    def test_bulk_insert_instances(self):
+        user = User.objects.create(username="user")
+        authors = [Author(name=str(i), user=user) for i in range(3)]
+        pks = Author.sa.bulk_insert(authors, return_pks=True)
+        assert [a.name for a in Author.objects.filter(pk__in=pks)] == ["0", "1", "2"]
+
+    def test_bulk_insert_auto_now(self):
+        start = timezone.now()
+        Event.sa.bulk_insert([{"name": "dict"}, Event(name="instance")])
+        for row in Event.objects.all():
+            assert row.created >= start
+            assert row.updated >= start
+
+    def test_bulk_insert_joins_atomic(self):
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                Book.sa.bulk_insert([{"title": "title"}])
+                assert Book.objects.count() == 1
+                raise RuntimeError
+        assert Book.objects.count() == 0
+
+    def test_upsert(self):
+        Item.objects.create(label="old", legacy_id="a")
+        rows = [
+            {"label": "new", "legacy_id": "a"},
+            {"label": "other", "legacy_id": "b"},
+        ]
+        assert Item.sa.upsert(rows, ["legacy_id"]) == 2
+        items = Item.objects.order_by("legacy_id").values_list("legacy_id", "label")
+        assert list(items) == [("a", "new"), ("b", "other")]
+
+    def test_upsert_ignore(self):
+        Item.objects.create(label="old", legacy_id="a")
+        rows = [{"label": "new", "legacy_id": "a"}]
+        Item.sa.upsert(rows, ["legacy_id"], update_columns=[])
+        assert Item.objects.get().label == "old"
+
+    def test_upsert_returning_pks(self):
+        with pytest.raises(NotImplementedError):
+            Item.sa.upsert([], ["legacy_id"], return_pks=True)
+
+
+@pytest.mark.django_db
+class TestBatchFlush:
+    @pytest.fixture(autouse=True)
+    def session(self, settings):
+        settings.ALDJEMY_BATCH_FLUSH = True
+        session = get_session(recreate=True)
+        yield session
+        session.close()
+        settings.ALDJEMY_BATCH_FLUSH = False
+        get_session(recreate=True)
+
+    def test_flush_on_commit(self, session):
+        with transaction.atomic():
+            session.add_all([Book.sa(title="first"), Book.sa(title="second")])
+            assert session.query(Book.sa).count() == 0
+            assert not Book.objects.exists()
+        assert Book.objects.count() == 2
+
+    def test_nested_commit(self, session):
+        with transaction.atomic():
+            session.add(Book.sa(title="outer"))
+            with transaction.atomic():
+                assert Book.objects.filter(title="outer").exists()
+                session.add(Book.sa(title="inner"))
+                assert not Book.objects.filter(title="inner").exists()
+            assert Book.objects.filter(title="inner").exists()
+        assert Book.objects.count() == 2
+
+    def test_savepoint_rollback(self, session):
+        with transaction.atomic():
+            outer = Book.sa(title="outer")
+            session.add(outer)
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    inner = Book.sa(title="inner")
+                    session.add(inner)
+                    session.flush()
+                    outer.title = "changed"
+                    raise RuntimeError
+            assert inner not in session
+            assert outer in session
+            assert outer.title == "outer"
+        assert list(Book.objects.values_list("title", flat=True)) == ["outer"]
+
+    def test_savepoint_rollback_discards_flushed_writes(self, session):
+        Book.objects.create(title="before")
+        book = session.query(Book.sa).one()
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(get_engine(), "before_cursor_execute", capture)
+        try:
+            with transaction.atomic():
+                with pytest.raises(RuntimeError):
+                    with transaction.atomic():
+                        book.title = "changed"
+                        inner = Book.sa(title="inner")
+                        session.add(inner)
+                        session.flush()
+                        raise RuntimeError
+                assert inner not in session
+                assert book.title == "before"
+                assert session.query(Book.sa.title).all() == [("before",)]
+        finally:
+            event.remove(get_engine(), "before_cursor_execute", capture)
+        # Django's savepoints are the only ones
+        assert not [sql for sql in statements if "SAVEPOINT" in sql.upper()]
+        assert list(Book.objects.values_list("title", flat=True)) == ["before"]
+
+    def test_savepoint_rollback_restores_deleted(self, session):
+        Book.objects.create(title="title")
+        book = session.query(Book.sa).one()
+        with transaction.atomic():
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    session.delete(book)
+                    raise RuntimeError
+            assert book in session
+            assert not session.deleted
+        assert Book.objects.count() == 1
+
+    def test_session_begun_in_savepoint(self, session):
+        session.close()
+        with transaction.atomic():
+            with pytest.raises(RuntimeError):
+                with transaction.atomic():
+                    book = Book.sa(title="title")
+                    session.add(book)
+                    raise RuntimeError
+            assert book not in session
+        assert not Book.objects.exists()
+
+    def test_flush_error(self, session):
+        Item.objects.create(label="old", legacy_id="a")
+        with pytest.raises(IntegrityError):
+            with transaction.atomic():
+                session.add(Item.sa(label="new", legacy_id="a"))
+        assert not session.new
+        assert list(Item.objects.values_list("label", flat=True)) == ["old"]
+
+    def test_disabled(self, settings):
+        settings.ALDJEMY_BATCH_FLUSH = False
+        session = get_session(recreate=True)
+        assert follow_transaction not in connection.execute_wrappers
+        with transaction.atomic():
+            session.add(Book.sa(title="title"))
+            assert session.query(Book.sa).count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBatchFlushTransaction:
+    @pytest.fixture(autouse=True)
+    def session(self, settings):
+        settings.ALDJEMY_BATCH_FLUSH = True
+        session = get_session(recreate=True)
+        yield session
+        session.close()
+        settings.ALDJEMY_BATCH_FLUSH = False
+        get_session(recreate=True)
+
+    def test_commit(self, session):
+        with transaction.atomic():
+            book = Book.sa(title="title")
+            session.add(book)
+            assert not Book.objects.exists()
+        assert not session.in_transaction()
+        assert book.title == "title"
+        assert Book.objects.get().pk == book.id
+
+    def test_rollback(self, session):
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                book = Book.sa(title="title")
+                session.add(book)
+                session.flush()
+                raise RuntimeError
+        # The session is rolled back when the connection is used again
+        assert not Book.objects.exists()
+        assert book not in session
+
+    def test_rollback_before_query(self, session):
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                session.add(Book.sa(title="title"))
+                session.flush()
+                raise RuntimeError
+        assert session.query(Book.sa).count() == 0
+
+    def test_write_outside_atomic(self, session):
+        book = Book.sa(title="title")
+        session.add(book)
+        assert session.query(Book.sa.id).scalar() == book.id
+        assert Book.objects.get().title == "title"
+
+
+@pytest.mark.django_db
+class TestSessionScope:
+    def test_scope(self):
+        Book.objects.create(title="title")
+        with session_scope() as session:
+            assert session is get_session()
+            book = session.query(Book.sa).one()
+            assert book in session
+        assert not session.identity_map
+        assert book not in session
+
+    def test_nested(self):
+        Book.objects.create(title="title")
+        with session_scope() as session:
+            with session_scope():
+                book = session.query(Book.sa).one()
+            assert book in session
+        assert book not in session
+
+    def test_decorator(self):
+        Book.objects.create(title="title")
+
+        @session_scope()
+        def task():
+            return get_session().query(Book.sa).one()
+
+        assert task() not in get_session()
+
+    def test_clear_sessions(self, caplog, settings):
+        settings.ALDJEMY_IDENTITY_MAP_WARNING = 1
+        Book.objects.bulk_create([Book(title="first"), Book(title="second")])
+        books = get_session().query(Book.sa).all()
+        with caplog.at_level("DEBUG", logger="aldjemy"):
+            assert clear_sessions()["default"] == 2
+            assert clear_sessions()["default"] == 0
+        assert len(books) == 2
+        messages = [(r.levelname, r.getMessage()) for r in caplog.records]
+        assert ("WARNING", "2 objects in the default session") in messages
+        assert ("DEBUG", "0 objects in the default session") in messages
+
+    def test_middleware(self, rf):
+        Book.objects.create(title="title")
+
+        def view(request):
+            return get_session().query(Book.sa).one()
+
+        book = AldjemySessionMiddleware(view)(rf.get("/"))
+        assert book not in get_session()
+
+
+@pytest.mark.django_db
+class TestFromQueryset:
+    @pytest.fixture(autouse=True)
+    def books(self):
+        book = Book.objects.create(title="alpha")
+        Book.objects.create(title="beta")
+        Book.objects.create(title="50% off")
+        Chapter.objects.create(title="one", book=book)
+
+    def rows(self, statement):
+        return [tuple(row) for row in get_session().execute(statement)]
+
+    def assert_same(self, queryset, translated=True):
+        statement = Book.sa.from_queryset(queryset)
+        assert (statement.get_final_froms() == [inspect(Book.sa).local_table]) is (
+            translated
+        )
+        assert self.rows(statement) == list(queryset.values_list())
+        return statement
+
+    def test_filters(self):
+        self.assert_same(Book.objects.filter(title__startswith="al"))
+        self.assert_same(Book.objects.filter(title__contains="%"))
+        self.assert_same(Book.objects.filter(title__iexact="BETA"))
+        self.assert_same(Book.objects.exclude(Q(title="alpha") | Q(id__in=[0, 1])))
+        self.assert_same(Book.objects.filter(title__isnull=False, id__range=(1, 2)))
+        self.assert_same(Book.objects.filter(id=F("id")))
+        self.assert_same(Book.objects.none())
+
+    def test_ordering_and_slicing(self):
+        self.assert_same(Book.objects.order_by("-title")[1:3])
+        self.assert_same(Book.objects.order_by("title").distinct()[:1])
+
+    def test_values(self):
+        queryset = Chapter.objects.values("id", "book", name=F("title"))
+        statement = Chapter.sa.from_queryset(queryset)
+        assert [dict(row._mapping) for row in get_session().execute(statement)] == [
+            dict(row) for row in queryset
+        ]
+
+    def test_subquery(self):
+        titles = Book.objects.filter(title__startswith="al").values("id")
+        statement = select(Chapter.sa.title).where(
+            Chapter.sa.book_id.in_(Book.sa.from_queryset(titles))
+        )
+        assert self.rows(statement) == [("one",)]
+        cte = Book.sa.from_queryset(titles).cte()
+        statement = select(Chapter.sa.title).join(cte, cte.c.id == Chapter.sa.book_id)
+        assert self.rows(statement) == [("one",)]
+
+    def test_fallback(self):
+        self.assert_same(Book.objects.filter(title__regex="^a"), translated=False)
+        self.assert_same(
+            Book.objects.filter(chapter__title="one").order_by("pk"), translated=False
+        )
+        self.assert_same(
+            Book.objects.filter(title__endswith="%").extra(where=["title <> ':x'"]),
+            translated=False,
+        )
+        self.assert_same(
+            Book.objects.filter(chapter__title="two").none(), translated=False
+        )
+
+    def test_case_sensitive_fallback(self, monkeypatch):
+        # Like MySQL, whose LIKE follows the collation
+        monkeypatch.setitem(connection.operators, "contains", "LIKE BINARY %s")
+        queryset = Book.objects.filter(title__contains="a")
+        statement = Book.sa.from_queryset(queryset)
+        assert statement.get_final_froms() != [inspect(Book.sa).local_table]
+        self.assert_same(Book.objects.filter(title__icontains="A"))
+
+    def test_other_model(self):
+        with pytest.raises(ValueError):
+            Book.sa.from_queryset(Chapter.objects.all())
+        assert Book.sa.from_queryset(BookProxy.objects.all()) is not None
+
+
+class TestCopy:
+    dialect = postgresql.psycopg2.dialect()
+
+    def lines(self, sa_model, rows, columns):
+        table = sa_model.__table__
+        converter = _RowConverter(Book, table)
+        columns = [table.c[name] for name in columns]
+        return list(_lines(rows, converter, columns, self.dialect))
+
+    def test_lines(self):
+        rows = [{"title": "a\tb\\c\nd"}, Book(title=None), ("1", None)]
+        assert self.lines(Book.sa, rows, ["title", "id"]) == [
+            b"a\\tb\\\\c\\nd\t\\N\n",
+            b"\\N\t\\N\n",
+            b"1\t\\N\n",
+        ]
+
+    def test_format(self):
+        assert _format(True) == "t"
+        assert _format(b"\x00\xff") == "\\x00ff"
+        assert _format(datetime.timedelta(days=1, microseconds=2)) == (
+            "1 days 0 seconds 2 microseconds"
+        )
+        assert _format(['a"b', None, ["c\\d"]]) == '{"a\\"b",NULL,{"c\\\\d"}}'
+
+    def test_reader(self):
+        reader = _Reader(iter([b"abc\n", b"de\n", b"f\n"]))
+        assert reader.read(5) == b"abc\nd"
+        assert reader.read(100) == b"e\nf\n"
+        assert reader.read(100) == b""
+        assert reader.count == 3
+
+    def test_postgresql_only(self):
+        with pytest.raises(NotImplementedError):
+            Book.sa.copy_from([])
+        with pytest.raises(NotImplementedError):
+            Book.sa.copy_to(None, StringIO())
+
+
+class TestCodegen:
+    @pytest.fixture(scope="class")
+    @classmethod
+    def generated(cls, tmp_path_factory):
+        """Import the modules of ``aldjemy_codegen``, as ``aldjemy_generated``."""
+        path = str(tmp_path_factory.mktemp("codegen"))
+        out = StringIO()
+        call_command(
+            "aldjemy_codegen", os.path.join(path, "aldjemy_generated"), stdout=out
+        )
+        assert out.getvalue().count("Wrote") == 3
+        sys.path.insert(0, path)
+        try:
+            yield importlib.import_module("aldjemy_generated.models")
+        finally:
+            sys.path.remove(path)
+
+    def describe(self, table):
+        return (
+            [
+                (
+                    column.name,
+                    repr(column.type),
+                    column.nullable,
+                    column.primary_key,
+                    bool(column.unique),
+                    bool(column.index),
+                    [fk.target_fullname for fk in column.foreign_keys],
+                    column.server_default is not None,
+                )
+                for column in table.c
+            ],
+            sorted(
+                (
+                    index.name or "",
+                    [str(e) for e in index.expressions],
+                    sorted((k, str(v)) for k, v in index.dialect_kwargs.items()),
+                )
+                for index in table.indexes
+            ),
+            sorted(
+                (type(c).__name__, c.name or "", [col.name for col in c.columns])
+                for c in table.constraints
+            ),
+        )
+
+    def test_tables(self, generated):
+        metadata = MetaData()
+        generate_tables(metadata)
+        generated_tables = sys.modules["aldjemy_generated.tables"].metadata.tables
+        assert generated_tables.keys() == metadata.tables.keys()
+        for key, table in metadata.tables.items():
+            assert self.describe(generated_tables[key]) == self.describe(table)
+
+    def test_constraints(self):
+        table = get_metadata().tables["sample_ticket"]
+        module = codegen._Module({table: "t_sample_ticket"})
+        source = "\n".join(codegen._render_table(module, table))
+        namespace = {"metadata": MetaData()}
+        exec(module.source() + "\n" + source, namespace)
+        generated = namespace["t_sample_ticket"]
+        assert self.describe(generated) == self.describe(table)
+
+    def test_models(self, generated):
+        for model in [Book, Chapter, Author, Log, Place, Restaurant, Pizzeria]:
+            sa_model = generated.MODELS[model._meta.label_lower]
+            keys = set(inspect(model.sa).attrs.keys())
+            assert set(inspect(sa_model).attrs.keys()) == keys
+            assert sa_model.__alias__ == model.sa.__alias__
+        assert issubclass(generated.SampleLog, Log.aldjemy_mixin)
+        assert generated.SamplePizzeria.__mapper__.inherits is (
+            generated.SampleRestaurant.__mapper__
+        )
+
+    @pytest.mark.django_db
+    def test_query(self, generated):
+        Chapter.objects.create(title="chapter", book=Book.objects.create(title="book"))
+        sa_chapter = generated.SampleChapter
+        chapter = get_session().query(sa_chapter).join(sa_chapter.book).one()
+        assert chapter.book.title == "book"
+        assert chapter.book.chapter_set == [chapter]
+
+    @pytest.fixture
+    def restore_models(self, monkeypatch):
+        for model in django_apps.get_models(include_auto_created=True):
+            if "sa" in vars(model):
+                monkeypatch.setattr(model, "sa", vars(model)["sa"])
+
+    def test_use_generated(self, generated, settings, restore_models):
+        settings.ALDJEMY_USE_GENERATED = "aldjemy_generated"
+        django_apps.get_app_config("aldjemy").ready()
+        assert Book.sa is generated.SampleBook
+        assert BookProxy.sa is generated.SampleBook
+
+    def test_stale(self, generated, monkeypatch, restore_models):
+        monkeypatch.delitem(generated.MODELS, "sample.book")
+        with pytest.warns(RuntimeWarning, match="sample.book"):
+            use_generated("aldjemy_generated")
+
+    def test_check(self, generated, settings):
+        directory = os.path.dirname(generated.__file__)
+        call_command("aldjemy_codegen", directory, "--check")
+        settings.ALDJEMY_DEFAULT_LOADING = "selectin"
+        stderr = StringIO()
+        with pytest.raises(CommandError, match="out of date"):
+            call_command("aldjemy_codegen", directory, "--check", stderr=stderr)
+        assert "models.py is out of date" in stderr.getvalue()
+
+    def test_formatted(self, generated):
+        pytest.importorskip("ruff")
+        directory = os.path.dirname(generated.__file__)
+        args = ["format", "--isolated", "--check", directory]
+        subprocess.run([sys.executable, "-m", "ruff", *args], check=True)
@@ -0,0 +1,11 @@
+"""Benchmarks for aldjemy, run them with ``python -m benchmarks.<name>``."""
+
+import os
+
+
+def setup():
+    """Configure Django with the test project settings."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    import django
+
+    django.setup()
@@ -0,0 +1,73 @@
+"""Compare fetching columns of arrays with fetching rows on SQLite.
+
+The rows are turned into NumPy arrays, as analytics code does with the
+results of ``.all()``.
+"""
+
+import argparse
+import time
+
+from . import setup
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    setup()
+    import numpy
+    from django.core.management import call_command
+    from django.db import connection
+    from sqlalchemy import func, select
+
+    from aldjemy.columnar import fetch_columns
+    from aldjemy_test.sample.models import Book
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+            "WHERE i < %s) INSERT INTO sample_book (title) SELECT i FROM n",
+            [args.rows],
+        )
+
+    statement = select(
+        Book.sa.id,
+        (Book.sa.id * 0.5).label("half"),
+        (func.length(Book.sa.title) > 3).label("long"),
+    )
+
+    def rows():
+        result = Book.sa.get_session().execute(statement).all()
+        return {
+            "id": numpy.array([row.id for row in result], dtype="int64"),
+            "half": numpy.array([row.half for row in result], dtype="float64"),
+            "long": numpy.array([row.long for row in result], dtype="bool"),
+        }
+
+    def numpy_columns():
+        return Book.sa.fetch_columns(statement, chunk_size=args.chunk_size)
+
+    def array_columns():
+        return fetch_columns(
+            Book.sa, statement, chunk_size=args.chunk_size, use_numpy=False
+        )
+
+    for name, func_ in [
+        (".all() + numpy", rows),
+        ("fetch_columns numpy", numpy_columns),
+        ("fetch_columns array", array_columns),
+    ]:
+        print("%-20s %8.3f s" % (name, timed(func_)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Measure the per statement cost of the DBAPI connection proxy.
+
+Statements are run on an open SQLAlchemy connection, and with a checkout
+of the connection from the pool for each statement, like sessions do.
+Each is measured with the proxy of ``aldjemy.wrapper`` and with the proxy
+it replaced, resolving every attribute with ``__getattr__`` and created at
+each checkout, copied below as ``GetattrWrapper``.
+Pass ``--instrument`` to measure the proxy with ``ALDJEMY_INSTRUMENT``.
+"""
+
+import argparse
+import time
+from unittest import mock
+
+from . import setup
+
+
+class GetattrWrapper:
+    """The proxy before ``aldjemy.wrapper.Wrapper``, as the baseline."""
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __getattr__(self, attr):
+        if attr in ["commit", "rollback"]:
+            return lambda *args, **kwargs: None
+        obj = getattr(self.obj, attr)
+        if attr not in ["cursor", "execute"]:
+            return obj
+        if attr == "cursor":
+            return type(self)(obj)
+        return self.wrapper(obj)
+
+    def wrapper(self, obj):
+        return obj
+
+    def __call__(self, *args, **kwargs):
+        self.obj = self.obj(*args, **kwargs)
+        return self
+
+
+def per_call(func, number):
+    func()
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def measure(engine, statement, number):
+    """Return the time of each case in microseconds, by name."""
+
+    def checkout():
+        with engine.connect() as sa_connection:
+            sa_connection.execute(statement).scalar()
+
+    with engine.connect() as sa_connection:
+
+        def execute():
+            sa_connection.execute(statement).scalar()
+
+        def raw_cursor():
+            cursor = sa_connection.connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+
+        return {
+            name: per_call(func, number)
+            for name, func in [
+                ("checkout + execute", checkout),
+                ("execute", execute),
+                ("proxy cursor", raw_cursor),
+            ]
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--instrument", action="store_true")
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+
+    settings.ALDJEMY_INSTRUMENT = args.instrument
+    from sqlalchemy import select
+
+    from aldjemy import core
+
+    engine = core.get_engine()
+    statement = select(1)
+
+    def get_baseline(connection):
+        return GetattrWrapper(connection.connection)
+
+    with mock.patch.object(core, "get_wrapper", get_baseline):
+        baseline = measure(engine, statement, args.number)
+    results = measure(engine, statement, args.number)
+
+    label = "instrumented us" if args.instrument else "slotted us"
+    print("%-20s %15s %15s" % ("", "getattr us", label))
+    for name, value in results.items():
+        print("%-20s %15.2f %15.2f" % (name, baseline[name], value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Measure the overhead of aldjemy on requests that only use the Django ORM.
+
+A request is simulated by the ``request_started`` and ``request_finished``
+signals around a Django query. With ``CONN_MAX_AGE = 0`` every request
+opens a new connection, which sends ``connection_created``. Each case runs
+in its own process: without aldjemy in ``INSTALLED_APPS``, with it, and
+with a ``Model.sa`` query instead of the Django one.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from . import setup
+from .runtime import per_call
+
+CASES = ["django, not installed", "django", "aldjemy"]
+
+
+def run(case, number, repeat):
+    setup()
+    from django.core.management import call_command
+    from django.core.signals import request_finished, request_started
+
+    from aldjemy_test.sample.models import Book
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    pk = Book.objects.create(title="title").pk
+
+    if case == "aldjemy":
+
+        def query():
+            Book.sa.query().filter(Book.sa.id == pk).one()
+
+    else:
+
+        def query():
+            Book.objects.get(pk=pk)
+
+    def request():
+        request_started.send(sender=None)
+        try:
+            query()
+        finally:
+            request_finished.send(sender=None)
+
+    return per_call(request, number, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", choices=CASES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args.child, args.number, args.repeat)))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        # Connections to in-memory databases are never closed
+        name = os.path.join(path, "db")
+        for case in CASES:
+            env = dict(os.environ, BENCHMARK_SQLITE_NAME=name)
+            if case == "django, not installed":
+                env["BENCHMARK_WITHOUT_ALDJEMY"] = "1"
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.request_overhead"]
+                + ["--child", case, "--number", str(args.number)]
+                + ["--repeat", str(args.repeat)],
+                check=True,
+                capture_output=True,
+                text=True,
+                env=env,
+            ).stdout
+            results[case] = json.loads(output)
+            os.remove(name)
+
+    baseline = results[CASES[0]]
+    for case, us_per_call in results.items():
+        print(
+            "%-22s %10.1f us/request %+10.1f us"
+            % (case, us_per_call, us_per_call - baseline)
+        )
+
+
+if __name__ == "__main__":
+    main()
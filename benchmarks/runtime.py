@@ -0,0 +1,214 @@
+"""Compare the runtime of common queries through aldjemy and the Django ORM.
+
+Every case runs through ``Model.sa`` and through the equivalent queryset,
+on the ``aldjemy_test.sample`` models. Results are printed as JSON, save
+them with ``--output`` and pass the file of another commit with
+``--compare`` to print the ratios.
+
+SQLite in memory is used by default, set ``BENCHMARK_POSTGRES=1`` to use
+the PostgreSQL database of the test settings instead.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from . import setup
+
+BOOKS = 1000
+CHAPTERS_PER_BOOK = 5
+AUTHORS = 100
+BULK_ROWS = 500
+
+
+def per_call(func, number, repeat):
+    """Return the best time of a call in microseconds, like timeit."""
+    func()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6
+
+
+def populate():
+    from django.contrib.auth import get_user_model
+
+    from aldjemy_test.sample.models import Author, Book, Chapter
+
+    user = get_user_model().objects.create(username="benchmark")
+    books = Book.objects.bulk_create(Book(title="book %d" % i) for i in range(BOOKS))
+    Chapter.objects.bulk_create(
+        Chapter(title="chapter %d" % i, book=book)
+        for book in books
+        for i in range(CHAPTERS_PER_BOOK)
+    )
+    authors = Author.objects.bulk_create(
+        Author(name="author %d" % i, biography="", user=user) for i in range(AUTHORS)
+    )
+    Through = Author.books.through
+    Through.objects.bulk_create(
+        Through(author_id=author.pk, book_id=book.pk)
+        for i, author in enumerate(authors)
+        for book in books[i * 10 : i * 10 + 10]
+    )
+
+
+def get_cases():
+    """Return ``(name, aldjemy, django)`` callables of each case."""
+    from django.db import transaction
+    from django.db.models import Count
+    from sqlalchemy import func
+    from sqlalchemy.orm import joinedload
+
+    from aldjemy.session import get_session
+    from aldjemy_test.sample.models import Author, Book, Chapter
+
+    pk = Book.objects.order_by("pk")[BOOKS // 2].pk
+    first_pk = Book.objects.order_by("pk").first().pk
+    title = "book %d" % (BOOKS // 2)
+
+    def bulk(insert):
+        def run():
+            with transaction.atomic():
+                insert([{"title": "bulk %d" % i} for i in range(BULK_ROWS)])
+                transaction.set_rollback(True)
+
+        return run
+
+    def sa_request():
+        session = get_session(recreate=True)
+        session.query(Book.sa).filter(Book.sa.id == pk).one()
+        session.close()
+
+    return [
+        (
+            "pk_fetch",
+            lambda: Book.sa.query().filter(Book.sa.id == pk).one(),
+            lambda: Book.objects.get(pk=pk),
+        ),
+        (
+            "filtered_list",
+            lambda: (
+                Book.sa.query()
+                .filter(Book.sa.id.between(first_pk, first_pk + 99))
+                .all()
+            ),
+            lambda: list(Book.objects.filter(id__range=(first_pk, first_pk + 99))),
+        ),
+        (
+            "fk_join",
+            lambda: (
+                Chapter.sa.query()
+                .options(joinedload(Chapter.sa.book))
+                .order_by(Chapter.sa.id)
+                .limit(100)
+                .all()
+            ),
+            lambda: list(Chapter.objects.select_related("book").order_by("id")[:100]),
+        ),
+        (
+            "m2m_join",
+            lambda: (
+                Author.sa.query()
+                .join(Author.sa.books)
+                .filter(Book.sa.title == title)
+                .all()
+            ),
+            lambda: list(Author.objects.filter(books__title=title)),
+        ),
+        (
+            "aggregate",
+            lambda: (
+                Chapter.sa.query(Chapter.sa.book_id, func.count(Chapter.sa.id))
+                .group_by(Chapter.sa.book_id)
+                .all()
+            ),
+            lambda: list(Chapter.objects.values("book_id").annotate(count=Count("id"))),
+        ),
+        (
+            "bulk_insert",
+            bulk(Book.sa.bulk_insert),
+            bulk(lambda rows: Book.objects.bulk_create(Book(**row) for row in rows)),
+        ),
+        (
+            "request",
+            sa_request,
+            lambda: Book.objects.filter(pk=pk).get(),
+        ),
+    ]
+
+
+def compare(results, baseline):
+    previous = {(r["case"], r["implementation"]): r for r in baseline["results"]}
+    for result in results["results"]:
+        old = previous.get((result["case"], result["implementation"]))
+        if old is None:
+            continue
+        print(
+            "%-14s %-8s %10.1f us %10.1f us %6.2fx"
+            % (
+                result["case"],
+                result["implementation"],
+                old["us_per_call"],
+                result["us_per_call"],
+                result["us_per_call"] / old["us_per_call"],
+            ),
+            file=sys.stderr,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--case", action="append", help="run only these cases")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results of a previous run")
+    args = parser.parse_args()
+
+    setup()
+    import django
+    import sqlalchemy
+    from django.core.management import call_command
+    from django.db import connection
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    populate()
+
+    results = {
+        "database": connection.vendor,
+        "python": platform.python_version(),
+        "django": django.__version__,
+        "sqlalchemy": sqlalchemy.__version__,
+        "results": [],
+    }
+    for name, sa_func, django_func in get_cases():
+        if args.case and name not in args.case:
+            continue
+        for implementation, func in [("aldjemy", sa_func), ("django", django_func)]:
+            results["results"].append(
+                {
+                    "case": name,
+                    "implementation": implementation,
+                    "us_per_call": round(per_call(func, args.number, args.repeat), 2),
+                }
+            )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
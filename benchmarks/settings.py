@@ -0,0 +1,27 @@
+"""Settings of the test project, with the SQLite databases kept in memory."""
+
+import os
+
+from aldjemy_test.settings import *  # noqa: F401,F403
+from aldjemy_test.settings import DATABASES, INSTALLED_APPS
+
+DATABASES = {
+    **DATABASES,
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("BENCHMARK_SQLITE_NAME", ":memory:"),
+    },
+    "logs": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    },
+}
+
+if os.environ.get("BENCHMARK_POSTGRES"):
+    DATABASES["default"] = DATABASES["pg"]
+
+if os.environ.get("BENCHMARK_WITHOUT_ALDJEMY"):
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app != "aldjemy"]
+
+# Keep the result cache from adding work to every write
+ALDJEMY_RESULT_CACHE = None
@@ -0,0 +1,110 @@
+"""Measure the cost of executing a statement on SQLite through aldjemy.
+
+Each statement returns a column declared as ``datetime``, which goes through
+the sqlite3 converters that Django registers.
+It is measured with the types of ``aldjemy.sqlite``, which pass through the
+values those converters parsed, and with the proxy they replaced, swapping
+the global ``datetime`` converter around each execute, copied below as
+``SqliteWrapper``. Django's own cursor is measured for reference.
+"""
+
+import argparse
+import time
+from unittest import mock
+
+from . import setup
+
+STATEMENT = "SELECT '2020-01-02 03:04:05' AS \"value [datetime]\""
+
+
+class SqliteWrapper:
+    """The proxy before ``aldjemy.sqlite.configure_dialect``, as the baseline."""
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __getattr__(self, attr):
+        if attr in ["commit", "rollback"]:
+            return lambda *args, **kwargs: None
+        obj = getattr(self.obj, attr)
+        if attr not in ["cursor", "execute"]:
+            return obj
+        if attr == "cursor":
+            return type(self)(obj)
+        return self.wrapper(obj)
+
+    def wrapper(self, func):
+        from django.db.backends.sqlite3.base import Database
+
+        def null_converter(s):
+            if isinstance(s, bytes):
+                return s.decode("utf-8")
+            return s
+
+        def wrapper(*args, **kwargs):
+            converter = Database.converters.pop("DATETIME")
+            Database.register_converter("datetime", null_converter)
+            res = func(*args, **kwargs)
+            Database.register_converter("DATETIME", converter)
+            return res
+
+        return wrapper
+
+    def __call__(self, *args, **kwargs):
+        self.obj = self.obj(*args, **kwargs)
+        return self
+
+
+def per_call(func, number):
+    func()
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def measure(engine, statement, number):
+    """Return the time of an execute in microseconds."""
+    with engine.connect() as sa_connection:
+        return per_call(lambda: sa_connection.execute(statement).scalar(), number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection
+    from sqlalchemy import DateTime, text
+
+    from aldjemy import core
+
+    statement = text(STATEMENT).columns(value=DateTime)
+
+    def get_baseline(connection):
+        return SqliteWrapper(connection.connection)
+
+    # A separate engine, keeping the dialect's own types
+    with mock.patch.object(core, "configure_dialect", lambda dialect: None):
+        baseline_engine = core._create_engine("default")
+    with mock.patch.object(core, "get_wrapper", get_baseline):
+        baseline = measure(baseline_engine, statement, args.number)
+    sa_time = measure(core.get_engine(), statement, args.number)
+
+    with connection.cursor() as cursor:
+
+        def django_execute():
+            cursor.execute(STATEMENT)
+            cursor.fetchone()
+
+        django_time = per_call(django_execute, args.number)
+
+    print("%-20s %15s" % ("", "us per execute"))
+    print("%-20s %15.2f" % ("converter swap", baseline))
+    print("%-20s %15.2f" % ("aldjemy", sa_time))
+    print("%-20s %15.2f" % ("django", django_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare the startup cost of eager and lazy model construction.
+
+The eager path maps every model, like ``AldjemyConfig.ready()`` does by
+default. The lazy path only builds the registry, then maps the models that
+are actually accessed, given with ``--access``. The cached path maps every
+model from a warm ``ALDJEMY_METADATA_CACHE``, and the generated path imports
+the modules written by ``aldjemy_codegen``.
+"""
+
+import argparse
+import importlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from . import setup
+
+
+def timeit(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--access",
+        nargs="*",
+        default=["sample.Book"],
+        help="models accessed after a lazy startup, as app_label.ModelName",
+    )
+    args = parser.parse_args()
+
+    setup()
+    from django.apps import apps
+    from sqlalchemy import MetaData
+    from sqlalchemy.orm import configure_mappers
+
+    from aldjemy.codegen import generate_modules
+    from aldjemy.metadata_cache import load_metadata
+    from aldjemy.orm import LazyModels, construct_models
+
+    accessed = [apps.get_model(label) for label in args.access]
+
+    def eager():
+        construct_models(MetaData())
+        configure_mappers()
+
+    cache_dir = tempfile.mkdtemp()
+    load_metadata(cache_dir)
+
+    def cached():
+        metadata, plans = load_metadata(cache_dir)
+        construct_models(metadata, plans=plans)
+        configure_mappers()
+
+    generated_dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(generated_dir, "aldjemy_generated"))
+    for name, source in generate_modules().items():
+        with open(os.path.join(generated_dir, "aldjemy_generated", name), "w") as f:
+            f.write(source)
+    sys.path.insert(0, generated_dir)
+
+    def generated():
+        # Imported again each time, like at the start of a process
+        for name in ["", ".tables", ".models"]:
+            sys.modules.pop("aldjemy_generated" + name, None)
+        importlib.import_module("aldjemy_generated.models")
+        configure_mappers()
+
+    def lazy():
+        LazyModels(MetaData())
+
+    def lazy_access():
+        lazy_models = LazyModels(MetaData())
+        for model in accessed:
+            lazy_models.get(model)
+
+    print("models: %d" % len(apps.get_models(include_auto_created=True)))
+    for name, func in [
+        ("eager", eager),
+        ("eager, cached", cached),
+        ("generated", generated),
+        ("lazy", lazy),
+        ("lazy + access", lazy_access),
+    ]:
+        timings = timeit(func, args.repeat)
+        print(
+            "%-14s median %8.2f ms   min %8.2f ms"
+            % (name, statistics.median(timings) * 1000, min(timings) * 1000)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Measure how aldjemy's startup scales with synthetic projects.
+
+For each number of models given with ``--sizes``, a project is generated
+in a temporary directory, with apps of ``--models`` models each. Every model
+has ``--fks`` foreign keys and ``--m2m`` many to many fields to models of its
+own app and of the previous app. Each size runs in its own process, and the
+cost per model should stay flat as the size grows.
+
+aldjemy is not installed in the projects: ``django.setup()`` is timed
+without mapping the models, which ``aldjemy_profile`` measures apart.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODEL = """
+class M{index}(models.Model):
+    name = models.CharField(max_length=100)
+    value = models.IntegerField(default=0)
+{relations}
+"""
+
+SETTINGS = """
+SECRET_KEY = "not-a-secret"
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+INSTALLED_APPS = {installed_apps!r}
+DATABASES = {{"default": {{"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}}}}
+"""
+
+
+def generate(path, apps, models, fks, m2m):
+    """Write the synthetic project in ``path``, return its settings module."""
+    app_names = ["synthetic_%d" % a for a in range(apps)]
+    for a, app_name in enumerate(app_names):
+        os.makedirs(os.path.join(path, app_name))
+        with open(os.path.join(path, app_name, "__init__.py"), "w"):
+            pass
+        lines = ["from django.db import models\n"]
+        for m in range(models):
+            relations = []
+            targets = []
+            for i in range(fks + m2m):
+                # Alternate between models of this app and of the previous one
+                if i % 2 and a:
+                    targets.append("%s.M%d" % (app_names[a - 1], (m + i) % models))
+                else:
+                    targets.append("%s.M%d" % (app_name, (m + i) % models))
+            for i, target in enumerate(targets):
+                field = "fk%d" % i if i < fks else "m2m%d" % i
+                related_name = "%s_%s_m%d" % (field, app_name, m)
+                if i < fks:
+                    relations.append(
+                        "    %s = models.ForeignKey(%r, models.CASCADE, null=True, "
+                        "related_name=%r)" % (field, target, related_name)
+                    )
+                else:
+                    relations.append(
+                        "    %s = models.ManyToManyField(%r, related_name=%r)"
+                        % (field, target, related_name)
+                    )
+            lines.append(MODEL.format(index=m, relations="\n".join(relations)))
+        with open(os.path.join(path, app_name, "models.py"), "w") as f:
+            f.write("\n".join(lines))
+
+    with open(os.path.join(path, "synthetic_settings.py"), "w") as f:
+        f.write(SETTINGS.format(installed_apps=app_names))
+    return "synthetic_settings"
+
+
+def run(apps, models, fks, m2m):
+    """Generate a project, set up Django with it, profile aldjemy."""
+    with tempfile.TemporaryDirectory() as path:
+        sys.path.insert(0, path)
+        os.environ["DJANGO_SETTINGS_MODULE"] = generate(path, apps, models, fks, m2m)
+        import django
+
+        start = time.perf_counter()
+        django.setup()
+        setup_time = time.perf_counter() - start
+
+        from django.apps import apps as django_apps
+
+        from aldjemy.management.commands.aldjemy_profile import profile_startup
+
+        profile = profile_startup(memory=False)
+        count = len(django_apps.get_models(include_auto_created=True))
+        return {
+            "models": count,
+            "django_setup": setup_time,
+            "aldjemy": profile["totals"],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="*", default=[500, 1000, 2000])
+    parser.add_argument("--models", type=int, default=50, help="models per app")
+    parser.add_argument("--fks", type=int, default=2)
+    parser.add_argument("--m2m", type=int, default=1)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        apps = max(1, args.child // args.models)
+        result = run(apps, args.models, args.fks, args.m2m)
+        print(json.dumps(result))
+        return
+
+    print(
+        "%8s %8s %12s %12s %14s"
+        % ("size", "models", "django ms", "aldjemy ms", "aldjemy us/model")
+    )
+    for size in args.sizes:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.synthetic", "--child", str(size)]
+            + ["--models", str(args.models), "--fks", str(args.fks)]
+            + ["--m2m", str(args.m2m)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output)
+        aldjemy = sum(result["aldjemy"].values())
+        print(
+            "%8d %8d %12.1f %12.1f %14.1f"
+            % (
+                size,
+                result["models"],
+                result["django_setup"] * 1e3,
+                aldjemy * 1e3,
+                aldjemy / result["models"] * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()